@@ -1,15 +1,28 @@
 "use strict";
 (function(server_url) {
+
+    // origin codes of the chat.bin wire format, in server Origin order
+    const ORIGINS = ["DEFAULT", "SERVER", "USER", "SELF", "PRIVATE", "SESSION"];
+    // origin (uint8), sent at epoch ms (uint64), room sequence number (uint32), body length (uint32)
+    const HEADER_SIZE = 17;
+    // close codes of a dropped connection, the session can be resumed
+    const DROPPED_CODES = [1001, 1006];
+    // the server is restarting, its close reason holds how long to wait, e.g. "reconnect in 2350ms"
+    const SERVICE_RESTART = 1012;
+    // reconnect backoff in ms, doubling per failed attempt up to the maximum
+    const RECONNECT_BASE = 500;
+    const RECONNECT_MAX = 30000;
+    let attempts = 0;
+    const decoder = new TextDecoder();
+    let socket;
+    // resume token and sequence number of the last message received, kept for reconnects of this page
+    let token = null;
+    let last = 0;
     
     window.onload = function(){
-        const socket = new WebSocket(server_url);
         let input = $("input");
         input.focus()
-    
-        // message recieved
-        socket.addEventListener('message', function (event) {
-            message_recieved(event.data);
-        });
+        connect();
     
         // enter in box
         document.onkeypress = function(e){
@@ -23,6 +36,47 @@
             send_message(socket);
         });
     };
+
+    // Opens the connection, resuming the session of a dropped connection if there is one
+    function connect() {
+        // room is selected by the url hash, e.g. index.html#general
+        const room = window.location.hash.substring(1);
+        let url = server_url + "/" + encodeURIComponent(room);
+        if (token !== null) {
+            url += "?resume=" + encodeURIComponent(token) + "&last=" + last;
+        }
+        // prefer the compact binary format, otherwise opt in to batched frames,
+        // either way several messages may arrive in one frame
+        socket = new WebSocket(url, ["chat.bin", "chat.batch"]);
+        socket.binaryType = "arraybuffer";
+    
+        // message recieved
+        socket.addEventListener('message', function (event) {
+            message_recieved(event.data);
+        });
+
+        socket.addEventListener('open', function (event) {
+            attempts = 0;
+        });
+
+        socket.addEventListener('close', function (event) {
+            if (event.code == SERVICE_RESTART) {
+                // sessions don't survive a restart
+                token = null;
+                let hint = parseInt((event.reason.match(/\d+/) || [])[0]);
+                setTimeout(connect, isNaN(hint) ? reconnect_delay() : hint);
+            } else if (DROPPED_CODES.includes(event.code)) {
+                setTimeout(connect, reconnect_delay());
+            }
+        });
+    }
+
+    // Random delay up to an exponentially growing cap, so clients dropped together don't reconnect together
+    function reconnect_delay() {
+        let cap = Math.min(RECONNECT_MAX, RECONNECT_BASE * Math.pow(2, attempts));
+        attempts += 1;
+        return Math.random() * cap;
+    }
     
     function send_message(socket) {
         let outgoing = input.value;
@@ -34,17 +88,53 @@
     
     function message_recieved(message) {
         console.log(message);
-        let message_json = JSON.parse(message)
         let chatwindow = $("chatwindow");
+        let messages;
+        if (message instanceof ArrayBuffer) {
+            messages = decode_binary(message);
+        } else {
+            // batches (e.g. history replay) are sent as an array of messages
+            let message_json = JSON.parse(message);
+            messages = Array.isArray(message_json) ? message_json : [message_json];
+        }
+        let mine = messages.some(m => m.origin == "SELF");
     
         // scroll if we are at most recent or we sent the message
         let shouldScroll = scrollableBottomed(chatwindow) || mine;
-        chatwindow.appendChild(get_message(message_json.body, message_json.origin));
+        for (const m of messages) {
+            if (m.origin == "SESSION") {
+                // resume token, numbering restarts from its seq, e.g. after changing rooms
+                token = m.body;
+                last = m.seq;
+                continue;
+            }
+            if (m.seq) {
+                last = Math.max(last, m.seq);
+            }
+            chatwindow.appendChild(get_message(m.body, m.origin));
+        }
         if (shouldScroll){
             chatwindow.scrollTop = chatwindow.scrollHeight;
         }
     }
     
+    // Decodes a chat.bin frame of one or more concatenated records
+    function decode_binary(buffer) {
+        let view = new DataView(buffer);
+        let messages = [];
+        let offset = 0;
+        while (offset + HEADER_SIZE <= buffer.byteLength) {
+            let origin = ORIGINS[view.getUint8(offset)];
+            let sentAt = new Date(Number(view.getBigUint64(offset + 1)));
+            let seq = view.getUint32(offset + 9);
+            let length = view.getUint32(offset + 13);
+            let body = decoder.decode(new Uint8Array(buffer, offset + HEADER_SIZE, length));
+            messages.push({body: body, origin: origin, sentAt: sentAt.toLocaleString(), seq: seq});
+            offset += HEADER_SIZE + length;
+        }
+        return messages;
+    }
+
     // Returns true if a scrollable element is at the bottom
     function scrollableBottomed(scrollable) {
         if (scrollable.scrollTop >= (scrollable.scrollHeight - scrollable.offsetHeight)) {
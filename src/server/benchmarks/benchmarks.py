@@ -0,0 +1,341 @@
+"""
+benchmarks times the per-message hot paths of Response, CommandHandler and Chatroom.
+Timing follows timeit: each sample runs a calibrated number of loops with garbage collection disabled,
+and results are reported per call over several samples after a warmup.
+
+Run from this directory, e.g.
+    python benchmarks.py --output baseline.json
+    python benchmarks.py --compare baseline.json
+"""
+import argparse
+import asyncio
+import gc
+import itertools
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import time
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../server')))
+from chatroom import Chatroom
+from response import Response, Origin
+from user import User
+
+ROOM_SIZES = (10, 100, 1000)
+MESSAGE_LENGTHS = (16, 256, 4096)
+
+# name -> (function, parameter names), see benchmark()
+BENCHMARKS = {}
+
+
+def benchmark(*parameters):
+    """
+    Registers a benchmark. The decorated function takes the parameters named (room_size, message_length)
+    and returns a zero argument callable to time, a coroutine function for async code paths.
+
+    Args:
+        *parameters (str): parameters the benchmark is varied over
+    """
+    def decorator(func):
+        BENCHMARKS[func.__name__] = (func, parameters)
+        return func
+    return decorator
+
+
+class NullWebsocket:
+    """
+    Websocket that discards everything sent, so only server side work is timed
+    """
+    subprotocol = None
+    remote_address = None
+    open = True
+
+    async def send(self, message):
+        pass
+
+    async def close(self, code=1000, reason=""):
+        pass
+
+
+def create_chatroom(room_size, chat_config):
+    """
+    Creates a chatroom with room_size users in its default room.
+    Users are registered directly rather than through handle_connection,
+    which would send room_size squared connection notifications.
+
+    Args:
+        room_size (int): number of connected users
+        chat_config (str): path to chat.yaml
+
+    Returns:
+        Tuple[Chatroom, NullWebsocket]: chatroom and the websocket of one of its users, None if room_size is 0
+    """
+    chatroom = Chatroom(chat_config)
+    websocket = None
+    for index in range(room_size):
+        websocket = NullWebsocket()
+        name = f"user{index}"
+        user = User(websocket, name, chatroom.create_outbound_queue(websocket))
+        chatroom.connected[websocket] = user
+        chatroom._index_name(name, websocket)
+        user.room = chatroom.rooms.join(chatroom.rooms.default_room, websocket, user)
+    return chatroom, websocket
+
+
+def message(message_length):
+    return ("hello world " * (message_length // 12 + 1))[:message_length]
+
+
+@benchmark("message_length")
+def response_init(message_length, chat_config):
+    body = message(message_length)
+    return lambda: Response(body, Origin.USER)
+
+
+@benchmark("message_length")
+def response_json(message_length, chat_config):
+    body = message(message_length)
+    return lambda: Response(body, Origin.USER).json()
+
+
+@benchmark("message_length")
+def response_binary(message_length, chat_config):
+    body = message(message_length)
+    return lambda: Response(body, Origin.USER).binary()
+
+
+@benchmark("message_length")
+def is_command(message_length, chat_config):
+    chatroom, _ = create_chatroom(0, chat_config)
+    body = message(message_length)
+    return lambda: chatroom.command_handler.is_command(body)
+
+
+@benchmark("message_length")
+def parse_command(message_length, chat_config):
+    chatroom, _ = create_chatroom(0, chat_config)
+    command = "!pm someone " + message(message_length)
+    return lambda: chatroom.command_handler._parse_command(command)
+
+
+@benchmark("room_size")
+def handle_command(room_size, chat_config):
+    chatroom, websocket = create_chatroom(room_size, chat_config)
+    user = chatroom.connected[websocket]
+    return lambda: chatroom.command_handler.handle_command("!who", user, chatroom)
+
+
+@benchmark("room_size", "message_length")
+def handle_message(room_size, message_length, chat_config):
+    chatroom, websocket = create_chatroom(room_size, chat_config)
+    body = message(message_length)
+    return lambda: chatroom.handle_message(websocket, body)
+
+
+@benchmark("room_size", "message_length")
+def send_to_all(room_size, message_length, chat_config):
+    chatroom, websocket = create_chatroom(room_size, chat_config)
+    room = chatroom.connected[websocket].room
+    body = message(message_length)
+    return lambda: chatroom.send_to_all(Response(body, Origin.USER), websocket, room)
+
+
+@benchmark("room_size", "message_length")
+def send_to_all_sequential(room_size, message_length, chat_config):
+    # compared with send_to_all, which is concurrent with the test config, this is the cost of isolating sends
+    chatroom, websocket = create_chatroom(room_size, chat_config)
+    chatroom.concurrent_broadcast = False
+    room = chatroom.connected[websocket].room
+    body = message(message_length)
+    return lambda: chatroom.send_to_all(Response(body, Origin.USER), websocket, room)
+
+
+@benchmark("room_size")
+def change_name(room_size, chat_config):
+    chatroom, websocket = create_chatroom(room_size, chat_config)
+    names = itertools.cycle(["renamed_a", "renamed_b"])
+    return lambda: chatroom.change_name(websocket, next(names))
+
+
+@benchmark()
+def generate_name(chat_config):
+    chatroom, _ = create_chatroom(0, chat_config)
+    generator = chatroom.name_generator
+    # released like a disconnecting user's, so memory stays bounded however many loops run
+    return lambda: generator.release(generator.generate_name())
+
+
+def time_loops(func, loops, loop, is_async):
+    """
+    Args:
+        func (Callable): function to time
+        loops (int): number of calls
+        loop (asyncio.AbstractEventLoop): loop to run coroutines on
+        is_async (bool): whether func returns a coroutine to await
+
+    Returns:
+        float: seconds taken
+    """
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        if is_async:
+            async def run():
+                start = time.perf_counter()
+                for _ in range(loops):
+                    await func()
+                return time.perf_counter() - start
+            return loop.run_until_complete(run())
+
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        return time.perf_counter() - start
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+def measure(func, loop, min_time=0.1, repeat=7):
+    """
+    Calibrates loops so a sample takes at least min_time, then takes repeat samples after a warmup
+
+    Args:
+        func (Callable): function to time
+        loop (asyncio.AbstractEventLoop): loop to run coroutines on
+        min_time (float, optional): minimum seconds per sample. Defaults to 0.1.
+        repeat (int, optional): number of samples. Defaults to 7.
+
+    Returns:
+        dict: loops per sample, and mean, median, stdev and min microseconds per call
+    """
+    # lambdas wrapping coroutine functions aren't coroutine functions themselves, call once to find out
+    result = func()
+    is_async = asyncio.iscoroutine(result)
+    if is_async:
+        loop.run_until_complete(result)
+
+    loops = 1
+    while True:
+        elapsed = time_loops(func, loops, loop, is_async)
+        if elapsed >= min_time:
+            break
+        loops *= 10 if elapsed < min_time / 10 else 2
+
+    samples = [time_loops(func, loops, loop, is_async) / loops * 1e6 for _ in range(repeat)]
+    return {
+        "loops": loops,
+        "mean_us": round(statistics.mean(samples), 4),
+        "median_us": round(statistics.median(samples), 4),
+        "stdev_us": round(statistics.stdev(samples), 4) if len(samples) > 1 else 0.0,
+        "min_us": round(min(samples), 4)
+    }
+
+
+def cases(name, parameters):
+    """
+    Args:
+        name (str): benchmark name
+        parameters (Tuple[str]): parameters the benchmark is varied over
+
+    Yields:
+        Tuple[str, dict]: case name, e.g. "handle_message[room_size=10,message_length=16]", and its arguments
+    """
+    grids = {"room_size": ROOM_SIZES, "message_length": MESSAGE_LENGTHS}
+    for values in itertools.product(*[grids[parameter] for parameter in parameters]):
+        arguments = dict(zip(parameters, values))
+        label = ",".join(f"{key}={value}" for key, value in arguments.items())
+        yield (f"{name}[{label}]" if label else name), arguments
+
+
+def run(args):
+    """
+    Runs every benchmark matching args.filter
+
+    Args:
+        args (argparse.Namespace): parsed command line arguments
+
+    Returns:
+        dict: machine readable results
+    """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    results = {}
+    for name, (func, parameters) in BENCHMARKS.items():
+        for case, arguments in cases(name, parameters):
+            if args.filter and args.filter not in case:
+                continue
+            results[case] = measure(func(chat_config=args.chat_config, **arguments), loop, args.min_time, args.repeat)
+            print(f"{case:<60} {results[case]['median_us']:>12.3f} us +- {results[case]['stdev_us']:.3f}",
+                  file=sys.stderr)
+    loop.close()
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "chat_config": args.chat_config
+        },
+        "benchmarks": results
+    }
+
+
+def compare(baseline, current, threshold):
+    """
+    Compares median times against a baseline. A change counts only if it exceeds threshold
+    and the medians differ by more than both runs' combined standard deviation.
+
+    Args:
+        baseline (dict): results of an earlier run
+        current (dict): results of this run
+        threshold (float): relative change considered significant, e.g. 0.05
+
+    Returns:
+        Tuple[List[str], int]: report lines, and the number of significant slowdowns
+    """
+    lines = [f"{'benchmark':<60} {'baseline':>12} {'current':>12} {'change':>9}"]
+    regressions = 0
+    for case, result in current["benchmarks"].items():
+        old = baseline["benchmarks"].get(case)
+        if old is None:
+            lines.append(f"{case:<60} {'-':>12} {result['median_us']:>12.3f}       new")
+            continue
+        change = result["median_us"] / old["median_us"] - 1
+        noise = old["stdev_us"] + result["stdev_us"]
+        significant = abs(change) > threshold and abs(result["median_us"] - old["median_us"]) > noise
+        verdict = ("slower" if change > 0 else "faster") if significant else ""
+        regressions += verdict == "slower"
+        lines.append(f"{case:<60} {old['median_us']:>12.3f} {result['median_us']:>12.3f} {change:>+8.1%} {verdict}")
+    return lines, regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Chatroom hot path microbenchmarks")
+    parser.add_argument("--filter", help="only run cases whose name contains this")
+    parser.add_argument("--min-time", type=float, default=0.1, help="minimum seconds per sample")
+    parser.add_argument("--repeat", type=int, default=7, help="samples per case")
+    parser.add_argument("--chat-config", default="../config/test_config/chat.yaml")
+    parser.add_argument("--output", help="file to write JSON results to")
+    parser.add_argument("--compare", help="baseline JSON results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.05, help="relative change considered significant")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    logging.disable(logging.CRITICAL)
+    args = parse_args()
+    results = run(args)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(json.dumps(results, indent=4) + "\n")
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            lines, regressions = compare(json.load(baseline_file), results, args.threshold)
+        print("\n".join(lines))
+        sys.exit(1 if regressions else 0)
+    elif not args.output:
+        print(json.dumps(results, indent=4))
@@ -0,0 +1,340 @@
+"""
+loadtest starts the real Server and Chatroom in a child process, connects many websocket clients
+and measures broadcast fan-out latency, throughput, server CPU and memory per connection.
+
+Run from this directory, e.g.
+    python loadtest.py --clients 2000 --rooms 20 --senders 100 --rate 2 --duration 10 --output results.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import threading
+import time
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../server')))
+import websockets
+from chatroom import Chatroom
+from response import Response
+from server import Server
+
+logger = logging.getLogger(__name__)
+
+# marks load test messages, followed by the send time on the shared monotonic clock
+MARKER = "loadtest"
+
+
+def process_stats():
+    """
+    Returns:
+        dict: cpu_seconds (user + system) and rss_bytes of the current process
+    """
+    times = os.times()
+    try:
+        with open("/proc/self/statm") as statm:
+            rss_bytes = int(statm.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        # peak rather than current, kilobytes on linux
+        rss_bytes = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return {"cpu_seconds": times.user + times.system, "rss_bytes": rss_bytes}
+
+
+def raise_file_limit():
+    """
+    Raises the open file limit to the hard limit, every connection is a file descriptor on each side
+    """
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def run_server(server_config, chat_config, host, port, connection):
+    """
+    Child process entrypoint, serves until terminated and answers stats requests from the parent
+
+    Args:
+        server_config (str): path to server.yaml
+        chat_config (str): path to chat.yaml
+        host (str): address to bind
+        port (int): port to bind, 0 for any free port
+        connection (multiprocessing.connection.Connection): pipe to the parent
+    """
+    logging.disable(logging.WARNING)
+    raise_file_limit()
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    chatroom = Chatroom(chat_config)
+    server = Server(server_config, chatroom)
+    loop.run_until_complete(chatroom.handle_startup())
+    websocket_server = loop.run_until_complete(server.serve(host, port))
+    connection.send(websocket_server.sockets[0].getsockname()[1])
+
+    # stats are read from a thread so requests are answered even while the loop is saturated
+    def answer():
+        while connection.recv() is not None:
+            connection.send(process_stats())
+
+    threading.Thread(target=answer, daemon=True).start()
+    loop.run_forever()
+
+
+def percentile(ordered, fraction):
+    """
+    Args:
+        ordered (List[float]): sorted samples
+        fraction (float): percentile as a fraction, e.g. 0.99
+
+    Returns:
+        float: nearest rank percentile, 0 if there are no samples
+    """
+    if not ordered:
+        return 0.0
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+class LoadTest:
+    """
+    Drives load against a server: connects clients spread over rooms, has some of them send
+    at a fixed rate, and records the latency of every delivered copy of those messages
+    """
+
+    def __init__(self, url, clients, rooms, senders, rate, duration, connect_concurrency, subprotocols,
+                 server_stats=None):
+        """
+        Args:
+            url (str): server url, e.g. ws://127.0.0.1:8080
+            clients (int): number of connections
+            rooms (int): number of rooms clients are spread over
+            senders (int): number of clients that send messages
+            rate (float): messages per second per sender
+            duration (float): seconds to send for
+            connect_concurrency (int): connections opened at once
+            subprotocols (List[str]): subprotocols clients offer, e.g. chat.batch
+            server_stats (Callable[[], dict], optional): returns server process_stats(). Defaults to None.
+        """
+        self.url = url
+        self.clients = clients
+        self.rooms = rooms
+        self.senders = min(senders, clients)
+        self.rate = rate
+        self.duration = duration
+        self.connect_concurrency = connect_concurrency
+        self.subprotocols = subprotocols or None
+        self.server_stats = server_stats or dict
+
+        self.connections = []
+        self.connect_failures = 0
+        self.latencies = []
+        self.sent = 0
+        self.received = 0
+
+    async def connect(self):
+        """
+        Opens every connection, starting a reader for each
+
+        Returns:
+            float: seconds taken
+        """
+        start = time.monotonic()
+        for batch_start in range(0, self.clients, self.connect_concurrency):
+            batch = range(batch_start, min(batch_start + self.connect_concurrency, self.clients))
+            results = await asyncio.gather(*[
+                websockets.connect(f"{self.url}/room{index % self.rooms}", subprotocols=self.subprotocols,
+                                   max_queue=None, close_timeout=1)
+                for index in batch], return_exceptions=True)
+            for result in results:
+                if isinstance(result, Exception):
+                    self.connect_failures += 1
+                else:
+                    self.connections.append((result, asyncio.ensure_future(self.read(result))))
+        return time.monotonic() - start
+
+    async def read(self, websocket):
+        """
+        Reads frames until the connection closes, recording the latency of load test messages
+
+        Args:
+            websocket (WebSocketClientProtocol): client connection
+        """
+        try:
+            async for frame in websocket:
+                now = time.monotonic()
+                if isinstance(frame, bytes):
+                    # chat.bin, a record or a batch of records
+                    bodies = [response.body for response in Response.from_binary(frame)]
+                else:
+                    decoded = json.loads(frame)
+                    bodies = [message["body"] for message in (decoded if isinstance(decoded, list) else [decoded])]
+                for text in bodies:
+                    # bodies are "<name>: loadtest <sent at>", skip notifications
+                    _, _, body = text.partition(": ")
+                    if body.startswith(MARKER):
+                        self.latencies.append(now - float(body[len(MARKER) + 1:]))
+                        self.received += 1
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+    async def send(self, websocket, deadline):
+        """
+        Sends load test messages at the configured rate until deadline
+
+        Args:
+            websocket (WebSocketClientProtocol): sending connection
+            deadline (float): monotonic time to stop at
+        """
+        interval = 1 / self.rate
+        # spread senders over the interval instead of sending in lockstep
+        await asyncio.sleep(random.uniform(0, interval))
+        next_send = time.monotonic()
+        while next_send < deadline:
+            try:
+                await websocket.send(f"{MARKER} {time.monotonic()}")
+            except websockets.exceptions.ConnectionClosed:
+                return
+            self.sent += 1
+            next_send += interval
+            await asyncio.sleep(max(next_send - time.monotonic(), 0))
+
+    async def run(self, drain=2.0):
+        """
+        Connects, sends for the configured duration, waits for deliveries to drain and disconnects
+
+        Args:
+            drain (float, optional): seconds to wait for deliveries after sending stops. Defaults to 2.0.
+
+        Returns:
+            dict: connection, message and server results
+        """
+        baseline = self.server_stats()
+        connect_seconds = await self.connect()
+
+        # let connection notifications settle so they don't count against the send phase,
+        # and so memory is measured with every connection idle
+        await asyncio.sleep(min(1.0, drain))
+        connected = self.server_stats()
+        self.latencies.clear()
+        self.received = 0
+
+        start_stats = self.server_stats()
+        client_start = process_stats()
+        start = time.monotonic()
+        deadline = start + self.duration
+        await asyncio.gather(*[self.send(websocket, deadline) for websocket, _ in self.connections[:self.senders]])
+        await asyncio.sleep(drain)
+        elapsed = time.monotonic() - start
+        end_stats = self.server_stats()
+        client_cpu_seconds = process_stats()["cpu_seconds"] - client_start["cpu_seconds"]
+
+        await asyncio.gather(*[websocket.close() for websocket, _ in self.connections], return_exceptions=True)
+        await asyncio.gather(*[reader for _, reader in self.connections], return_exceptions=True)
+
+        ordered = sorted(self.latencies)
+        opened = len(self.connections)
+        cpu_seconds = end_stats.get("cpu_seconds", 0.0) - start_stats.get("cpu_seconds", 0.0)
+        rss_growth = connected.get("rss_bytes", 0) - baseline.get("rss_bytes", 0)
+        return {
+            "connections": {
+                "opened": len(self.connections),
+                "failed": self.connect_failures,
+                "seconds": round(connect_seconds, 3),
+                "per_second": round(len(self.connections) / connect_seconds, 1) if connect_seconds else 0.0
+            },
+            "messages": {
+                "sent": self.sent,
+                "delivered": self.received,
+                "sent_per_second": round(self.sent / self.duration, 1),
+                "delivered_per_second": round(self.received / elapsed, 1)
+            },
+            "latency_ms": {
+                "p50": round(percentile(ordered, 0.50) * 1000, 3),
+                "p95": round(percentile(ordered, 0.95) * 1000, 3),
+                "p99": round(percentile(ordered, 0.99) * 1000, 3),
+                "max": round(ordered[-1] * 1000, 3) if ordered else 0.0,
+                "mean": round(sum(ordered) / len(ordered) * 1000, 3) if ordered else 0.0
+            },
+            "server": {
+                "cpu_seconds": round(cpu_seconds, 3),
+                "cpu_percent": round(cpu_seconds / elapsed * 100, 1),
+                "rss_bytes_baseline": baseline.get("rss_bytes", 0),
+                "rss_bytes_connected": connected.get("rss_bytes", 0),
+                "rss_bytes_per_connection": round(rss_growth / opened) if opened else 0
+            },
+            # the load generator is a single process, near 100% means it limits the results rather than the server
+            "client": {
+                "cpu_percent": round(client_cpu_seconds / elapsed * 100, 1)
+            }
+        }
+
+
+def run(args):
+    """
+    Runs a load test against a freshly started server process
+
+    Args:
+        args (argparse.Namespace): parsed command line arguments
+
+    Returns:
+        dict: machine readable results
+    """
+    raise_file_limit()
+    parent, child = multiprocessing.get_context("fork").Pipe()
+    process = multiprocessing.get_context("fork").Process(
+        target=run_server, args=(args.server_config, args.chat_config, args.host, args.port, child), daemon=True)
+    process.start()
+
+    def server_stats():
+        parent.send(True)
+        return parent.recv()
+
+    try:
+        port = parent.recv()
+        load_test = LoadTest(f"ws://{args.host}:{port}", args.clients, args.rooms, args.senders, args.rate,
+                             args.duration, args.connect_concurrency, args.subprotocol, server_stats)
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        results = loop.run_until_complete(load_test.run(args.drain))
+        loop.close()
+    finally:
+        parent.send(None)
+        process.terminate()
+        process.join()
+
+    results["config"] = {
+        "clients": args.clients, "rooms": args.rooms, "senders": args.senders, "rate": args.rate,
+        "duration": args.duration, "subprotocol": args.subprotocol, "server_config": args.server_config,
+        "chat_config": args.chat_config
+    }
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Websocket chatroom load test")
+    parser.add_argument("--clients", type=int, default=1000, help="number of connections")
+    parser.add_argument("--rooms", type=int, default=10, help="rooms the clients are spread over")
+    parser.add_argument("--senders", type=int, default=50, help="clients that send messages")
+    parser.add_argument("--rate", type=float, default=1.0, help="messages per second per sender")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds to send for")
+    parser.add_argument("--drain", type=float, default=2.0, help="seconds to wait for deliveries after sending")
+    parser.add_argument("--connect-concurrency", type=int, default=100, help="connections opened at once")
+    parser.add_argument("--subprotocol", action="append", default=[], help="subprotocol clients offer, repeatable")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=0, help="server port, 0 for any free port")
+    parser.add_argument("--server-config", default="../config/test_config/server.yaml")
+    parser.add_argument("--chat-config", default="../config/test_config/chat.yaml")
+    parser.add_argument("--output", help="file to write JSON results to, printed if omitted")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    args = parse_args()
+    results = json.dumps(run(args), indent=4)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(results + "\n")
+    print(results)
@@ -0,0 +1,275 @@
+"""
+bus relays chatroom events between server nodes so a room behaves as one room across processes
+"""
+import asyncio
+import json
+import logging
+import struct
+from uuid import uuid4
+from utils import log_message
+
+logger = logging.getLogger(__name__)
+
+# frames on the broker socket are a 4 byte big endian length followed by a utf-8 JSON event
+FRAME_HEADER = struct.Struct("!I")
+
+
+class Bus:
+    """
+    Base broadcast bus, events published by a node are delivered to every other node's subscriber.
+    Nodes deliver their own events locally, a bus never echoes an event back to its publisher.
+    """
+    # whether other nodes, e.g. in other processes, may share rooms with this one
+    shared = False
+
+    @property
+    def has_peers(self):
+        """
+        Returns:
+            bool: whether published events may currently reach another node
+        """
+        return True
+
+    def __init__(self):
+        """
+        Create a new bus node with a random node id
+        """
+        self.node_id = uuid4().hex[:12]
+        self._subscriber = None
+
+    def subscribe(self, callback):
+        """
+        Sets the callback for events published by other nodes
+
+        Args:
+            callback (Callable[[dict], Awaitable]): async event handler
+        """
+        self._subscriber = callback
+
+    async def start(self):
+        """
+        Connects the node to the bus
+        """
+
+    async def stop(self):
+        """
+        Disconnects the node from the bus
+        """
+
+    async def publish(self, event):
+        """
+        Publishes an event to every other node, the node id is added to the event
+
+        Args:
+            event (dict): JSON serializable event with a "type" key
+        """
+        raise NotImplementedError
+
+    async def _deliver(self, event):
+        if self._subscriber is None:
+            return
+        try:
+            await self._subscriber(event)
+        except Exception as e:
+            log_message(logger, f"Bus subscriber failed on {event.get('type')} event: {repr(e)}", logging.ERROR)
+
+
+class LocalBus(Bus):
+    """
+    In-process bus, nodes sharing a hub list deliver to each other directly.
+    A LocalBus without other nodes on its hub is a single node deployment and publishing is free.
+    """
+
+    def __init__(self, hub=None):
+        """
+        Create a new in-process bus node
+
+        Args:
+            hub (list, optional): shared list of LocalBus nodes. Defaults to None (a private hub).
+        """
+        super().__init__()
+        self.hub = hub if hub is not None else []
+        self.shared = hub is not None
+
+    async def start(self):
+        self.hub.append(self)
+        await self.publish({"type": "hello"})
+
+    async def stop(self):
+        if self in self.hub:
+            self.hub.remove(self)
+            for node in self.hub:
+                await node._deliver({"type": "node_down", "node": self.node_id})
+
+    @property
+    def has_peers(self):
+        return len(self.hub) > 1
+
+    async def publish(self, event):
+        if not self.has_peers:
+            return
+        event["node"] = self.node_id
+        for node in list(self.hub):
+            if node is not self:
+                await node._deliver(event)
+
+
+class BrokerBus(Bus):
+    """
+    Multi-process bus, connects to a Broker over a unix domain socket
+    """
+    shared = True
+
+    def __init__(self, path):
+        """
+        Create a new broker bus node, call start() to connect
+
+        Args:
+            path (str): broker unix socket path
+        """
+        super().__init__()
+        self.path = path
+        self._reader = None
+        self._writer = None
+        self._read_task = None
+
+    async def start(self):
+        self._reader, self._writer = await asyncio.open_unix_connection(self.path)
+        self._read_task = asyncio.ensure_future(self._read_loop())
+        log_message(logger, f"Bus node {self.node_id} connected to broker at {self.path}", logging.INFO)
+        await self.publish({"type": "hello"})
+
+    async def stop(self):
+        if self._read_task is not None:
+            self._read_task.cancel()
+            try:
+                await self._read_task
+            except asyncio.CancelledError:
+                pass
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    async def publish(self, event):
+        if self._writer is None:
+            return
+        event["node"] = self.node_id
+        self._writer.write(encode_frame(event))
+        await self._writer.drain()
+
+    async def _read_loop(self):
+        try:
+            while True:
+                event = await read_frame(self._reader)
+                if event is None:
+                    log_message(logger, f"Bus node {self.node_id} lost its broker connection", logging.ERROR)
+                    return
+                await self._deliver(event)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log_message(logger, f"Bus node {self.node_id} read failed: {repr(e)}", logging.ERROR)
+
+
+class Broker:
+    """
+    Relays frames between BrokerBus nodes over a unix domain socket.
+    Each frame is forwarded to every node except the one that sent it.
+    """
+
+    def __init__(self, path):
+        """
+        Create a new broker, call start() to listen
+
+        Args:
+            path (str): unix socket path to listen on
+        """
+        self.path = path
+
+        # Dict[asyncio.StreamWriter, str], node connection -> node id, once known
+        self.nodes = dict()
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_unix_server(self._handle_node, self.path)
+        log_message(logger, f"Broker listening on {self.path}", logging.INFO)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        for writer in list(self.nodes):
+            writer.close()
+
+    async def _handle_node(self, reader, writer):
+        self.nodes[writer] = None
+        try:
+            while True:
+                header = await reader.readexactly(FRAME_HEADER.size)
+                body = await reader.readexactly(FRAME_HEADER.unpack(header)[0])
+                if self.nodes[writer] is None:
+                    self.nodes[writer] = json.loads(body)["node"]
+                self._relay(header + body, writer)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            node_id = self.nodes.pop(writer, None)
+            writer.close()
+            if node_id is not None:
+                log_message(logger, f"Broker lost node {node_id}", logging.WARNING)
+                self._relay(encode_frame({"type": "node_down", "node": node_id}), None)
+
+    def _relay(self, frame, sender):
+        for writer in self.nodes:
+            if writer is not sender:
+                writer.write(frame)
+
+
+def encode_frame(event):
+    """
+    Encodes an event as a length prefixed broker frame
+
+    Args:
+        event (dict): JSON serializable event
+
+    Returns:
+        bytes: frame
+    """
+    body = json.dumps(event).encode("utf-8")
+    return FRAME_HEADER.pack(len(body)) + body
+
+
+async def read_frame(reader):
+    """
+    Reads one length prefixed broker frame
+
+    Args:
+        reader (asyncio.StreamReader): stream to read from
+
+    Returns:
+        dict: decoded event, or None if the stream ended
+    """
+    try:
+        header = await reader.readexactly(FRAME_HEADER.size)
+        body = await reader.readexactly(FRAME_HEADER.unpack(header)[0])
+    except asyncio.IncompleteReadError:
+        return None
+    return json.loads(body)
+
+
+def create_bus(bus_config):
+    """
+    Creates a bus from the chat.yaml bus section
+
+    Args:
+        bus_config (dict): bus config, {"backend": "local" | "broker", "path": broker socket path}
+
+    Returns:
+        Bus: configured bus
+    """
+    backend = bus_config.get("backend", "local")
+    if backend == "local":
+        return LocalBus()
+    if backend == "broker":
+        return BrokerBus(bus_config["path"])
+    raise ValueError(f"Unknown bus backend {backend}")
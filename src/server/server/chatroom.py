@@ -1,18 +1,44 @@
 """
 Chatroom defines handlers for client behavior such as connecting and sending messages
 """
+import os
 import random
+import asyncio
 import logging
-from string import Template
+import math
+import time
+from collections import deque
 from collections.abc import Iterable
-from utils import log, log_message
+from utils import log, log_message, start_eagerly
 from user import User
 from command_handler import CommandHandler
 from config_manager import ConfigManager
-from response import Response, Origin
+from response import Response, Origin, Subprotocol
+from outbound_queue import OutboundQueue, SlowConsumerPolicy
+from room import RoomRegistry
+from session import SessionRegistry, PARKED_CLOSE_CODES, resume_request
+from bus import create_bus
+from presence import RemotePresence
+from message_log import MessageLog
+from templates import CompiledTemplate
+from metrics import REGISTRY
 
 logger = logging.getLogger(__name__)
 
+MESSAGES_RECEIVED = REGISTRY.counter("chat_messages_received_total", "Messages received from clients, including commands")
+MESSAGES_SENT = REGISTRY.counter("chat_messages_sent_total", "Payloads sent or queued to clients")
+BROADCAST_DURATION = REGISTRY.histogram("chat_broadcast_duration_seconds", "Time to fan a broadcast out locally")
+BROADCAST_RECIPIENTS = REGISTRY.histogram("chat_broadcast_recipients", "Local recipients per broadcast",
+                                          buckets=(1, 10, 100, 1000, 10000, 100000))
+SHUTDOWN_ABORTED = REGISTRY.counter("chat_shutdown_aborted_total", "Connections aborted at the shutdown deadline")
+SESSION_EVENTS = REGISTRY.counter("chat_sessions_total", "Sessions parked, resumed and expired", labels=("event",))
+
+# subprotocols whose framing allows several responses per frame
+BATCHING_SUBPROTOCOLS = (Subprotocol.BATCH.value, Subprotocol.BINARY.value)
+
+# close code telling clients the server is restarting and they should reconnect, the reason holds a delay
+SERVICE_RESTART = 1012
+
 
 class Chatroom:
     """
@@ -29,32 +55,223 @@ class Chatroom:
 
         # Dict[Websocket, User]
         self.connected = dict()
-        self.command_handler = CommandHandler()
+
+        # Dict[str, Dict[Websocket, None]], name -> ordered set of websockets using that name
+        self.names = dict()
+
+        # cached "!who" listing, rebuilt only after membership or names change
+        self._who_cache = None
+
         self.config = ConfigManager(chat_config_path)
+        # commands run on the connection's read loop, a timeout bounds how long one can hold it
+        self.command_handler = CommandHandler(timeout=self.config.get("commands", {}).get("timeout", None))
         self.name_generator = AdjAnimalNameGenerator(
             self.config["name_generator"]["adjective_path"],
             self.config["name_generator"]["animal_path"])
         self.env = self.config["meta"]["enviornment"]
+        self.unique_names = self.config.get("unique_names", False)
+
+        # templates are validated and compiled up front, a malformed template fails here instead of on first use
+        self.templates = {
+            key: CompiledTemplate(self.config[key], identifiers, key) for key, identifiers in [
+                ("greeting_temp", ["name"]),
+                ("conn_notif_temp", ["name"]),
+                ("disconn_notif_temp", ["name"]),
+                ("namechange_notif_temp", ["old", "new"]),
+                ("room_greeting_temp", ["room"]),
+                ("room_join_notif_temp", ["name", "room"]),
+                ("room_leave_notif_temp", ["name", "room"]),
+                ("private_messate_from_temp", ["from_name", "message"]),
+                ("private_message_to_temp", ["to_name", "message"]),
+            ]}
+
+        # constant notifications are encoded once, only the timestamp is renewed per send
+        self.shutdown_response = Response(self.config["shutdown_notif_temp"], Origin.SERVER)
+        self.shutdown_response.json()
+
+        # on shutdown clients are told to reconnect after a random delay in this window, spreading their reconnects
+        reconnect_config = self.config.get("reconnect", {})
+        self.reconnect_delay = (reconnect_config.get("min_delay", 1.0), reconnect_config.get("max_delay", 10.0))
+        self.draining = False
+
+        # broadcast fan-out settings, sequential with no timeout if not configured
+        broadcast_config = self.config.get("broadcast", {})
+        self.concurrent_broadcast = broadcast_config.get("concurrent", False)
+        self.send_timeout = broadcast_config.get("send_timeout", None)
+
+        # per connection outbound queues, sends are written inline if not enabled
+        queue_config = self.config.get("outbound_queue", {})
+        self.queue_enabled = queue_config.get("enabled", False)
+        self.queue_max_size = queue_config.get("max_size", 256)
+        self.queue_policy = SlowConsumerPolicy(queue_config.get("policy", SlowConsumerPolicy.DROP_OLDEST.value))
+
+        # frame coalescing for clients that opt in with the batch subprotocol, requires outbound queues
+        batching_config = self.config.get("batching", {})
+        self.batching_enabled = batching_config.get("enabled", False)
+        self.batch_interval = batching_config.get("flush_interval", 0.01)
+        self.batch_bytes = batching_config.get("max_bytes", 16384)
+        if self.batching_enabled and not self.queue_enabled:
+            log_message(logger, "batching requires outbound_queue to be enabled, frames will not be coalesced",
+                        logging.WARNING)
+
+        # rooms are keyed by websocket path, created on first join and evicted once idle
+        rooms_config = self.config.get("rooms", {})
+        history_config = self.config.get("history", {})
+        self.history_replay = history_config.get("replay", 0)
+        self.rooms = RoomRegistry(
+            rooms_config.get("default", "lobby"), rooms_config.get("idle_timeout", 300),
+            history_size=history_config.get("size", 0), history_bytes=history_config.get("max_bytes"))
+
+        # broadcasts, private messages and presence are relayed to other server nodes over the bus
+        self.remote = RemotePresence()
+        self.bus = None
+        self.attach_bus(create_bus(self.config.get("bus", {})))
+
+        # dropped connections are parked for a grace window and can resume with their token
+        sessions_config = self.config.get("sessions", {})
+        self.sessions = None
+        if sessions_config.get("enabled", False):
+            self.sessions = SessionRegistry(sessions_config.get("grace", 30), self._expire_session)
+
+        # optional durable message log, opened in handle_startup so it is created after any worker fork
+        self.persistence_config = self.config.get("persistence", {})
+        self.message_log = None
+
+        # computed when scraped, the most recently created chatroom is reported
+        REGISTRY.gauge("chat_connections", "Connected websockets", function=lambda: len(self.connected))
+        REGISTRY.gauge("chat_rooms", "Rooms with members or history", function=lambda: len(self.rooms))
+        REGISTRY.gauge("chat_send_queue_depth_max", "Deepest per-connection send queue",
+                       function=lambda: max([user.queue_depth for user in self.connected.values()], default=0))
+        REGISTRY.gauge("chat_send_queue_depth_total", "Payloads waiting in all send queues",
+                       function=lambda: sum(user.queue_depth for user in self.connected.values()))
+        REGISTRY.gauge("chat_send_queue_dropped", "Payloads dropped by slow consumer policies of connected users",
+                       function=lambda: sum(user.dropped for user in self.connected.values()))
+        REGISTRY.gauge("chat_sessions_parked", "Dropped users waiting to resume",
+                       function=lambda: len(self.sessions) if self.sessions is not None else 0)
+
+    def attach_bus(self, bus):
+        """
+        Replaces the bus used to reach other server nodes, must be called before handle_startup
+
+        Args:
+            bus (Bus): bus node for this chatroom
+        """
+        self.bus = bus
+        self.bus.subscribe(self.handle_bus_event)
 
     @log(logger, logging.INFO)
-    async def handle_connection(self, websocket, name=None):
+    async def handle_startup(self, worker=None, workers=1):
         """
-        Registers a new websocket connection and notifies users
+        Connects to the bus and opens the message log, called by the server before it accepts connections
+
+        Args:
+            worker (int, optional): worker index when running under a supervisor. Defaults to None.
+            workers (int, optional): number of workers under the supervisor. Defaults to 1.
+        """
+        if worker is not None:
+            # workers are forked with copies of the same generator, each takes its own share of the names
+            self.name_generator.partition(worker, workers)
+        if self.sessions is not None and self.bus.shared:
+            # parked sessions live in this process, a reconnect reaching another node could not resume
+            log_message(logger, "Session resume requires a single node, disabled with a shared bus", logging.WARNING)
+            self.sessions = None
+        if self.persistence_config.get("enabled", False):
+            directory = self.persistence_config["directory"]
+            if worker is not None:
+                directory = os.path.join(directory, f"worker-{worker}")
+            self.message_log = MessageLog(
+                directory,
+                segment_bytes=self.persistence_config.get("segment_bytes", 16 * 2**20),
+                retention_bytes=self.persistence_config.get("retention_bytes", 2**30),
+                retention_seconds=self.persistence_config.get("retention_seconds", 7 * 24 * 3600),
+                commit_interval=self.persistence_config.get("commit_interval", 0.0))
+        await self.bus.start()
+
+    @log(logger, logging.INFO, redact=("path",))
+    async def handle_connection(self, websocket, name=None, path=None):
+        """
+        Registers a new websocket connection, joins it to the room for its path and notifies the room.
+        A connection presenting a valid resume token in its path instead silently resumes its user, see _resume.
 
         Args:
             websocket (Websocket): new connection websocket
+            name (str, optional): name for the new user. Defaults to None (generated).
+            path (str, optional): websocket request path, e.g. "/general". Defaults to None (default room).
         """
-        name = name if name is not None else self.generate_name()
-        user = User(websocket, name)
+        if self.draining:
+            # accepted just before the server stopped listening
+            await websocket.close(SERVICE_RESTART, self._reconnect_hint())
+            return
+
+        if self.sessions is not None:
+            token, last = resume_request(path)
+            user = self.sessions.resume(token) if token is not None else None
+            if user is not None:
+                await self._resume(user, websocket, last)
+                return
+
+        if name is None or (self.unique_names and self.is_name_taken(name)):
+            name = self.generate_name()
+        binary = getattr(websocket, "subprotocol", None) == Subprotocol.BINARY.value
+        user = User(websocket, name, self.create_outbound_queue(websocket), binary)
         self.connected[websocket] = user
+        self._index_name(name, websocket)
+        await self._join_room(self.rooms.room_name(path), websocket, user)
+        await self.bus.publish({"type": "join", "name": name, "room": user.room.name})
         await self.send(Response(self.get_greeting(name), Origin.SERVER), websocket)
-        await self.send_to_all(Response(self.get_connection_notification(name), Origin.SERVER), websocket)
+        if self.sessions is not None:
+            self.sessions.issue(user)
+            await self._send_session(user)
+        await self.send_batch(user.room.history.recent(self.history_replay, binary), websocket)
+        await self.send_to_all(Response(self.get_connection_notification(name), Origin.SERVER), websocket, user.room)
 
-    @log(logger, logging.INFO)
+    async def _resume(self, user, websocket, last):
+        """
+        Moves a parked, or still connected, user to a new connection without notifying anyone,
+        sending only the messages of their room after the last one they received if they are still kept
+
+        Args:
+            user (User): user returned by the session registry
+            websocket (Websocket): new connection websocket
+            last (int): sequence number of the last message the client received
+        """
+        if user.websocket in self.connected:
+            # the client reconnected before its old connection was noticed to drop
+            old_websocket = user.websocket
+            await self._detach(old_websocket)
+            asyncio.ensure_future(old_websocket.close())
+
+        previous_room = user.room
+        user.websocket = websocket
+        user.binary = getattr(websocket, "subprotocol", None) == Subprotocol.BINARY.value
+        user.outbound = self.create_outbound_queue(websocket)
+        self.connected[websocket] = user
+        self._index_name(user.name, websocket)
+        await self._join_room(previous_room.name, websocket, user)
+        SESSION_EVENTS.labels("resumed").inc()
+
+        await self._send_session(user)
+        # sequence numbers restart if the room was evicted and created again while the user was parked
+        if user.room is previous_room and last <= user.room.seq:
+            await self.send_batch(user.room.history.since(last, user.binary), websocket)
+        else:
+            await self.send_batch(user.room.history.recent(self.history_replay, user.binary), websocket)
+
+    async def _send_session(self, user):
+        """
+        Sends the user's resume token with the sequence number of their room's last message,
+        the client resumes after it unless it receives later messages
+
+        Args:
+            user (User): user with a resume token
+        """
+        await self.send(Response(user.token, Origin.SESSION, user.room.seq), user.websocket)
+
+    @log(logger, hot_path=True)
     async def handle_message(self, websocket, message):
         """
         Handles incoming message:
-            If it is a message, send to all users.
+            If it is a message, send to all users in the sender's room.
             If it is a command, process it
 
         Args:
@@ -62,29 +279,87 @@ class Chatroom:
             message (str): message sent
         """
 
+        MESSAGES_RECEIVED.inc()
         user = self.connected[websocket]
         if self.command_handler.is_command(message):
             await self.command_handler.handle_command(message, user, self)
             return
 
         body = f"{user.name}: {message}"
-        all_response = Response(body, Origin.USER)
-        sender_response = Response(body, Origin.SELF)
-        await self.send_to_all(all_response, websocket)
+        all_response = Response(body, Origin.USER, user.room.next_seq())
+        sender_response = all_response.with_origin(Origin.SELF)
+        user.room.history.append(all_response)
+        if self.message_log is not None:
+            self.message_log.append(user.room.name, all_response.json())
+        await self.send_to_all(all_response, websocket, user.room)
         await self.send(sender_response, websocket)
 
     @log(logger, logging.INFO)
     async def handle_disconnect(self, websocket):
         """
-        handles disconnect of websocket and notifies all connections
+        handles disconnect of websocket and notifies its room.
+        If the connection dropped rather than closed, the user is parked instead and only announced as left
+        if they don't resume in time.
 
         Args:
             websocket (Websocket): Connection that was closed
         """
-        user = self.connected.pop(websocket)
-        await self.send_to_all(Response(self.get_disconnect_notification(user.name), Origin.SERVER))
+        user = await self._detach(websocket)
+        if user is None or self.draining:
+            # the user already resumed on another connection, or everyone is leaving
+            return
+
+        if self.sessions is not None and user.token is not None:
+            if getattr(websocket, "close_code", None) in PARKED_CLOSE_CODES:
+                self.sessions.park(user)
+                SESSION_EVENTS.labels("parked").inc()
+                return
+            self.sessions.discard(user)
+        await self._announce_leave(user)
+
+    async def _detach(self, websocket):
+        """
+        Removes a connection from the chatroom and its room, without notifying anyone
 
-    @log(logger, logging.INFO)
+        Args:
+            websocket (Websocket): connection to remove
+
+        Returns:
+            User: user of the connection, or None if it was already removed
+        """
+        user = self.connected.pop(websocket, None)
+        if user is None:
+            return None
+        self._unindex_name(user.name, websocket)
+        self.rooms.leave(user.room, websocket)
+        if user.outbound is not None:
+            await user.outbound.stop()
+        return user
+
+    async def _announce_leave(self, user):
+        """
+        Releases a departed user's name and tells their room and other server nodes they left
+
+        Args:
+            user (User): user who left, already detached
+        """
+        self._release_name(user.name)
+        await self.bus.publish({"type": "leave", "name": user.name})
+        # a parked user's room may have been evicted and created again since
+        room = self.rooms.get(user.room.name) or user.room
+        await self.send_to_all(Response(self.get_disconnect_notification(user.name), Origin.SERVER), room=room)
+
+    async def _expire_session(self, user):
+        """
+        Announces a parked user as left once their grace window ends without a resume
+
+        Args:
+            user (User): expired user
+        """
+        SESSION_EVENTS.labels("expired").inc()
+        await self._announce_leave(user)
+
+    @log(logger, hot_path=True)
     async def send(self, response, websocket):
         """Send a response to a websocket
 
@@ -93,38 +368,185 @@ class Chatroom:
             websocket (Websocket): The websocket to send the Response to
         """
         if not isinstance(response, Response):
-            log_message(f"Outgoing: {response} is not of type Response, preventing send", logging.CRITICAL)
+            log_message(logger, f"Outgoing: {response} is not of type Response, preventing send", logging.CRITICAL)
             return
 
-        if response.data["origin"] == Origin.DEFAULT:
-            log_message(f"Outgoing response has DEFAULT origin", logging.WARNING)
+        if response.origin == Origin.DEFAULT.value:
+            log_message(logger, f"Outgoing response has DEFAULT origin", logging.WARNING)
 
-        await websocket.send(response.json())
+        # encodings are cached, so a response sent to many websockets is only encoded once per format
+        user = self.connected.get(websocket)
+        payload = response.binary() if user is not None and user.binary else response.json()
+        await self._send_payload(payload, response.origin, websocket, user)
 
-    @log(logger, logging.INFO)
-    async def send_to_all(self, response, skip={}):
+    async def send_batch(self, payloads, websocket):
+        """
+        Send several encoded responses to a websocket as a single frame, concatenated binary records for binary
+        clients or a JSON array for clients that negotiated the batch subprotocol. Other clients get one per frame.
+
+        Args:
+            payloads (Union[List[str], List[bytes]]): encoded responses, e.g. from a room's history
+            websocket (Websocket): The websocket to send the batch to
+        """
+        if not payloads:
+            return
+        user = self.connected.get(websocket)
+        if isinstance(payloads[0], bytes):
+            await self._send_payload(b"".join(payloads), Origin.SERVER.value, websocket, user)
+        elif getattr(websocket, "subprotocol", None) == Subprotocol.BATCH.value:
+            await self._send_payload(f"[{','.join(payloads)}]", Origin.SERVER.value, websocket, user)
+        else:
+            for payload in payloads:
+                await self._send_payload(payload, Origin.SERVER.value, websocket, user)
+
+    async def _send_payload(self, payload, origin, websocket, user):
+        """
+        Send an encoded payload, through the connection's outbound queue if it has one
+
+        Args:
+            payload (Union[str, bytes]): encoded payload
+            origin (str): origin value of the payload
+            websocket (Websocket): The websocket to send the payload to
+            user (User): user of the websocket, None if it isn't connected
+        """
+        MESSAGES_SENT.inc()
+        if user is not None and user.outbound is not None:
+            user.outbound.put(payload, origin)
+        else:
+            await websocket.send(payload)
+
+    @log(logger, hot_path=True)
+    async def send_to_all(self, response, skip={}, room=None, local_only=False):
         """
-        Send a message to all connected clients, except those in skip
+        Send a message to all connected clients, or all members of room, except those in skip.
+        The message is also published to other server nodes unless local_only is set.
+        If broadcast.concurrent is configured and outbound queues are not, sends to all clients in parallel.
 
         Args:
             response (Response): Response to send to all connections
             skip (set, optional): Union[Websocket, Iterable[Websocket]] to skip. Defaults to {}.
+            room (Room, optional): room to send to. Defaults to None (every connection).
+            local_only (bool, optional): only send to connections on this node. Defaults to False.
         """
         if not isinstance(skip, Iterable):
             skip = {skip}
 
-        for websocket in self.connected:
-            if websocket not in skip:
+        # every broadcast to a room is numbered, chat messages already are when they are added to history
+        if room is not None and response.seq is None:
+            response = response.with_seq(room.next_seq())
+
+        # a bus without peers would drop the event, so it isn't built
+        if not local_only and self.bus.has_peers:
+            await self.bus.publish({
+                "type": "broadcast", "room": room.name if room is not None else None, "response": response.data,
+                "sentAtMs": response.sent_at_ms})
+
+        # snapshot recipients, connections may change while we are awaiting sends
+        members = self.connected if room is None else room.members
+        recipients = [websocket for websocket in members if websocket not in skip]
+
+        start = time.perf_counter()
+        # queued sends never wait, the outbound queues already isolate slow sockets
+        if not self.concurrent_broadcast or self.queue_enabled:
+            for websocket in recipients:
                 await self.send(response, websocket)
+        else:
+            await self._send_concurrently(response, recipients)
+
+        BROADCAST_DURATION.observe(time.perf_counter() - start)
+        BROADCAST_RECIPIENTS.observe(len(recipients))
+
+    async def _send_concurrently(self, response, recipients):
+        """
+        Send a response to several websockets without one slow or failing socket holding up the others.
+        Sends run directly and only those that have to wait become tasks, which get send_timeout seconds
+        between them before they are cancelled.
+
+        Args:
+            response (Response): The Response to send
+            recipients (List[Websocket]): websockets to send the Response to
+        """
+        # Dict[asyncio.Task, Websocket], sends that could not finish right away
+        pending = dict()
+        for websocket in recipients:
+            try:
+                task = start_eagerly(self.send(response, websocket))
+            except Exception as e:
+                log_message(logger, f"Broadcast to {websocket} failed: {repr(e)}", logging.WARNING)
+                continue
+            if task is not None:
+                pending[task] = websocket
+        if not pending:
+            return
+
+        done, timed_out = await asyncio.wait(pending, timeout=self.send_timeout)
+        # failures are isolated to their own socket, log them and move on
+        for task in done:
+            if not task.cancelled() and task.exception() is not None:
+                log_message(logger, f"Broadcast to {pending[task]} failed: {repr(task.exception())}",
+                            logging.WARNING)
+        for task in timed_out:
+            task.cancel()
+            log_message(logger, f"Broadcast to {pending[task]} timed out after {self.send_timeout}s",
+                        logging.WARNING)
 
     @log(logger, logging.CRITICAL)
-    async def handle_shutdown(self):
+    async def handle_shutdown(self, deadline=None):
+        """
+        Drains the chatroom: every client is notified of shutdown and closed in parallel with a hint to reconnect
+        after a random delay. Connections not closed by the deadline, e.g. dead peers, are aborted.
+        Departures are not announced, the other clients are leaving too.
+
+        Args:
+            deadline (float, optional): seconds to wait for connections to close. Defaults to None (no deadline).
+        """
+        self.draining = True
+        if self.sessions is not None:
+            self.sessions.clear()
+
+        response = self.shutdown_response.restamp()
+        # Dict[asyncio.Task, Websocket]
+        drains = {asyncio.ensure_future(self._drain(response, websocket, user)): websocket
+                  for websocket, user in list(self.connected.items())}
+        if drains:
+            _, pending = await asyncio.wait(drains, timeout=deadline)
+            # a connection whose drain is unfinished may be mid close handshake, no longer open but not closed
+            stragglers = [drains[drain] for drain in pending]
+            for drain in pending:
+                drain.cancel()
+            if stragglers:
+                log_message(logger, f"Aborting {len(stragglers)} connections not closed after {deadline}s",
+                            logging.WARNING)
+                SHUTDOWN_ABORTED.inc(len(stragglers))
+                for websocket in stragglers:
+                    _abort(websocket)
+        await self.bus.stop()
+        if self.message_log is not None:
+            await asyncio.get_event_loop().run_in_executor(None, self.message_log.close)
+
+    async def _drain(self, response, websocket, user):
         """
-        Notifies all clients of shutdown and closes their connections
+        Sends the shutdown notification to a connection and closes it once sent
+
+        Args:
+            response (Response): shutdown notification
+            websocket (Websocket): connection to close
+            user (User): user of the connection
         """
-        await self.send_to_all(Response(self.get_shutdown_notification(), Origin.SERVER))
-        for conn in self.connected.keys():
-            await conn.close()
+        try:
+            await self.send(response, websocket)
+            if user.outbound is not None:
+                await user.outbound.flush()
+            await websocket.close(SERVICE_RESTART, self._reconnect_hint())
+        except Exception as e:
+            log_message(logger, f"Could not drain {websocket}: {repr(e)}", logging.WARNING)
+
+    def _reconnect_hint(self):
+        """
+        Returns:
+            str: close reason asking the client to reconnect after a random delay, e.g. "reconnect in 2350ms"
+        """
+        return f"reconnect in {int(random.uniform(*self.reconnect_delay) * 1000)}ms"
 
     @log(logger, logging.INFO)
     async def change_name(self, websocket, new_name):
@@ -134,14 +556,64 @@ class Chatroom:
         Args:
             websocket (Websocket): connection to change name of
             new_name (str): new name for user
+
+        Returns:
+            bool: whether the name was changed
         """
-        old_name = self.connected[websocket].name
+        user = self.connected[websocket]
+        old_name = user.name
 
         # sanitize by removing all whitespace
         new_name = "".join(new_name.split())
 
-        self.connected[websocket].name = new_name
-        await self.send_to_all(Response(self.get_name_change_notification(old_name, new_name), Origin.SERVER))
+        if self.unique_names and new_name != old_name and self.is_name_taken(new_name):
+            await self.send(Response(f"!setname error: {new_name} is already taken", Origin.SERVER), websocket)
+            return False
+
+        self._unindex_name(old_name, websocket)
+        user.name = new_name
+        self._index_name(new_name, websocket)
+        self._release_name(old_name)
+        user.room.invalidate()
+        await self.bus.publish({"type": "rename", "old": old_name, "new": new_name})
+        await self.send_to_all(
+            Response(self.get_name_change_notification(old_name, new_name), Origin.SERVER), room=user.room)
+        return True
+
+    @log(logger, logging.INFO)
+    async def change_room(self, websocket, room_name):
+        """
+        Moves the user connected with websocket to another room, notifying both rooms
+
+        Args:
+            websocket (Websocket): connection to move
+            room_name (str): requested room name
+
+        Returns:
+            bool: whether the user changed rooms
+        """
+        user = self.connected[websocket]
+        old_room = user.room
+        room_name = self.rooms.room_name(room_name)
+
+        if room_name == old_room.name:
+            await self.send(Response(f"You are already in #{room_name}", Origin.SERVER), websocket)
+            return False
+
+        # the move is complete before anything waits, a command cancelled midway only misses notifications
+        self.rooms.leave(old_room, websocket)
+        await self._join_room(room_name, websocket, user)
+        await self.send_to_all(
+            Response(self.get_room_leave_notification(user.name, old_room.name), Origin.SERVER), room=old_room)
+        await self.bus.publish({"type": "move", "name": user.name, "room": room_name})
+        if user.token is not None:
+            # sequence numbers are per room, the client resumes from the new room's
+            await self._send_session(user)
+        await self.send(Response(self.get_room_greeting(room_name), Origin.SERVER), websocket)
+        await self.send_batch(user.room.history.recent(self.history_replay, user.binary), websocket)
+        await self.send_to_all(
+            Response(self.get_room_join_notification(user.name, room_name), Origin.SERVER), websocket, user.room)
+        return True
 
     @log(logger, logging.INFO)
     async def private_message(self, message, from_websocket, to_websocket):
@@ -151,15 +623,242 @@ class Chatroom:
         await self.send(outgoing, to_websocket)
         await self.send(receipt, from_websocket)
 
+    @log(logger, logging.INFO)
+    async def send_private_message(self, message, from_websocket, to_name):
+        """
+        Sends a private message to a user by name, on this or any other server node
+
+        Args:
+            message (str): message body
+            from_websocket (Websocket): connection of the sender
+            to_name (str): name of the recipient
+
+        Returns:
+            bool: whether the recipient was found
+        """
+        target_user = self.find_user(to_name)
+        if target_user is not None:
+            await self.private_message(message, from_websocket, target_user.websocket)
+            return True
+
+        if to_name not in self.remote:
+            return False
+
+        outgoing = Response(self.get_outgoing_pm(message, self.connected[from_websocket].name), Origin.PRIVATE)
+        await self.bus.publish({"type": "private", "to": to_name, "response": outgoing.data,
+                                "sentAtMs": outgoing.sent_at_ms})
+        await self.send(Response(self.get_pm_receipt(message, to_name), Origin.PRIVATE), from_websocket)
+        return True
+
+    async def handle_bus_event(self, event):
+        """
+        Handles an event published by another server node
+
+        Args:
+            event (dict): bus event, see bus.py
+        """
+        kind, node = event["type"], event["node"]
+
+        if kind == "broadcast":
+            room = None
+            if event["room"] is not None:
+                # no local members if the room doesn't exist here
+                room = self.rooms.get(event["room"])
+                if room is None:
+                    return
+            # room broadcasts are numbered in this node's copy of the room, chat messages are kept in its history
+            response = Response.from_data(
+                event["response"], event.get("sentAtMs"), room.next_seq() if room is not None else None)
+            if room is not None and response.origin == Origin.USER.value:
+                room.history.append(response)
+                # every node logs the chat messages of its rooms, so its log is complete on its own
+                if self.message_log is not None:
+                    self.message_log.append(room.name, response.json())
+            await self.send_to_all(response, room=room, local_only=True)
+        elif kind == "private":
+            target_user = self.find_user(event["to"])
+            if target_user is not None:
+                await self.send(Response.from_data(event["response"], event.get("sentAtMs")), target_user.websocket)
+        elif kind == "join":
+            self.remote.add(event["name"], node, event["room"])
+        elif kind == "leave":
+            self.remote.remove(event["name"])
+        elif kind == "rename":
+            self.remote.rename(event["old"], event["new"])
+        elif kind == "move":
+            self.remote.move(event["name"], event["room"])
+        elif kind == "hello":
+            # a node joined the bus, tell everyone who is connected here
+            users = [[user.name, user.room.name] for user in self.connected.values()]
+            await self.bus.publish({"type": "sync", "users": users})
+        elif kind == "sync":
+            for name, room in event["users"]:
+                self.remote.add(name, node, room)
+        elif kind == "node_down":
+            self.remote.drop_node(node)
+            REGISTRY.peers.pop(node, None)
+        elif kind == "metrics":
+            REGISTRY.peers[node] = event["samples"]
+        else:
+            log_message(logger, f"Unknown bus event type {kind}", logging.WARNING)
+
+    def create_outbound_queue(self, websocket):
+        """
+        Creates and starts an outbound queue for a new connection if queues are enabled.
+        The queue coalesces frames if batching is enabled and the client negotiated the batch or binary subprotocol.
+
+        Args:
+            websocket (Websocket): new connection websocket
+
+        Returns:
+            OutboundQueue: started queue, or None if queues are disabled
+        """
+        if not self.queue_enabled:
+            return None
+        batch_interval = None
+        if self.batching_enabled and getattr(websocket, "subprotocol", None) in BATCHING_SUBPROTOCOLS:
+            batch_interval = self.batch_interval
+        queue = OutboundQueue(websocket, self.queue_max_size, self.queue_policy, batch_interval, self.batch_bytes)
+        queue.start()
+        return queue
+
+    async def get_history(self, room, count, binary=False):
+        """
+        Gets recent messages for a room, from the message log if the room's history is too short
+
+        Args:
+            room (Room): room to get messages for
+            count (int): maximum number of messages
+            binary (bool, optional): whether to return binary payloads. Defaults to False (JSON).
+
+        Returns:
+            Union[List[str], List[bytes]]: up to count encoded messages, oldest first
+        """
+        if count > len(room.history) and self.message_log is not None:
+            # logged sequence numbers may be from an earlier instance of the room, they are dropped
+            payloads = await asyncio.get_event_loop().run_in_executor(
+                None, self.message_log.recent, room.name, count)
+            return [Response.from_json(payload).encode(binary) for payload in payloads]
+        return room.history.recent(count, binary)
+
+    async def _join_room(self, room_name, websocket, user):
+        """
+        Joins a room and sets it as the user's room, then warms a newly created room's history from the message log,
+        read off the event loop
+
+        Args:
+            room_name (str): normalized room name
+            websocket (Websocket): joining connection
+            user (User): joining user
+
+        Returns:
+            Room: the joined room
+        """
+        room = user.room = self.rooms.join(room_name, websocket, user)
+        if self.message_log is not None and len(room) == 1 and not room.history:
+            payloads = await asyncio.get_event_loop().run_in_executor(
+                None, self.message_log.recent, room_name, room.history.max_messages)
+            # skipped if messages arrived while reading, logged ones would be ordered after them
+            if not room.history:
+                for payload in payloads:
+                    room.history.append(Response.from_json(payload, room.next_seq()))
+        return room
+
+    def find_user(self, name):
+        """
+        Finds a connected user by name
+
+        Args:
+            name (str): name to look up
+
+        Returns:
+            User: first connected user with the name, or None if there is none
+        """
+        websockets = self.names.get(name)
+        if not websockets:
+            return None
+        return self.connected[next(iter(websockets))]
+
+    def is_name_taken(self, name):
+        """
+        Args:
+            name (str): name to check
+
+        Returns:
+            bool: whether a user on this or any other node, or a parked user, has the name
+        """
+        return (name in self.names or name in self.remote
+                or (self.sessions is not None and self.sessions.is_parked(name)))
+
+    def get_who(self, room=None):
+        """
+        Lists connected users, the listing is cached until membership or names change
+
+        Args:
+            room (Room, optional): room to list. Defaults to None (every connection).
+
+        Returns:
+            str: comma separated names of connected users
+        """
+        if room is not None:
+            local, remote = room.get_who(), self.remote.names_in(room.name)
+        else:
+            if self._who_cache is None:
+                self._who_cache = ", ".join([user.name for user in self.connected.values()])
+            local, remote = self._who_cache, list(self.remote.users)
+
+        # users on other nodes are appended to the cached local listing
+        listing = [local] if local else []
+        return ", ".join(listing + remote)
+
+    def get_rooms(self):
+        """
+        Lists rooms and their member counts
+
+        Returns:
+            str: comma separated room names with member counts
+        """
+        counts = {name: len(room) for name, room in self.rooms.rooms.items()}
+        for name, remote_names in self.remote.rooms.items():
+            counts[name] = counts.get(name, 0) + len(remote_names)
+        return ", ".join([f"#{name} ({count})" for name, count in counts.items()])
+
+    def _index_name(self, name, websocket):
+        self.names.setdefault(name, dict())[websocket] = None
+        self._who_cache = None
+
+    def _unindex_name(self, name, websocket):
+        websockets = self.names.get(name)
+        if websockets is not None:
+            websockets.pop(websocket, None)
+            if not websockets:
+                del self.names[name]
+        self._who_cache = None
+
+    def _release_name(self, name):
+        # returns a name to the generator's pool once no local connection uses it
+        if name not in self.names:
+            self.name_generator.release(name)
+
     def generate_name(self):
         """
-        Generate an initial name for a new client
+        Generate an initial name for a new client, guaranteed not in use if unique_names is configured
 
         Returns:
             str: Randomly generated name
         """
+        name = self.name_generator.generate_name()
+        if not self.unique_names:
+            return name
 
-        return self.name_generator.generate_name()
+        # generated names are unique among generated names on this node, but may have been
+        # chosen with !setname or generated by another node. Skipped names held here are released when their
+        # user leaves, those held elsewhere are forgotten, as this node is never told when they are free
+        while self.is_name_taken(name):
+            if name not in self.names:
+                self.name_generator.discard(name)
+            name = self.name_generator.generate_name()
+        return name
 
     def get_greeting(self, name):
         """
@@ -171,7 +870,7 @@ class Chatroom:
         Returns:
             str: greeting for new connection
         """
-        return Template(self.config["greeting_temp"]).substitute(name=name)
+        return self.templates["greeting_temp"].render(name=name)
 
     def get_connection_notification(self, name):
         """
@@ -183,7 +882,7 @@ class Chatroom:
         Returns:
             str: notification for clients
         """
-        return Template(self.config["conn_notif_temp"]).substitute(name=name)
+        return self.templates["conn_notif_temp"].render(name=name)
 
     def get_disconnect_notification(self, name):
         """
@@ -195,7 +894,7 @@ class Chatroom:
         Returns:
             str: notification for clients
         """
-        return Template(self.config["disconn_notif_temp"]).substitute(name=name)
+        return self.templates["disconn_notif_temp"].render(name=name)
 
     def get_name_change_notification(self, old_name, new_name):
         """
@@ -208,7 +907,45 @@ class Chatroom:
         Returns:
             str: notification for clients
         """
-        return Template(self.config["namechange_notif_temp"]).substitute(old=old_name, new=new_name)
+        return self.templates["namechange_notif_temp"].render(old=old_name, new=new_name)
+
+    def get_room_greeting(self, room):
+        """
+        Generates greeting str for a user joining a room
+
+        Args:
+            room (str): name of joined room
+
+        Returns:
+            str: greeting for the user
+        """
+        return self.templates["room_greeting_temp"].render(room=room)
+
+    def get_room_join_notification(self, name, room):
+        """
+        Generates notification str for a user joining a room
+
+        Args:
+            name (str): name of joining client
+            room (str): name of joined room
+
+        Returns:
+            str: notification for room members
+        """
+        return self.templates["room_join_notif_temp"].render(name=name, room=room)
+
+    def get_room_leave_notification(self, name, room):
+        """
+        Generates notification str for a user leaving a room
+
+        Args:
+            name (str): name of leaving client
+            room (str): name of left room
+
+        Returns:
+            str: notification for room members
+        """
+        return self.templates["room_leave_notif_temp"].render(name=name, room=room)
 
     def get_shutdown_notification(self):
         """
@@ -217,27 +954,129 @@ class Chatroom:
         Returns:
             str: notification for clients
         """
-        return self.config["shutdown_notif_temp"]
+        return self.shutdown_response.body
 
     def get_outgoing_pm(self, message, from_name):
-        return Template(self.config["private_messate_from_temp"]).substitute(from_name=from_name, message=message)
+        return self.templates["private_messate_from_temp"].render(from_name=from_name, message=message)
 
     def get_pm_receipt(self, message, to_name):
-        return Template(self.config["private_message_to_temp"]).substitute(to_name=to_name, message=message)
+        return self.templates["private_message_to_temp"].render(to_name=to_name, message=message)
 
     def __repr__(self):
-        return f"<Chatroom, connections: {len(self.connected)}>"
+        return f"<Chatroom, connections: {len(self.connected)}, rooms: {len(self.rooms)}>"
+
+
+def _abort(websocket):
+    # drops the connection without a closing handshake, websockets exposes the transport for this
+    transport = getattr(websocket, "transport", None)
+    if transport is not None:
+        transport.abort()
+
+
+# Dict[str, Tuple[str]], word lists by path, read once per process however many Chatrooms are created
+_word_lists = {}
+
+
+def load_words(path):
+    """
+    Loads a word list with one word per line, capitalized and without duplicates. Cached per path.
+
+    Args:
+        path (str): path of the word list
+
+    Returns:
+        Tuple[str]: words in file order
+    """
+    words = _word_lists.get(path)
+    if words is None:
+        with open(path) as file:
+            words = _word_lists[path] = tuple(dict.fromkeys(word.capitalize() for word in file.read().split()))
+    return words
 
 
 class AdjAnimalNameGenerator:
+    """
+    Hands out unique adjective + animal names in O(1).
+    Names are drawn from a pseudo-random permutation of every combination, walked one index at a time,
+    so no name is handed out twice until every combination has been. Released names are reused after that,
+    and once none are free names get a numbered suffix, e.g. "CleverOtter2".
+    Copies of a generator, e.g. in forked workers, can be partitioned to hand out disjoint names.
+    """
 
     def __init__(self, adj_path, animal_path):
-        with open(adj_path) as adjs:
-            self.adjectives = [word.strip().capitalize()
-                               for word in adjs.readlines()]
-        with open(animal_path) as animals:
-            self.animals = [word.strip().capitalize()
-                            for word in animals.readlines()]
+        self.adjectives = load_words(adj_path)
+        self.animals = load_words(animal_path)
+        self.combinations = len(self.adjectives) * len(self.animals)
+
+        # index -> (multiplier * index + offset) % combinations is a permutation when the multiplier is coprime
+        self._multiplier = 1
+        if self.combinations > 1:
+            self._multiplier = random.randrange(1, self.combinations)
+            while math.gcd(self._multiplier, self.combinations) != 1:
+                self._multiplier = random.randrange(1, self.combinations)
+        self._offset = random.randrange(self.combinations) if self.combinations else 0
+        # next permutation index, and how far to step after each, see partition
+        self._next = 0
+        self._stride = 1
+
+        # names handed out and not released, and released names in the order they were freed
+        self._issued = set()
+        self._released = deque()
 
     def generate_name(self):
-        return f"{random.choice(self.adjectives)}{random.choice(self.animals)}"
+        """
+        Returns:
+            str: name not handed out by this generator since it was last released
+        """
+        if self._next >= self.combinations and self._released:
+            name = self._released.popleft()
+        else:
+            # past the end of the permutation, walk it again with a suffix for each pass
+            index, rounds = self._next % self.combinations, self._next // self.combinations
+            self._next += self._stride
+            position = (self._multiplier * index + self._offset) % self.combinations
+            adjective, animal = divmod(position, len(self.animals))
+            name = f"{self.adjectives[adjective]}{self.animals[animal]}"
+            if rounds:
+                name = f"{name}{rounds + 1}"
+        self._issued.add(name)
+        return name
+
+    def partition(self, index, count):
+        """
+        Restricts the generator to every count-th index of its permutation, starting at index.
+        Partitions of copies of one generator never hand out the same name.
+
+        Args:
+            index (int): partition of this copy, from 0 to count - 1
+            count (int): number of copies
+        """
+        self._next = index
+        self._stride = count
+
+    def discard(self, name):
+        """
+        Forgets a handed out name without making it available again, e.g. one held by a user on another node
+
+        Args:
+            name (str): name handed out by this generator
+        """
+        self._issued.discard(name)
+
+    def release(self, name):
+        """
+        Returns a name to the pool once nobody uses it, names not handed out by this generator are ignored
+
+        Args:
+            name (str): name no longer in use
+        """
+        if name in self._issued:
+            self._issued.remove(name)
+            self._released.append(name)
+
+    def __len__(self):
+        """
+        Returns:
+            int: number of names handed out and not released
+        """
+        return len(self._issued)
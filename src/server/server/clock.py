@@ -0,0 +1,33 @@
+"""
+clock provides a coarse wall clock that formats its timestamp at most once per second, shared by every Response
+"""
+import time
+
+
+class CoarseClock:
+    """
+    Wall clock whose formatted time is cached for the current second,
+    so a burst of messages in the same second formats the time once
+    """
+    __slots__ = ("format", "_second", "_formatted")
+
+    def __init__(self, time_format):
+        """
+        Args:
+            time_format (str): time.strftime format of the formatted time, e.g. "%H:%M:%S"
+        """
+        self.format = time_format
+        self._second = None
+        self._formatted = None
+
+    def now(self):
+        """
+        Returns:
+            Tuple[str, int]: local time formatted to the second, and the current time in epoch milliseconds
+        """
+        ms = time.time_ns() // 1000000
+        second = ms // 1000
+        if second != self._second:
+            self._formatted = time.strftime(self.format, time.localtime(second))
+            self._second = second
+        return self._formatted, ms
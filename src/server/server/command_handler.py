@@ -2,23 +2,32 @@
 command_handler allows clients to invoke registered commands via messages
 """
 import asyncio
-import re
 import logging
+import time
 from response import Response, Origin
-from utils import log, log_message
+from utils import log, log_message, start_eagerly
+from metrics import REGISTRY
 
 logger = logging.getLogger(__name__)
 
+COMMANDS = REGISTRY.counter("chat_commands_total", "Commands handled by command name", ("command",))
+COMMAND_DURATION = REGISTRY.histogram("chat_command_duration_seconds", "Command handling time by command name",
+                                      ("command",))
+COMMAND_TIMEOUTS = REGISTRY.counter("chat_command_timeouts_total", "Commands cancelled after exceeding the timeout",
+                                    ("command",))
 
-def register(command, command_dict):
+
+def register(command, command_dict, aliases=()):
     """
     Decorator factory, decorator registers a function as a command in a given dict
 
     Args:
         command (str): string used to invoke command
         dict (dict): dictionary to register commands in
+        aliases (Tuple[str], optional): other strings that invoke the command. Defaults to ().
     """
     def decorator(func):
+        func.aliases = tuple(aliases)
         command_dict[command] = func
         return func
     return decorator
@@ -29,17 +38,76 @@ registered = dict()
 
 class CommandHandler:
 
-    def __init__(self, pattern="^!.+"):
+    def __init__(self, prefix="!", timeout=None):
         """
         Create a new command handler
 
         Args:
-            pattern (str, optional): regex pattern for a command. Defaults to "^!.+".
+            prefix (str, optional): character that starts a command. Defaults to "!".
+            timeout (float, optional): seconds a command may run before it is cancelled, None for no limit.
+                Overrunning commands are cancelled within a quarter of the timeout. Defaults to None.
         """
-        self._regex = re.compile(pattern)
+        self.prefix = prefix
+        self.timeout = timeout or None
         self.registered_commands = registered
+
+        # Dict[str, str], every name, alias and unambiguous prefix -> registered command name
+        self._table = {}
+        # Dict[str, List[str]], prefixes shared by several commands -> the commands they could mean
+        self._ambiguous = {}
+        self._table_size = None
+        self._build_table()
+
+        # Dict[asyncio.Task, float], command tasks -> perf_counter deadline, checked by the watchdog
+        self._running = {}
+        # Set[asyncio.Task], command tasks the watchdog cancelled, told apart from cancellation for other reasons
+        self._expired = set()
+        self._watchdog = None
         log_message(logger, f"Registered Commands: {self.registered_commands.keys()}", logging.INFO)
 
+    def _build_table(self):
+        """
+        Precomputes the lookup table from the registered commands, so resolving a command is one dict lookup.
+        Exact names and aliases take precedence over prefixes of other commands.
+        """
+        candidates = {}
+        for name, func in self.registered_commands.items():
+            for invocation in (name, *getattr(func, "aliases", ())):
+                # "!" alone is not a command, prefixes include at least one character after it
+                for end in range(len(self.prefix) + 1, len(invocation) + 1):
+                    candidates.setdefault(invocation[:end], set()).add(name)
+
+        self._table, self._ambiguous = {}, {}
+        for prefix, names in candidates.items():
+            if len(names) == 1:
+                self._table[prefix] = next(iter(names))
+            else:
+                self._ambiguous[prefix] = sorted(names)
+        for name, func in self.registered_commands.items():
+            for invocation in (name, *getattr(func, "aliases", ())):
+                self._table[invocation] = name
+                self._ambiguous.pop(invocation, None)
+        self._table_size = len(self.registered_commands)
+
+    def resolve(self, command_name):
+        """
+        Looks up the registered command invoked by a name, alias or unambiguous prefix
+
+        Args:
+            command_name (str): lowercase command name, e.g. "!he"
+
+        Returns:
+            Union[str, List[str]]: registered command name, the candidates if ambiguous,
+                or None if no command matches
+        """
+        # commands registered after construction are picked up on the next lookup
+        if self._table_size != len(self.registered_commands):
+            self._build_table()
+        name = self._table.get(command_name)
+        if name is not None:
+            return name
+        return self._ambiguous.get(command_name)
+
     def is_command(self, message):
         """
         returns whether a given message is a command
@@ -50,9 +118,10 @@ class CommandHandler:
         Returns:
             bool: whether message is a command
         """
-        return self._regex.match(message) is not None
+        # equivalent to matching "^!.+" without the regex, a prefix followed by anything but a line break
+        return message.startswith(self.prefix) and message[len(self.prefix):len(self.prefix) + 1] not in ("", "\n")
 
-    @log(logger, logging.INFO)
+    @log(logger, hot_path=True)
     async def handle_command(self, command_message, user, chatroom):
         """
         Handles a command message from a user in a chatroom
@@ -70,14 +139,63 @@ class CommandHandler:
             return
 
         command_name, command_args = self._parse_command(command_message)
-        if command_name not in self.registered_commands:
-            resp = Response(f"\"{command_message}\" is not a valid command (Doesn't exist)", Origin.SERVER)
+        resolved = self.resolve(command_name)
+        if not isinstance(resolved, str):
+            # unknown names share a label, so clients can't create unbounded label values
+            COMMANDS.labels("unknown").inc()
+            if resolved is None:
+                resp = Response(f"\"{command_message}\" is not a valid command (Doesn't exist)", Origin.SERVER)
+            else:
+                resp = Response(f"\"{command_name}\" is ambiguous, did you mean {', '.join(resolved)}?",
+                                Origin.SERVER)
             await chatroom.send(resp, user.websocket)
             return
 
         # Invoke the command, passing calling user, chatroom, and arguments
-        command_func = self.registered_commands[command_name]
-        await command_func(self, user, chatroom, command_args)
+        command_func = self.registered_commands[resolved]
+        start = time.perf_counter()
+        task = None
+        try:
+            if self.timeout is None:
+                await command_func(self, user, chatroom, command_args)
+            else:
+                # the watchdog cancels the command's own task, never the connection's, which awaits it.
+                # Most commands finish without waiting and never need a task.
+                task = start_eagerly(command_func(self, user, chatroom, command_args))
+                if task is not None:
+                    self._running[task] = start + self.timeout
+                    if self._watchdog is None:
+                        self._watchdog = asyncio.ensure_future(self._watch())
+                    await task
+        except asyncio.CancelledError:
+            if task not in self._expired:
+                raise
+            # only the command was cancelled, the connection's read loop moves on to its next message
+            COMMAND_TIMEOUTS.labels(resolved).inc()
+            log_message(logger, f"{resolved} timed out after {self.timeout}s", logging.WARNING)
+            resp = Response(f"{resolved} took too long and was cancelled", Origin.SERVER)
+            await chatroom.send(resp, user.websocket)
+        finally:
+            if task is not None:
+                self._running.pop(task, None)
+                self._expired.discard(task)
+            COMMANDS.labels(resolved).inc()
+            COMMAND_DURATION.labels(resolved).observe(time.perf_counter() - start)
+
+    async def _watch(self):
+        """
+        Cancels commands running past their deadline, checking a few times per timeout while any are running
+        """
+        try:
+            while self._running:
+                await asyncio.sleep(self.timeout / 4)
+                now = time.perf_counter()
+                for task, deadline in list(self._running.items()):
+                    if now >= deadline and task not in self._expired:
+                        self._expired.add(task)
+                        task.cancel()
+        finally:
+            self._watchdog = None
 
     def _parse_command(self, command_str):
         """
@@ -91,11 +209,11 @@ class CommandHandler:
         """
         split = command_str.split(maxsplit=1)
         if len(split) == 1:
-            return split[0], ""
+            return split[0].lower(), ""
         else:
             return split[0].lower(), split[1]
 
-    @register("!help", registered)
+    @register("!help", registered, aliases=("!?",))
     async def help(self, user, chatroom, args):
         """
         Help command, sends user information about availible commands
@@ -105,7 +223,8 @@ class CommandHandler:
             chatroom (Chatroom): chatroom in which the command was called
             args (List[str]): command args
         """
-        body = f"Here are some commands you can use:\n\t{', '.join(self.registered_commands.keys())}"
+        commands = [" / ".join((name, *getattr(func, "aliases", ()))) for name, func in self.registered_commands.items()]
+        body = f"Here are some commands you can use (or any unambiguous start of one):\n\t{', '.join(commands)}"
         resp = Response(body, Origin.SERVER)
         await chatroom.send(resp, user.websocket)
 
@@ -123,7 +242,7 @@ class CommandHandler:
         resp = Response(body, Origin.SERVER)
         await chatroom.send(resp, user.websocket)
 
-    @register("!setname", registered)
+    @register("!setname", registered, aliases=("!nick",))
     async def setname(self, user, chatroom, args):
         """
         Setname command, allows user to change their name
@@ -140,18 +259,17 @@ class CommandHandler:
             return
         await chatroom.change_name(user.websocket, new_name)
 
-    @register("!who", registered)
+    @register("!who", registered, aliases=("!users",))
     async def who(self, user, chatroom, args):
         """
-        Who command, allows user to see who is connected
+        Who command, allows user to see who is connected to their room
 
         Args:
             user (User): user who called the command
             chatroom (Chatroom): chatroom in which the command was called
             args (List[str]): command args
         """
-        everyone = ", ".join([user.name for user in chatroom.connected.values()])
-        resp = Response(f"Connected Users: {everyone}", Origin.SERVER)
+        resp = Response(f"Connected Users: {chatroom.get_who(user.room)}", Origin.SERVER)
         await chatroom.send(resp, user.websocket)
 
     @register("!env", registered)
@@ -178,7 +296,7 @@ class CommandHandler:
         resp = Response("pong!", Origin.SERVER)
         await chatroom.send(resp, user.websocket)
 
-    @register("!pm", registered)
+    @register("!pm", registered, aliases=("!msg",))
     async def pm(self, user, chatroom, args):
         """Private message command, allows a user to send a private message
 
@@ -203,13 +321,70 @@ class CommandHandler:
         # message should be a list with 1 element after unpacking
         message = message[0]
 
-        # search for target user and send
-        for websocket in chatroom.connected:
-            target_user = chatroom.connected[websocket]
-            if target_user.name == target:
-                await chatroom.private_message(message, user.websocket, target_user.websocket)
-                return
+        # look up target user on any node and send
+        if await chatroom.send_private_message(message, user.websocket, target):
+            return
 
         # Target user not found
         resp = Response(f"!pm error: user {target} not found", Origin.SERVER)
         await chatroom.send(resp, user.websocket)
+
+    @register("!join", registered)
+    async def join(self, user, chatroom, args):
+        """Join command, moves the user to another room
+
+        Args:
+            user (User): user who called the command
+            chatroom (Chatroom): chatroom in which the command was called
+            args (str): command args: <room>
+        """
+        room_name = args.strip()
+        if room_name == "" or chatroom.rooms.room_name(room_name) != room_name.lower():
+            resp = Response(f"!join usage: !join <room> (letters, numbers, _ and -, at most 32)", Origin.SERVER)
+            await chatroom.send(resp, user.websocket)
+            return
+        await chatroom.change_room(user.websocket, room_name)
+
+    @register("!leave", registered)
+    async def leave(self, user, chatroom, args):
+        """Leave command, moves the user back to the default room
+
+        Args:
+            user (User): user who called the command
+            chatroom (Chatroom): chatroom in which the command was called
+            args (str): command args
+        """
+        await chatroom.change_room(user.websocket, chatroom.rooms.default_room)
+
+    @register("!rooms", registered)
+    async def rooms(self, user, chatroom, args):
+        """Rooms command, lists rooms and how many users are in each
+
+        Args:
+            user (User): user who called the command
+            chatroom (Chatroom): chatroom in which the command was called
+            args (str): command args
+        """
+        resp = Response(f"Rooms: {chatroom.get_rooms()}", Origin.SERVER)
+        await chatroom.send(resp, user.websocket)
+
+    @register("!history", registered)
+    async def history(self, user, chatroom, args):
+        """History command, sends the user recent messages from their room
+
+        Args:
+            user (User): user who called the command
+            chatroom (Chatroom): chatroom in which the command was called
+            args (str): command args: <count>
+        """
+        if not args.strip().isdigit():
+            resp = Response(f"!history usage: !history <count>", Origin.SERVER)
+            await chatroom.send(resp, user.websocket)
+            return
+
+        payloads = await chatroom.get_history(user.room, int(args), user.binary)
+        if not payloads:
+            resp = Response(f"No history in #{user.room.name}", Origin.SERVER)
+            await chatroom.send(resp, user.websocket)
+            return
+        await chatroom.send_batch(payloads, user.websocket)
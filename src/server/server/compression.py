@@ -0,0 +1,169 @@
+"""
+compression configures permessage-deflate, skipping small messages and sharing compressed broadcasts
+"""
+import dataclasses
+import logging
+from collections import OrderedDict
+from websockets.extensions.permessage_deflate import PerMessageDeflate, ServerPerMessageDeflateFactory
+from websockets.frames import OP_CONT, CTRL_OPCODES
+from utils import log_message
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# recently compressed payloads shared between connections, per window size
+SHARED_CACHE_SIZE = 64
+
+
+class CompressionStats:
+    """
+    Counters for outgoing messages seen by the deflate extension, shared by every connection of a server
+    """
+    __slots__ = ("compressed", "skipped", "shared", "bytes_in", "bytes_out")
+
+    def __init__(self):
+        self.compressed = 0
+        self.skipped = 0
+        self.shared = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    @property
+    def ratio(self):
+        """
+        Returns:
+            float: compressed bytes out per byte in, 1.0 if nothing was compressed
+        """
+        return self.bytes_out / self.bytes_in if self.bytes_in else 1.0
+
+    def __repr__(self):
+        return (f"<CompressionStats compressed: {self.compressed}, skipped: {self.skipped}, shared: {self.shared}, "
+                f"ratio: {self.ratio:.2f}>")
+
+
+class ThresholdPerMessageDeflate(PerMessageDeflate):
+    """
+    permessage-deflate that sends messages below a size threshold uncompressed.
+    Without context takeover a message always compresses to the same bytes,
+    so the output is shared between connections through a cache, compressing a broadcast once.
+    """
+
+    def __init__(self, remote_no_context_takeover, local_no_context_takeover, remote_max_window_bits,
+                 local_max_window_bits, compress_settings=None, threshold=0, cache=None, stats=None):
+        """
+        Args:
+            threshold (int, optional): minimum message size in bytes to compress. Defaults to 0.
+            cache (OrderedDict, optional): shared cache of payload to compressed payload. Defaults to None.
+            stats (CompressionStats, optional): counters to update. Defaults to None.
+        """
+        super().__init__(remote_no_context_takeover, local_no_context_takeover, remote_max_window_bits,
+                         local_max_window_bits, compress_settings)
+        self.threshold = threshold
+        self.cache = cache if local_no_context_takeover else None
+        self.stats = stats if stats is not None else CompressionStats()
+
+    def encode(self, frame):
+        """
+        Encode an outgoing frame, leaving single frame messages under threshold uncompressed
+
+        Args:
+            frame (Frame): outgoing frame
+
+        Returns:
+            Frame: frame to send
+        """
+        # only whole, single frame messages can be skipped or shared
+        if frame.opcode in CTRL_OPCODES or frame.opcode is OP_CONT or not frame.fin:
+            return super().encode(frame)
+
+        size = len(frame.data)
+        if size < self.threshold:
+            self.stats.skipped += 1
+            return frame
+
+        self.stats.compressed += 1
+        self.stats.bytes_in += size
+        if self.cache is None or not isinstance(frame.data, bytes):
+            encoded = super().encode(frame)
+            self.stats.bytes_out += len(encoded.data)
+            return encoded
+
+        data = self.cache.get(frame.data)
+        if data is not None:
+            self.stats.shared += 1
+            self.stats.bytes_out += len(data)
+            return dataclasses.replace(frame, data=data, rsv1=True)
+
+        encoded = super().encode(frame)
+        self.cache[frame.data] = encoded.data
+        if len(self.cache) > SHARED_CACHE_SIZE:
+            self.cache.popitem(last=False)
+        self.stats.bytes_out += len(encoded.data)
+        return encoded
+
+
+class ServerCompressionFactory(ServerPerMessageDeflateFactory):
+    """
+    Server permessage-deflate factory negotiating ThresholdPerMessageDeflate extensions
+    """
+
+    def __init__(self, threshold=0, **kwargs):
+        """
+        Args:
+            threshold (int, optional): minimum message size in bytes to compress. Defaults to 0.
+            **kwargs: ServerPerMessageDeflateFactory arguments
+        """
+        super().__init__(**kwargs)
+        self.threshold = threshold
+        self.stats = CompressionStats()
+
+        # read when scraped, the most recently created factory is reported
+        stats = self.stats
+        REGISTRY.counter("chat_compression_compressed_total", "Outgoing messages compressed, including shared ones",
+                         function=lambda: stats.compressed)
+        REGISTRY.counter("chat_compression_skipped_total", "Outgoing messages under the threshold sent uncompressed",
+                         function=lambda: stats.skipped)
+        REGISTRY.counter("chat_compression_shared_total", "Compressed messages reused from the shared cache",
+                         function=lambda: stats.shared)
+        REGISTRY.counter("chat_compression_bytes_in_total", "Bytes of compressed messages before compression",
+                         function=lambda: stats.bytes_in)
+        REGISTRY.counter("chat_compression_bytes_out_total", "Bytes of compressed messages after compression",
+                         function=lambda: stats.bytes_out)
+
+        # Dict[int, OrderedDict[bytes, bytes]], outputs only match for the same window size
+        self._caches = {}
+
+    def process_request_params(self, params, accepted_extensions):
+        response_params, extension = super().process_request_params(params, accepted_extensions)
+        cache = self._caches.setdefault(extension.local_max_window_bits, OrderedDict())
+        return response_params, ThresholdPerMessageDeflate(
+            extension.remote_no_context_takeover, extension.local_no_context_takeover,
+            extension.remote_max_window_bits, extension.local_max_window_bits, extension.compress_settings,
+            self.threshold, cache, self.stats)
+
+
+def create_compression(compression_config):
+    """
+    Creates a permessage-deflate factory from the server's compression configuration.
+    Compression is disabled unless the section enables it.
+
+    Args:
+        compression_config (dict): compression section of server.yaml, may be None
+
+    Returns:
+        ServerCompressionFactory: factory to pass as a websockets extension, or None if compression is disabled
+    """
+    compression_config = compression_config or {}
+    if not compression_config.get("enabled", False):
+        return None
+
+    log_message(logger, f"permessage-deflate enabled: {compression_config}", logging.INFO)
+    return ServerCompressionFactory(
+        threshold=compression_config.get("threshold", 0),
+        server_no_context_takeover=compression_config.get("no_context_takeover", False),
+        # clients resetting their context lets the server free its decompressor between messages
+        client_no_context_takeover=compression_config.get("client_no_context_takeover", False),
+        server_max_window_bits=compression_config.get("window_bits", 15),
+        compress_settings={
+            "memLevel": compression_config.get("mem_level", 8),
+            "level": compression_config.get("level", 6)})
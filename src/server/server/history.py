@@ -0,0 +1,93 @@
+"""
+history keeps a bounded buffer of recent, already encoded, room messages
+"""
+import math
+import sys
+from collections import deque
+
+
+class MessageHistory:
+    """
+    Ring buffer of encoded payloads, bounded by message count and by memory.
+    Each message is kept in both wire formats, so replay never serializes.
+    """
+
+    def __init__(self, max_messages, max_bytes=None):
+        """
+        Create a new, empty history
+
+        Args:
+            max_messages (int): maximum number of payloads kept
+            max_bytes (int, optional): maximum memory used by kept payloads, in bytes. Defaults to None (unbounded).
+        """
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes if max_bytes is not None else math.inf
+        self.bytes = 0
+
+        # Deque[Tuple[str, bytes, int]] of (JSON, binary) encoded payloads and their sequence number, oldest first
+        self._payloads = deque()
+
+    def append(self, response):
+        """
+        Adds a response's encodings, evicting the oldest payloads until within both limits.
+        A response larger than max_bytes on its own is not kept.
+
+        Args:
+            response (Response): response to keep
+        """
+        if self.max_messages < 1:
+            # history is disabled, don't pay for the encodings
+            return
+        entry = (response.json(), response.binary(), response.seq or 0)
+        size = _entry_size(entry)
+        if size > self.max_bytes:
+            return
+
+        self._payloads.append(entry)
+        self.bytes += size
+        while len(self._payloads) > self.max_messages or self.bytes > self.max_bytes:
+            self.bytes -= _entry_size(self._payloads.popleft())
+
+    def recent(self, count, binary=False):
+        """
+        Args:
+            count (int): number of payloads
+            binary (bool, optional): whether to return binary payloads. Defaults to False (JSON).
+
+        Returns:
+            Union[List[str], List[bytes]]: up to count most recent payloads, oldest first
+        """
+        if count <= 0:
+            return []
+        start = max(len(self._payloads) - count, 0)
+        encoding = 1 if binary else 0
+        return [self._payloads[index][encoding] for index in range(start, len(self._payloads))]
+
+    def since(self, seq, binary=False):
+        """
+        Args:
+            seq (int): sequence number of the last message already received
+            binary (bool, optional): whether to return binary payloads. Defaults to False (JSON).
+
+        Returns:
+            Union[List[str], List[bytes]]: kept payloads with a higher sequence number, oldest first
+        """
+        encoding = 1 if binary else 0
+        payloads = []
+        # newest first until reaching what was already received, sequence numbers only increase
+        for entry in reversed(self._payloads):
+            if entry[2] <= seq:
+                break
+            payloads.append(entry[encoding])
+        payloads.reverse()
+        return payloads
+
+    def __len__(self):
+        return len(self._payloads)
+
+    def __repr__(self):
+        return f"<MessageHistory {len(self._payloads)}/{self.max_messages} messages, {self.bytes}/{self.max_bytes} bytes>"
+
+
+def _entry_size(entry):
+    return sys.getsizeof(entry) + sys.getsizeof(entry[0]) + sys.getsizeof(entry[1])
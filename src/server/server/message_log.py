@@ -0,0 +1,362 @@
+"""
+message_log persists encoded room messages to an append-only log of segment files
+"""
+import bisect
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from utils import log_message
+
+logger = logging.getLogger(__name__)
+
+# record header: body length, crc32 of body, room name length. body is the room name followed by the payload
+RECORD_HEADER = struct.Struct("!IIH")
+SEGMENT_SUFFIX = ".log"
+
+
+class Segment:
+    """
+    One segment file, named after the record number of its first record
+    """
+
+    def __init__(self, directory, base):
+        """
+        Create a segment handle, the file is not opened
+
+        Args:
+            directory (str): log directory
+            base (int): record number of the first record in the segment
+        """
+        self.base = base
+        self.path = os.path.join(directory, f"{base:020d}{SEGMENT_SUFFIX}")
+
+        # committed (fsynced) size and record count, readers never look past these
+        self.size = 0
+        self.count = 0
+        self.modified_at = time.time()
+
+        # sparse index, List[Tuple[int, int]] of (record number, file position), None until scanned
+        self.index = None
+
+    def __repr__(self):
+        return f"<Segment {self.base}, records: {self.count}, bytes: {self.size}>"
+
+
+class MessageLog:
+    """
+    Append-only message log. Appends are buffered and group committed by a background thread,
+    so the event loop never writes or fsyncs. Reads use memory-mapped segments and a sparse index.
+    """
+
+    def __init__(self, directory, segment_bytes=16 * 2**20, retention_bytes=2**30, retention_seconds=7 * 24 * 3600,
+                 commit_interval=0.0, index_interval=64):
+        """
+        Open or create a message log, recovering from a torn tail if the last write was interrupted
+
+        Args:
+            directory (str): directory for segment files
+            segment_bytes (int, optional): size at which a new segment is started. Defaults to 16 MiB.
+            retention_bytes (int, optional): total size at which old segments are deleted. Defaults to 1 GiB.
+            retention_seconds (float, optional): age at which old segments are deleted. Defaults to 7 days.
+            commit_interval (float, optional): seconds to wait for more appends before each commit. Defaults to 0.
+            index_interval (int, optional): records between sparse index entries. Defaults to 64.
+        """
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.retention_bytes = retention_bytes
+        self.retention_seconds = retention_seconds
+        self.commit_interval = commit_interval
+        self.index_interval = index_interval
+
+        # List[Segment], oldest first, the last segment is the active one
+        self.segments = []
+        self._lock = threading.Lock()
+        self._pending = []
+        self._wakeup = threading.Event()
+        self._closed = False
+
+        os.makedirs(directory, exist_ok=True)
+        self._recover()
+        self._file = open(self.segments[-1].path, "ab")
+        self._thread = threading.Thread(target=self._commit_loop, name="message-log", daemon=True)
+        self._thread.start()
+
+    @property
+    def end(self):
+        """
+        Returns:
+            int: record number after the last committed record
+        """
+        active = self.segments[-1]
+        return active.base + active.count
+
+    def append(self, room, payload):
+        """
+        Queues a payload for the next group commit, safe to call from the event loop
+
+        Args:
+            room (str): room name
+            payload (str): encoded payload
+        """
+        room_bytes = room.encode("utf-8")
+        body = room_bytes + payload.encode("utf-8")
+        record = RECORD_HEADER.pack(len(body), zlib.crc32(body), len(room_bytes)) + body
+        with self._lock:
+            self._pending.append(record)
+        self._wakeup.set()
+
+    def flush(self):
+        """
+        Blocks until every queued payload has been committed, not for use on the event loop
+        """
+        done = threading.Event()
+        with self._lock:
+            self._pending.append(done)
+        self._wakeup.set()
+        done.wait()
+
+    def close(self):
+        """
+        Commits queued payloads and stops the commit thread
+        """
+        self._closed = True
+        self._wakeup.set()
+        self._thread.join()
+        self._file.close()
+
+    def read_from(self, record_number, count):
+        """
+        Reads consecutive committed records
+
+        Args:
+            record_number (int): first record number to read
+            count (int): maximum number of records
+
+        Returns:
+            List[Tuple[str, str]]: (room, payload) records
+        """
+        with self._lock:
+            segments = list(self.segments)
+        bases = [segment.base for segment in segments]
+        position = max(bisect.bisect_right(bases, record_number) - 1, 0)
+        record_number = max(record_number, segments[0].base)
+
+        records = []
+        for segment in segments[position:]:
+            if len(records) >= count:
+                break
+            if record_number >= segment.base + segment.count:
+                continue
+            self._ensure_index(segment)
+
+            # start from the closest indexed record at or before record_number
+            entry = segment.index[max(bisect.bisect_right(segment.index, (record_number, float("inf"))) - 1, 0)]
+            current = entry[0]
+            for room, payload in self._iter_records(segment, entry[1]):
+                if current >= record_number:
+                    records.append((room, payload))
+                    if len(records) >= count:
+                        break
+                current += 1
+            record_number = segment.base + segment.count
+        return records
+
+    def recent(self, room, count, max_records=5000):
+        """
+        Reads the most recent payloads for a room from the tail of the log
+
+        Args:
+            room (str): room name
+            count (int): maximum number of payloads
+            max_records (int, optional): maximum number of records scanned. Defaults to 5000.
+
+        Returns:
+            List[str]: up to count payloads, oldest first
+        """
+        if count <= 0:
+            return []
+        records = self.read_from(max(self.end - max_records, 0), max_records)
+        return [payload for record_room, payload in records if record_room == room][-count:]
+
+    def _iter_records(self, segment, position):
+        """
+        Iterates committed records in a segment from a file position using a memory map
+
+        Args:
+            segment (Segment): segment to read
+            position (int): file position of a record
+
+        Yields:
+            Tuple[str, str]: (room, payload)
+        """
+        size = segment.size
+        if size == 0 or position >= size:
+            return
+        try:
+            with open(segment.path, "rb") as file, mmap.mmap(file.fileno(), size, access=mmap.ACCESS_READ) as data:
+                while position < size:
+                    length, _, room_length = RECORD_HEADER.unpack_from(data, position)
+                    start = position + RECORD_HEADER.size
+                    room = data[start:start + room_length].decode("utf-8")
+                    payload = data[start + room_length:start + length].decode("utf-8")
+                    position = start + length
+                    yield room, payload
+        except FileNotFoundError:
+            # deleted by retention while reading
+            return
+
+    def _ensure_index(self, segment):
+        if segment.index is None:
+            segment.index = self._scan(segment)[2]
+
+    def _scan(self, segment):
+        """
+        Validates the records of a segment file
+
+        Args:
+            segment (Segment): segment to scan
+
+        Returns:
+            Tuple[int, int, List[Tuple[int, int]]]: valid size, valid record count, sparse index
+        """
+        index = [(segment.base, 0)]
+        file_size = os.path.getsize(segment.path)
+        if file_size == 0:
+            return 0, 0, index
+
+        position = count = 0
+        with open(segment.path, "rb") as file, mmap.mmap(file.fileno(), file_size, access=mmap.ACCESS_READ) as data:
+            while position + RECORD_HEADER.size <= file_size:
+                length, crc, room_length = RECORD_HEADER.unpack_from(data, position)
+                start = position + RECORD_HEADER.size
+                if start + length > file_size or room_length > length or zlib.crc32(data[start:start + length]) != crc:
+                    break
+                position = start + length
+                count += 1
+                if count % self.index_interval == 0:
+                    index.append((segment.base + count, position))
+        return position, count, index
+
+    def _recover(self):
+        """
+        Loads segments from disk. Only the last segment is scanned, earlier segments are
+        sized from the next segment's base and indexed lazily on first read.
+        """
+        bases = sorted(int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(self.directory)
+                       if name.endswith(SEGMENT_SUFFIX))
+        for base, next_base in zip(bases, bases[1:] + [None]):
+            segment = Segment(self.directory, base)
+            stat = os.stat(segment.path)
+            segment.size, segment.modified_at = stat.st_size, stat.st_mtime
+            if next_base is not None:
+                segment.count = next_base - base
+            self.segments.append(segment)
+
+        if not self.segments:
+            segment = Segment(self.directory, 0)
+            segment.index = [(0, 0)]
+            open(segment.path, "ab").close()
+            self.segments.append(segment)
+            return
+
+        active = self.segments[-1]
+        size, active.count, active.index = self._scan(active)
+        if size < active.size:
+            log_message(logger, f"Truncating torn tail of {active.path} at {size} of {active.size} bytes",
+                        logging.WARNING)
+            with open(active.path, "r+b") as file:
+                file.truncate(size)
+        active.size = size
+
+    def _commit_loop(self):
+        while True:
+            self._wakeup.wait()
+            if self.commit_interval > 0 and not self._closed:
+                time.sleep(self.commit_interval)
+            self._wakeup.clear()
+
+            with self._lock:
+                batch, self._pending = self._pending, []
+            try:
+                self._commit(batch)
+            except Exception as e:
+                log_message(logger, f"Message log commit failed: {repr(e)}", logging.ERROR)
+
+            if self._closed and not self._pending:
+                return
+
+    def _commit(self, batch):
+        """
+        Writes a batch of records with a single fsync per segment, then applies retention
+
+        Args:
+            batch (List[Union[bytes, threading.Event]]): records, and flush events to set once committed
+        """
+        waiters = []
+        written = 0
+        active = self.segments[-1]
+        size, count = active.size, active.count
+        new_index = []
+
+        for record in batch:
+            if isinstance(record, threading.Event):
+                waiters.append(record)
+                continue
+
+            if size > 0 and size + len(record) > self.segment_bytes:
+                self._sync(active, size, count, new_index)
+                active = self._rotate(active)
+                size, count, new_index = 0, 0, []
+
+            self._file.write(record)
+            size += len(record)
+            count += 1
+            written += 1
+            if count % self.index_interval == 0:
+                new_index.append((active.base + count, size))
+
+        if written:
+            self._sync(active, size, count, new_index)
+            self._apply_retention()
+        for waiter in waiters:
+            waiter.set()
+
+    def _sync(self, segment, size, count, new_index):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        with self._lock:
+            segment.size, segment.count, segment.modified_at = size, count, time.time()
+            if segment.index is not None:
+                segment.index.extend(new_index)
+
+    def _rotate(self, active):
+        self._file.close()
+        segment = Segment(self.directory, active.base + active.count)
+        segment.index = [(segment.base, 0)]
+        self._file = open(segment.path, "ab")
+        with self._lock:
+            self.segments.append(segment)
+        return segment
+
+    def _apply_retention(self):
+        now = time.time()
+        with self._lock:
+            total = sum(segment.size for segment in self.segments)
+            expired = []
+            while len(self.segments) > 1:
+                oldest = self.segments[0]
+                if total <= self.retention_bytes and now - oldest.modified_at <= self.retention_seconds:
+                    break
+                expired.append(self.segments.pop(0))
+                total -= oldest.size
+
+        for segment in expired:
+            os.remove(segment.path)
+            log_message(logger, f"Removed expired segment {segment.path}", logging.INFO)
+
+    def __repr__(self):
+        return f"<MessageLog {self.directory}, segments: {len(self.segments)}, records: {self.end}>"
@@ -0,0 +1,353 @@
+"""
+metrics provides counters, gauges and histograms, rendered in the Prometheus text exposition format.
+Updates are plain attribute arithmetic, safe without locks as everything runs on the event loop.
+"""
+import asyncio
+import bisect
+import logging
+import math
+from utils import log_message, call_stats
+
+logger = logging.getLogger(__name__)
+
+# seconds, suited to event loop work from tens of microseconds to seconds
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Metric:
+    """
+    Base for a named metric, optionally with labels. Values of each label combination live in a child.
+    """
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labels=()):
+        """
+        Args:
+            name (str): metric name, e.g. chat_messages_received_total
+            documentation (str): HELP text
+            labels (Tuple[str], optional): label names. Defaults to () (no labels).
+        """
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+
+        # Dict[Tuple[str], Metric] of children by label values, an unlabeled metric is its own value
+        self._children = {}
+
+    def labels(self, *values):
+        """
+        Args:
+            *values (str): label values in label name order
+
+        Returns:
+            Metric: child holding the value for these labels
+        """
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._child()
+        return child
+
+    def _child(self):
+        return type(self)(self.name, self.documentation)
+
+    def samples(self):
+        """
+        Yields:
+            Tuple[str, Dict[str, str], float]: sample name suffix, labels and value
+        """
+        if not self.label_names:
+            yield from self._samples({})
+            return
+        for values, child in self._children.items():
+            yield from child._samples(dict(zip(self.label_names, values)))
+
+    def _samples(self, labels):
+        raise NotImplementedError
+
+    def render(self, samples=None):
+        """
+        Args:
+            samples (Iterable[Tuple[str, Dict[str, str], float]], optional): samples to render.
+                Defaults to None (this metric's own).
+
+        Returns:
+            str: HELP, TYPE and sample lines
+        """
+        lines = [f"# HELP {self.name} {_escape_help(self.documentation)}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, labels, value in self.samples() if samples is None else samples:
+            lines.append(f"{self.name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """
+    Monotonically increasing value, or one read from a function when scraped, e.g. a count kept elsewhere
+    """
+    kind = "counter"
+
+    def __init__(self, name, documentation, labels=(), function=None):
+        """
+        Args:
+            function (Callable[[], float], optional): reads the value at scrape time. Defaults to None.
+        """
+        super().__init__(name, documentation, labels)
+        self.value = 0
+        self.function = function
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def _samples(self, labels):
+        yield "", labels, self.function() if self.function is not None else self.value
+
+
+class Gauge(Metric):
+    """
+    Value that can go up and down, or is computed by a function when scraped
+    """
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labels=(), function=None):
+        """
+        Args:
+            function (Callable[[], float], optional): computes the value at scrape time. Defaults to None.
+        """
+        super().__init__(name, documentation, labels)
+        self.value = 0
+        self.function = function
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def _samples(self, labels):
+        yield "", labels, self.function() if self.function is not None else self.value
+
+
+class Histogram(Metric):
+    """
+    Distribution of observations in cumulative buckets, with their sum and count
+    """
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        """
+        Args:
+            buckets (Tuple[float], optional): sorted bucket upper bounds. Defaults to DEFAULT_BUCKETS.
+        """
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+        # per bucket (not cumulative) counts, the last is +Inf
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def _child(self):
+        return Histogram(self.name, self.documentation, buckets=self.buckets)
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def _samples(self, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), self.counts):
+            cumulative += count
+            yield "_bucket", dict(labels, le=_format_value(bound)), cumulative
+        yield "_sum", labels, self.sum
+        yield "_count", labels, self.count
+
+
+class Registry:
+    """
+    Named metrics rendered together. Registering an existing name returns the existing metric,
+    except function metrics, which are rebound so the latest owner (e.g. Chatroom) is reported.
+    Under a supervisor every sample is labeled with its worker, and the samples other workers published
+    are rendered alongside this worker's, so any worker can be scraped for all of them.
+    """
+
+    def __init__(self):
+        # Dict[str, Metric] in registration order
+        self.metrics = {}
+        # worker index added to every sample as the worker label, None when not running under a supervisor
+        self.worker = None
+        # Dict[str, Dict[str, List[Tuple[str, Dict[str, str], float]]]], latest samples of other workers by bus node
+        self.peers = {}
+
+    def counter(self, name, documentation, labels=(), function=None):
+        counter = self._register(Counter(name, documentation, labels))
+        if function is not None:
+            counter.function = function
+        return counter
+
+    def gauge(self, name, documentation, labels=(), function=None):
+        gauge = self._register(Gauge(name, documentation, labels))
+        if function is not None:
+            gauge.function = function
+        return gauge
+
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def _register(self, metric):
+        existing = self.metrics.get(metric.name)
+        if existing is None:
+            self.metrics[metric.name] = metric
+            return metric
+        if type(existing) is not type(metric):
+            raise ValueError(f"Metric {metric.name} is already registered as a {existing.kind}")
+        return existing
+
+    def samples(self):
+        """
+        Returns:
+            Dict[str, List[Tuple[str, Dict[str, str], float]]]: this process's samples by metric name
+        """
+        if self.worker is None:
+            return {name: list(metric.samples()) for name, metric in self.metrics.items()}
+        worker = str(self.worker)
+        return {name: [(suffix, dict(labels, worker=worker), value) for suffix, labels, value in metric.samples()]
+                for name, metric in self.metrics.items()}
+
+    def render(self):
+        """
+        Returns:
+            str: every metric in the Prometheus text exposition format, with the samples of other workers
+        """
+        lines = []
+        for name, samples in self.samples().items():
+            for peer in self.peers.values():
+                samples.extend(peer.get(name, ()))
+            lines.append(self.metrics[name].render(samples))
+        return "\n".join(lines) + "\n"
+
+
+class LoopLagMonitor:
+    """
+    Measures event loop lag, how late a sleep wakes up beyond its interval
+    """
+
+    def __init__(self, histogram, gauge, interval=0.5):
+        """
+        Args:
+            histogram (Histogram): observes each lag measurement
+            gauge (Gauge): set to the latest lag
+            interval (float, optional): seconds between measurements. Defaults to 0.5.
+        """
+        self.histogram = histogram
+        self.gauge = gauge
+        self.interval = interval
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(loop.time() - expected, 0.0)
+            self.histogram.observe(lag)
+            self.gauge.set(lag)
+            if lag > 1.0:
+                log_message(logger, f"Event loop lagged {lag:.3f}s", logging.WARNING)
+
+
+class MetricsPublisher:
+    """
+    Periodically publishes this worker's samples to the other workers over the bus,
+    a scrape reports other workers' samples as of their last publish
+    """
+
+    def __init__(self, registry, bus, interval=5.0):
+        """
+        Args:
+            registry (Registry): registry to publish
+            bus (Bus): bus node of this worker
+            interval (float, optional): seconds between publishes. Defaults to 5.0.
+        """
+        self.registry = registry
+        self.bus = bus
+        self.interval = interval
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            _collect_call_stats()
+            try:
+                await self.bus.publish({"type": "metrics", "samples": self.registry.samples()})
+            except Exception as e:
+                log_message(logger, f"Could not publish metrics: {repr(e)}", logging.WARNING)
+            await asyncio.sleep(self.interval)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(f'{key}="{_escape_label(str(value))}"' for key, value in labels.items())
+    return "{" + pairs + "}"
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _escape_help(text):
+    return text.replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def _escape_label(text):
+    return text.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+# process wide registry, metrics are declared by the modules that update them
+REGISTRY = Registry()
+
+LOOP_LAG = REGISTRY.histogram("chat_event_loop_lag_seconds", "Event loop wakeup delay beyond the sleep interval")
+LOOP_LAG_LAST = REGISTRY.gauge("chat_event_loop_lag_last_seconds", "Most recent event loop lag measurement")
+
+# hot path call statistics recorded by utils.log(hot_path=True)
+REGISTRY.gauge("chat_hot_path_calls", "Calls of hot path functions", ("function",))
+REGISTRY.gauge("chat_hot_path_seconds", "Cumulative seconds spent in hot path functions", ("function",))
+
+
+def _collect_call_stats():
+    calls, seconds = REGISTRY.metrics["chat_hot_path_calls"], REGISTRY.metrics["chat_hot_path_seconds"]
+    for name, stats in call_stats.items():
+        calls.labels(name).set(stats.calls)
+        seconds.labels(name).set(stats.total_time)
+
+
+def render():
+    """
+    Returns:
+        str: the process wide registry in the Prometheus text exposition format
+    """
+    _collect_call_stats()
+    return REGISTRY.render()
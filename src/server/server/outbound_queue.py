@@ -0,0 +1,229 @@
+"""
+outbound_queue buffers outgoing payloads for a single connection and writes them from a dedicated task
+"""
+import asyncio
+import logging
+from collections import deque
+from enum import Enum
+from utils import log_message
+from response import Origin
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# totals over every queue, messages / frames is the coalescing ratio
+MESSAGES_WRITTEN = REGISTRY.counter("chat_outbound_messages_total", "Payloads written by outbound queues")
+FRAMES_WRITTEN = REGISTRY.counter("chat_outbound_frames_total", "Frames written by outbound queues")
+
+
+class SlowConsumerPolicy(Enum):
+    """What to do when a connection's outbound queue is full
+    """
+    DROP_OLDEST = "drop_oldest"
+    DROP_CHAT = "drop_chat"
+    DISCONNECT = "disconnect"
+
+
+# origins that are never dropped in favor of chat under DROP_CHAT
+PRIORITY_ORIGINS = frozenset({Origin.SERVER.value, Origin.PRIVATE.value})
+
+
+class OutboundQueue:
+    """
+    Bounded queue of encoded payloads for a websocket, drained by its own writer task
+    """
+
+    def __init__(self, websocket, max_size, policy=SlowConsumerPolicy.DROP_OLDEST, batch_interval=None,
+                 batch_bytes=16384):
+        """
+        Create a new outbound queue, call start() to begin writing
+
+        Args:
+            websocket (Websocket): connection to write to
+            max_size (int): maximum number of queued payloads
+            policy (SlowConsumerPolicy, optional): policy when full. Defaults to SlowConsumerPolicy.DROP_OLDEST.
+            batch_interval (float, optional): seconds to wait for more payloads to coalesce into one JSON array
+                frame. Defaults to None (one frame per payload).
+            batch_bytes (int, optional): maximum size of a coalesced frame. Defaults to 16384.
+        """
+        self.websocket = websocket
+        self.max_size = max_size
+        self.policy = policy
+        self.batch_interval = batch_interval
+        self.batch_bytes = batch_bytes
+        self.dropped = 0
+        self.closed = False
+
+        # sent counters, messages_sent / frames_sent is the coalescing ratio
+        self.messages_sent = 0
+        self.frames_sent = 0
+
+        # Deque[Tuple[str, str]] of (payload, origin)
+        self._queue = deque()
+        self._ready = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._writer = None
+
+    @property
+    def depth(self):
+        """
+        Number of payloads waiting to be written
+
+        Returns:
+            int: queue depth
+        """
+        return len(self._queue)
+
+    def start(self):
+        """
+        Starts the writer task
+        """
+        self._writer = asyncio.ensure_future(self._write_loop())
+
+    def put(self, payload, origin):
+        """
+        Queues a payload for writing, applying the slow consumer policy if the queue is full
+
+        Args:
+            payload (str): encoded payload
+            origin (str): origin value of the payload
+
+        Returns:
+            bool: whether the payload was queued
+        """
+        if self.closed:
+            return False
+
+        if len(self._queue) >= self.max_size and not self._make_room(origin):
+            self.dropped += 1
+            return False
+
+        self._queue.append((payload, origin))
+        self._idle.clear()
+        self._ready.set()
+        return True
+
+    async def flush(self):
+        """
+        Waits until every queued payload has been written (or the queue is closed)
+        """
+        if self._writer is not None:
+            await self._idle.wait()
+
+    async def stop(self):
+        """
+        Stops the writer task and discards anything still queued
+        """
+        self._close()
+        if self._writer is not None:
+            self._writer.cancel()
+            try:
+                await self._writer
+            except asyncio.CancelledError:
+                pass
+
+    def _make_room(self, origin):
+        """
+        Applies the slow consumer policy to a full queue
+
+        Args:
+            origin (str): origin value of the incoming payload
+
+        Returns:
+            bool: whether there is now room for the incoming payload
+        """
+        if self.policy == SlowConsumerPolicy.DROP_OLDEST:
+            self._queue.popleft()
+            self.dropped += 1
+            return True
+
+        if self.policy == SlowConsumerPolicy.DROP_CHAT:
+            # evict the oldest chat payload, keeping SERVER and PRIVATE messages
+            for index, (_, queued_origin) in enumerate(self._queue):
+                if queued_origin not in PRIORITY_ORIGINS:
+                    del self._queue[index]
+                    self.dropped += 1
+                    return True
+
+            # queue is all priority payloads, only make room for another priority payload
+            if origin in PRIORITY_ORIGINS:
+                self._queue.popleft()
+                self.dropped += 1
+                return True
+            return False
+
+        # DISCONNECT
+        log_message(logger, f"Slow consumer {self.websocket}, {self.depth} payloads queued, disconnecting",
+                    logging.WARNING)
+        self.dropped += len(self._queue)
+        self._close()
+        asyncio.ensure_future(self.websocket.close(code=1008, reason="slow consumer"))
+        return False
+
+    def _close(self):
+        self.closed = True
+        self._queue.clear()
+        self._idle.set()
+        self._ready.set()
+
+    async def _write_loop(self):
+        """
+        Writes queued payloads to the websocket in order until closed
+        """
+        try:
+            while not self.closed:
+                if not self._queue:
+                    self._idle.set()
+                    self._ready.clear()
+                    await self._ready.wait()
+                    continue
+
+                payload, _ = self._queue.popleft()
+                if self.batch_interval is None:
+                    self.messages_sent += 1
+                    MESSAGES_WRITTEN.inc()
+                else:
+                    payload = await self._coalesce(payload)
+                await self.websocket.send(payload)
+                self.frames_sent += 1
+                FRAMES_WRITTEN.inc()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log_message(logger, f"Outbound writer for {self.websocket} stopped: {repr(e)}", logging.WARNING)
+            self._close()
+
+    async def _coalesce(self, first):
+        """
+        Waits batch_interval for more payloads, then combines queued payloads up to batch_bytes into one frame
+
+        Args:
+            first (Union[str, bytes]): payload already taken from the queue
+
+        Returns:
+            Union[str, bytes]: first if nothing else was queued, otherwise a JSON array or concatenated binary frame
+        """
+        if self.batch_interval > 0:
+            await asyncio.sleep(self.batch_interval)
+
+        payloads, size = [first], len(first)
+        while self._queue and size + len(self._queue[0][0]) <= self.batch_bytes:
+            payload, _ = self._queue.popleft()
+            payloads.append(payload)
+            size += len(payload)
+        self.messages_sent += len(payloads)
+        MESSAGES_WRITTEN.inc(len(payloads))
+
+        if len(payloads) == 1:
+            return first
+
+        # binary records are self delimiting, a batch is their concatenation
+        if isinstance(first, bytes):
+            return b"".join(payloads)
+
+        # payloads are JSON objects or arrays (e.g. history), arrays are flattened into the batch
+        return f"[{','.join([payload[1:-1] if payload[0] == '[' else payload for payload in payloads])}]"
+
+    def __repr__(self):
+        return f"<OutboundQueue depth: {self.depth}/{self.max_size}, dropped: {self.dropped}, {self.policy.value}>"
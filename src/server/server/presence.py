@@ -0,0 +1,106 @@
+"""
+presence tracks users connected to other server nodes, as reported over the bus
+"""
+
+
+class RemotePresence:
+    """
+    Directory of users on other nodes, indexed by name and by room
+    """
+
+    def __init__(self):
+        # Dict[str, Tuple[str, str]], name -> (node id, room name)
+        self.users = dict()
+
+        # Dict[str, Dict[str, None]], room name -> ordered set of names
+        self.rooms = dict()
+
+    def add(self, name, node, room):
+        """
+        Records a user connected to another node
+
+        Args:
+            name (str): user name
+            node (str): node id the user is connected to
+            room (str): room the user is in
+        """
+        self.remove(name)
+        self.users[name] = (node, room)
+        self.rooms.setdefault(room, dict())[name] = None
+
+    def remove(self, name):
+        """
+        Forgets a remote user if known
+
+        Args:
+            name (str): user name
+        """
+        entry = self.users.pop(name, None)
+        if entry is None:
+            return
+        names = self.rooms[entry[1]]
+        names.pop(name, None)
+        if not names:
+            del self.rooms[entry[1]]
+
+    def rename(self, old_name, new_name):
+        """
+        Renames a remote user
+
+        Args:
+            old_name (str): name before change
+            new_name (str): name after change
+        """
+        entry = self.users.get(old_name)
+        if entry is not None:
+            self.remove(old_name)
+            self.add(new_name, *entry)
+
+    def move(self, name, room):
+        """
+        Moves a remote user to another room
+
+        Args:
+            name (str): user name
+            room (str): new room name
+        """
+        entry = self.users.get(name)
+        if entry is not None:
+            self.add(name, entry[0], room)
+
+    def drop_node(self, node):
+        """
+        Forgets every user connected to a node
+
+        Args:
+            node (str): node id
+        """
+        for name in [name for name, entry in self.users.items() if entry[0] == node]:
+            self.remove(name)
+
+    def node_of(self, name):
+        """
+        Args:
+            name (str): user name
+
+        Returns:
+            str: node id the user is connected to, or None if not a known remote user
+        """
+        entry = self.users.get(name)
+        return entry[0] if entry is not None else None
+
+    def names_in(self, room):
+        """
+        Args:
+            room (str): room name
+
+        Returns:
+            List[str]: names of remote users in the room
+        """
+        return list(self.rooms.get(room, ()))
+
+    def __contains__(self, name):
+        return name in self.users
+
+    def __len__(self):
+        return len(self.users)
@@ -0,0 +1,181 @@
+"""
+rate_limit provides token bucket limits on incoming messages, keyed by connection or source address
+"""
+import time
+from collections import OrderedDict
+from enum import Enum
+
+
+class RateLimitAction(Enum):
+    """What to do with a message that exceeds a rate limit
+    """
+    # drop the message and tell the sender
+    WARN = "warn"
+    # delay the message until the limit allows it, which stops reading from the socket meanwhile
+    THROTTLE = "throttle"
+    # close the connection
+    DISCONNECT = "disconnect"
+
+
+# buckets examined for expiry on each acquire
+SWEEP_STEP = 2
+
+
+class Buckets:
+    """
+    Message, byte and command token buckets of one key, refilled lazily from the last update time
+    """
+    __slots__ = ("messages", "bytes", "commands", "updated")
+
+    def __init__(self, messages, bytes, commands, updated):
+        self.messages = messages
+        self.bytes = bytes
+        self.commands = commands
+        self.updated = updated
+
+
+class RateLimiter:
+    """
+    Token bucket rate limiter. Buckets start full, hold burst seconds worth of tokens,
+    and are removed once idle long enough to have refilled, so state is only kept for active keys.
+    """
+
+    def __init__(self, messages_per_second=0, bytes_per_second=0, commands_per_second=0, burst=2.0):
+        """
+        Create a rate limiter, a rate of 0 is unlimited
+
+        Args:
+            messages_per_second (float, optional): sustained messages per second. Defaults to 0.
+            bytes_per_second (float, optional): sustained message bytes per second. Defaults to 0.
+            commands_per_second (float, optional): sustained commands per second. Defaults to 0.
+            burst (float, optional): seconds of sustained rate that may be sent at once. Defaults to 2.0.
+        """
+        self.messages_per_second = messages_per_second
+        self.bytes_per_second = bytes_per_second
+        self.commands_per_second = commands_per_second
+        self.burst = burst
+
+        # bucket capacities, at least one message's worth so the limit can always be met eventually
+        self.max_messages = max(messages_per_second * burst, 1)
+        self.max_bytes = max(bytes_per_second * burst, 1)
+        self.max_commands = max(commands_per_second * burst, 1)
+
+        # time for an empty bucket to refill, an idle bucket is dropped after this as it is full again
+        self.idle_timeout = max([capacity / rate for capacity, rate in (
+            (self.max_messages, messages_per_second), (self.max_bytes, bytes_per_second),
+            (self.max_commands, commands_per_second)) if rate > 0], default=0.0)
+
+        # OrderedDict[Hashable, Buckets], least recently swept first
+        self._buckets = OrderedDict()
+
+    def acquire(self, key, size, command=False, now=None):
+        """
+        Takes tokens for a message if every applicable bucket has enough
+
+        Args:
+            key (Hashable): connection or address the message came from
+            size (int): message length
+            command (bool, optional): whether the message is a command. Defaults to False.
+            now (float, optional): monotonic time. Defaults to None (current time).
+
+        Returns:
+            float: 0 if the message is allowed, otherwise seconds until it would be. No tokens are taken if limited.
+        """
+        wait = self.check(key, size, command, now)
+        if wait == 0:
+            self.debit(key, size, command)
+        return wait
+
+    def check(self, key, size, command=False, now=None):
+        """
+        Refills a key's buckets and reports whether a message fits, without taking any tokens,
+        so several limiters can be checked before any of them is debited
+
+        Args:
+            key (Hashable): connection or address the message came from
+            size (int): message length
+            command (bool, optional): whether the message is a command. Defaults to False.
+            now (float, optional): monotonic time. Defaults to None (current time).
+
+        Returns:
+            float: 0 if the message is allowed, otherwise seconds until it would be.
+        """
+        if now is None:
+            now = time.monotonic()
+        self._sweep(now)
+
+        buckets = self._buckets.get(key)
+        if buckets is None:
+            buckets = self._buckets[key] = Buckets(self.max_messages, self.max_bytes, self.max_commands, now)
+        else:
+            elapsed = now - buckets.updated
+            buckets.messages = min(buckets.messages + elapsed * self.messages_per_second, self.max_messages)
+            buckets.bytes = min(buckets.bytes + elapsed * self.bytes_per_second, self.max_bytes)
+            buckets.commands = min(buckets.commands + elapsed * self.commands_per_second, self.max_commands)
+            buckets.updated = now
+
+        return max(
+            _wait(buckets.messages, 1, self.messages_per_second),
+            _wait(buckets.bytes, min(size, self.max_bytes), self.bytes_per_second),
+            _wait(buckets.commands, 1, self.commands_per_second) if command else 0.0)
+
+    def debit(self, key, size, command=False):
+        """
+        Takes tokens for an accepted message from the buckets refilled by the preceding check
+
+        Args:
+            key (Hashable): connection or address the message came from
+            size (int): message length
+            command (bool, optional): whether the message is a command. Defaults to False.
+        """
+        buckets = self._buckets.get(key)
+        if buckets is None:
+            return
+        buckets.messages -= 1
+        buckets.bytes -= min(size, self.max_bytes)
+        if command:
+            buckets.commands -= 1
+
+    def forget(self, key):
+        """
+        Removes a key's buckets, e.g. when its connection closes
+
+        Args:
+            key (Hashable): connection or address
+        """
+        self._buckets.pop(key, None)
+
+    def _sweep(self, now):
+        """
+        Examines the oldest few buckets, removing those idle long enough to be full again
+        and moving the rest to the back, so every bucket is revisited without a full scan
+
+        Args:
+            now (float): monotonic time
+        """
+        for _ in range(min(SWEEP_STEP, len(self._buckets))):
+            key, buckets = self._buckets.popitem(last=False)
+            if now - buckets.updated < self.idle_timeout:
+                self._buckets[key] = buckets
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def __repr__(self):
+        return (f"<RateLimiter {self.messages_per_second} msg/s, {self.bytes_per_second} B/s, "
+                f"{self.commands_per_second} cmd/s, keys: {len(self)}>")
+
+
+def _wait(tokens, cost, rate):
+    """
+    Args:
+        tokens (float): tokens in a bucket
+        cost (float): tokens needed
+        rate (float): refill rate per second, 0 for unlimited
+
+    Returns:
+        float: seconds until the bucket holds cost tokens
+    """
+    if rate <= 0 or tokens >= cost:
+        return 0.0
+    return (cost - tokens) / rate
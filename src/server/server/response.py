@@ -1,6 +1,18 @@
 import datetime
 import json
+import struct
+import sys
 from enum import Enum
+from clock import CoarseClock
+
+SENT_AT_FORMAT = "%m/%d/%Y, %H:%M:%S"
+
+# shared by every response, sentAt is formatted at most once per second
+CLOCK = CoarseClock(SENT_AT_FORMAT)
+
+# binary record header: origin code, sent at in epoch milliseconds, room sequence number (0 for none),
+# utf-8 body length
+BINARY_HEADER = struct.Struct("!BQII")
 
 
 class Origin(Enum):
@@ -11,25 +23,263 @@ class Origin(Enum):
     USER = "USER"
     SELF = "SELF"
     PRIVATE = "PRIVATE"
+    # session resume token for the client, not displayed
+    SESSION = "SESSION"
+
+
+# small integer codes for origins in the binary wire format, in Origin declaration order
+ORIGIN_CODES = {origin.value: code for code, origin in enumerate(Origin)}
+ORIGIN_BY_CODE = tuple(sys.intern(origin.value) for origin in Origin)
+
+# interned origin values, and their JSON encodings
+ORIGIN_VALUES = {origin.value: sys.intern(origin.value) for origin in Origin}
+ORIGIN_JSON = {origin.value: json.dumps(origin.value) for origin in Origin}
+
+
+class Subprotocol(Enum):
+    """Websocket subprotocols a client may request to opt in to optional wire features.
+    Declared in order of server preference.
+    """
+    BINARY = "chat.bin"
+    BATCH = "chat.batch"
 
 
 class Response:
+    """Immutable chat message with its time sent, and its room sequence number if it is kept in a room's history.
+    Encodings are computed on first use and cached.
+    """
+    __slots__ = ("_body", "_origin", "_sent_at", "_sent_at_ms", "_seq", "_encoded_body", "_json", "_binary")
 
-    def __init__(self, body, origin=Origin.DEFAULT):
+    def __init__(self, body, origin=Origin.DEFAULT, seq=None):
         """Creates a new response
 
         Args:
             body (str): response body
             origin (Origin, optional): Origin of body. Defaults to Origin.DEFAULT.
+            seq (int, optional): sequence number in the room's history. Defaults to None.
+        """
+        self._sent_at, self._sent_at_ms = CLOCK.now()
+        self._body = str(body)
+        # _value_ is a plain attribute, Origin.value goes through a descriptor
+        self._origin = origin._value_
+        self._seq = seq
+
+        # lazily computed encodings, a Response is serialized at most once per format
+        self._encoded_body = None
+        self._json = None
+        self._binary = None
+
+    @property
+    def body(self):
+        """
+        Returns:
+            str: response body
         """
-        self.data = {
-            "body": str(body),
-            "origin": origin.value,
-            "sentAt": str(datetime.datetime.now().strftime("%m/%d/%Y, %H:%M:%S"))
-        }
+        return self._body
+
+    @property
+    def origin(self):
+        """
+        Returns:
+            str: Origin value of the response, e.g. "USER"
+        """
+        return self._origin
+
+    @property
+    def sent_at(self):
+        """
+        Returns:
+            str: local time the response was sent, formatted with SENT_AT_FORMAT
+        """
+        return self._sent_at
+
+    @property
+    def sent_at_ms(self):
+        """
+        Returns:
+            int: time the response was sent in epoch milliseconds, for latency measurement
+        """
+        return self._sent_at_ms
+
+    @property
+    def seq(self):
+        """
+        Returns:
+            int: sequence number in the room's history, None if the response is not kept in history
+        """
+        return self._seq
+
+    @property
+    def data(self):
+        """
+        Returns:
+            dict: new dict of the response's JSON fields, body, origin, sentAt and seq if it has one
+        """
+        data = {"body": self._body, "origin": self._origin, "sentAt": self._sent_at}
+        if self._seq is not None:
+            data["seq"] = self._seq
+        return data
+
+    @classmethod
+    def from_data(cls, data, sent_at_ms=None, seq=None):
+        """Recreates a response from its data, e.g. one received from another server node.
+        Unlike the constructor, keeps the original sentAt.
+
+        Args:
+            data (dict): response data with body, origin and sentAt
+            sent_at_ms (int, optional): sent at in epoch milliseconds. Defaults to None (parsed from sentAt).
+            seq (int, optional): sequence number in this node's room history, a seq in data is from another node
+                or an earlier room and is dropped. Defaults to None.
+
+        Returns:
+            Response: response with the values of data
+        """
+        response = cls.__new__(cls)
+        response._body = str(data["body"])
+        # known origins share the interned value, so comparisons are identity checks
+        response._origin = ORIGIN_VALUES.get(data["origin"], data["origin"])
+        response._sent_at = data["sentAt"]
+        if sent_at_ms is None:
+            sent_at_ms = int(datetime.datetime.strptime(data["sentAt"], SENT_AT_FORMAT).timestamp() * 1000)
+        response._sent_at_ms = sent_at_ms
+        response._seq = seq
+        response._encoded_body = None
+        response._json = None
+        response._binary = None
+        return response
+
+    @classmethod
+    def from_json(cls, payload, seq=None):
+        """Recreates a response from its JSON encoding, e.g. one read from the message log
+
+        Args:
+            payload (str): JSON encoded response
+            seq (int, optional): sequence number, see from_data. Defaults to None.
+
+        Returns:
+            Response: decoded response, with its encoding cached if it is unchanged
+        """
+        data = json.loads(payload)
+        response = cls.from_data(data, seq=seq)
+        if data.get("seq") == seq:
+            response._json = payload
+        return response
+
+    @classmethod
+    def from_binary(cls, frame):
+        """Decodes the responses in a chat.bin frame, a single record or a batch of concatenated records
+
+        Args:
+            frame (bytes): binary encoded responses, see binary
+
+        Returns:
+            List[Response]: decoded responses, in frame order
+        """
+        responses = []
+        offset = 0
+        while offset < len(frame):
+            code, sent_at_ms, seq, length = BINARY_HEADER.unpack_from(frame, offset)
+            offset += BINARY_HEADER.size
+            body = frame[offset:offset + length].decode("utf-8")
+            offset += length
+            data = {
+                "body": body,
+                "origin": ORIGIN_BY_CODE[code],
+                "sentAt": datetime.datetime.fromtimestamp(sent_at_ms / 1000).strftime(SENT_AT_FORMAT)
+            }
+            responses.append(cls.from_data(data, sent_at_ms=sent_at_ms, seq=seq or None))
+        return responses
+
+    def with_origin(self, origin):
+        """Creates a copy of this response with a different origin.
+        The copy shares the encoded body, so only the origin needs to be encoded again.
+
+        Args:
+            origin (Origin): Origin of the copy
+
+        Returns:
+            Response: copy of this response with the given origin
+        """
+        return self._copy(origin._value_, self._sent_at, self._sent_at_ms, self._seq)
+
+    def with_seq(self, seq):
+        """Creates a copy of this response with a sequence number, e.g. when it is added to a room's history
+
+        Args:
+            seq (int): sequence number of the copy
+
+        Returns:
+            Response: copy of this response with the given sequence number
+        """
+        return self._copy(self._origin, self._sent_at, self._sent_at_ms, seq)
+
+    def restamp(self):
+        """Creates a copy of this response sent now.
+        The copy shares the encoded body, so constant responses can be reused cheaply.
+
+        Returns:
+            Response: copy of this response with the current sentAt
+        """
+        return self._copy(self._origin, *CLOCK.now(), self._seq)
+
+    def _copy(self, origin, sent_at, sent_at_ms, seq):
+        copy = Response.__new__(Response)
+        copy._body = self._body
+        copy._origin = origin
+        copy._sent_at = sent_at
+        copy._sent_at_ms = sent_at_ms
+        copy._seq = seq
+        copy._encoded_body = self._encode_body()
+        copy._json = None
+        copy._binary = None
+        return copy
 
     def json(self):
-        return json.dumps(self.data)
+        """Serializes the response to JSON, the result is cached so sending the same
+        Response to many connections only serializes it once
+
+        Returns:
+            str: JSON encoded response
+        """
+        if self._json is None:
+            # equivalent to json.dumps(self.data), but reuses the encoded body and origin
+            origin = ORIGIN_JSON.get(self._origin) or json.dumps(self._origin)
+            seq = f", \"seq\": {self._seq}" if self._seq is not None else ""
+            self._json = (f"{{\"body\": {self._encode_body()}, "
+                          f"\"origin\": {origin}, "
+                          f"\"sentAt\": {json.dumps(self._sent_at)}{seq}}}")
+        return self._json
+
+    def binary(self):
+        """Serializes the response to the compact binary format negotiated by the chat.bin subprotocol:
+        origin code (uint8), sent at epoch milliseconds (uint64), sequence number or 0 (uint32),
+        body length (uint32), utf-8 body.
+        Records are self delimiting, so a batch is a concatenation of records. The result is cached.
+
+        Returns:
+            bytes: binary encoded response
+        """
+        if self._binary is None:
+            body = self._body.encode("utf-8")
+            self._binary = BINARY_HEADER.pack(
+                ORIGIN_CODES[self._origin], self._sent_at_ms, self._seq or 0, len(body)) + body
+        return self._binary
+
+    def encode(self, binary=False):
+        """Serializes the response in the wire format of a connection
+
+        Args:
+            binary (bool, optional): whether to use the binary format. Defaults to False (JSON).
+
+        Returns:
+            Union[str, bytes]: encoded response
+        """
+        return self.binary() if binary else self.json()
+
+    def _encode_body(self):
+        if self._encoded_body is None:
+            self._encoded_body = json.dumps(self._body)
+        return self._encoded_body
 
     def __str__(self):
         return self.json()
@@ -0,0 +1,196 @@
+"""
+room defines named groups of connections and the registry that creates and evicts them
+"""
+import re
+import time
+import logging
+from utils import log_message
+from history import MessageHistory
+
+logger = logging.getLogger(__name__)
+
+
+class Room:
+    """
+    A named group of connections, broadcasts are scoped to a room's members
+    """
+
+    def __init__(self, name, history_size=0, history_bytes=None):
+        """
+        Create a new, empty room
+
+        Args:
+            name (str): room name
+            history_size (int, optional): number of recent messages kept. Defaults to 0.
+            history_bytes (int, optional): memory budget for recent messages, in bytes. Defaults to None (unbounded).
+        """
+        self.name = name
+        self.history = MessageHistory(history_size, history_bytes)
+
+        # sequence number of the last broadcast to the room, clients resume from the last one they received
+        self.seq = 0
+
+        # Dict[Websocket, User]
+        self.members = dict()
+
+        # cached "!who" listing for this room
+        self._who_cache = None
+
+    def get_who(self):
+        """
+        Lists room members, the listing is cached until membership or names change
+
+        Returns:
+            str: comma separated names of members
+        """
+        if self._who_cache is None:
+            self._who_cache = ", ".join([user.name for user in self.members.values()])
+        return self._who_cache
+
+    def next_seq(self):
+        """
+        Returns:
+            int: sequence number for the next broadcast to the room
+        """
+        self.seq += 1
+        return self.seq
+
+    def invalidate(self):
+        """
+        Invalidates cached data derived from members, call after a member changes their name
+        """
+        self._who_cache = None
+
+    def __len__(self):
+        return len(self.members)
+
+    def __repr__(self):
+        return f"<Room {self.name}, members: {len(self.members)}>"
+
+
+class RoomRegistry:
+    """
+    Creates rooms lazily on join and evicts them once they have been empty for idle_timeout seconds
+    """
+
+    def __init__(self, default_room="lobby", idle_timeout=300, pattern="^[A-Za-z0-9_-]{1,32}$",
+                 history_size=0, history_bytes=None):
+        """
+        Create a new room registry
+
+        Args:
+            default_room (str, optional): room for connections without a valid room. Defaults to "lobby".
+            idle_timeout (float, optional): seconds an empty room is kept before eviction. Defaults to 300.
+            pattern (str, optional): regex pattern for a valid room name. Defaults to "^[A-Za-z0-9_-]{1,32}$".
+            history_size (int, optional): number of recent messages kept per room. Defaults to 0.
+            history_bytes (int, optional): memory budget for recent messages per room, in bytes.
+                Defaults to None (unbounded).
+        """
+        self.default_room = default_room
+        self.idle_timeout = idle_timeout
+        self.history_size = history_size
+        self.history_bytes = history_bytes
+        self._regex = re.compile(pattern)
+
+        # Dict[str, Room]
+        self.rooms = dict()
+
+        # Dict[str, float], empty rooms -> time they became empty, in order of becoming empty
+        self._empty = dict()
+
+    def room_name(self, name):
+        """
+        Normalizes a requested room name or websocket path to a room name
+
+        Args:
+            name (str): requested name or path, e.g. "/general". May be None.
+
+        Returns:
+            str: normalized room name, or the default room if name is missing or invalid
+        """
+        if name is None:
+            return self.default_room
+        name = name.split("?", 1)[0].strip("/").lower()
+        if not self._regex.match(name):
+            return self.default_room
+        return name
+
+    def get(self, name):
+        """
+        Args:
+            name (str): room name
+
+        Returns:
+            Room: room with the given name, or None if it doesn't exist
+        """
+        return self.rooms.get(name)
+
+    def join(self, name, websocket, user):
+        """
+        Adds a connection to a room, creating the room if needed
+
+        Args:
+            name (str): normalized room name
+            websocket (Websocket): connection joining the room
+            user (User): user for the connection
+
+        Returns:
+            Room: the joined room
+        """
+        self.evict_idle()
+        room = self.rooms.get(name)
+        if room is None:
+            room = Room(name, self.history_size, self.history_bytes)
+            self.rooms[name] = room
+            log_message(logger, f"Created room {name}", logging.INFO)
+
+        self._empty.pop(name, None)
+        room.members[websocket] = user
+        room.invalidate()
+        return room
+
+    def leave(self, room, websocket):
+        """
+        Removes a connection from a room, the room becomes eligible for eviction once empty
+
+        Args:
+            room (Room): room to leave
+            websocket (Websocket): connection leaving the room
+        """
+        room.members.pop(websocket, None)
+        room.invalidate()
+        if not room.members and room.name != self.default_room:
+            self._empty.pop(room.name, None)
+            self._empty[room.name] = time.monotonic()
+        self.evict_idle()
+
+    def evict_idle(self, now=None):
+        """
+        Evicts rooms that have been empty for longer than idle_timeout.
+        Rooms are tracked in the order they became empty, so this only touches evictable rooms.
+
+        Args:
+            now (float, optional): current time.monotonic(). Defaults to None (now).
+
+        Returns:
+            int: number of evicted rooms
+        """
+        now = time.monotonic() if now is None else now
+        evicted = 0
+        while self._empty:
+            name, emptied_at = next(iter(self._empty.items()))
+            if now - emptied_at < self.idle_timeout:
+                break
+            del self._empty[name]
+            del self.rooms[name]
+            evicted += 1
+
+        if evicted:
+            log_message(logger, f"Evicted {evicted} idle rooms", logging.INFO)
+        return evicted
+
+    def __len__(self):
+        return len(self.rooms)
+
+    def __repr__(self):
+        return f"<RoomRegistry rooms: {len(self.rooms)}, empty: {len(self._empty)}>"
@@ -1,12 +1,26 @@
 import asyncio
+import os
+import signal
+from http import HTTPStatus
 import websockets
 import logging
 from chatroom import Chatroom
+from response import Response, Origin, Subprotocol
+from bus import BrokerBus
+from supervisor import Supervisor
+from compression import create_compression
+from rate_limit import RateLimiter, RateLimitAction
+import metrics
 from utils import log, log_message
 from config_manager import ConfigManager
 
 logger = logging.getLogger(__name__)
 
+RATE_LIMIT_WARNING = "You are sending messages too fast, your message was not delivered"
+
+# websockets.serve keyword arguments that can be set in the websocket section of server.yaml
+WEBSOCKET_OPTIONS = ("max_size", "max_queue", "read_limit", "write_limit", "ping_interval", "ping_timeout")
+
 
 class Server:
 
@@ -21,20 +35,145 @@ class Server:
         self.host = self.config["host"]
         self.port = self.config["port"]
         self.max_message_len = self.config.get("max_message_len", -1)
+
+        # worker processes sharing the port, 0 for one per core
+        self.workers = self.config.get("workers", 1) or os.cpu_count()
+        self.bus_path = self.config.get("bus_path", "/tmp/chatroom-bus.sock")
+
+        # per connection buffer and keepalive settings, the library defaults buffer up to ~32 MiB per connection
+        websocket_config = self.config.get("websocket", {})
+        self.websocket_options = {key: websocket_config[key] for key in WEBSOCKET_OPTIONS if key in websocket_config}
+
+        # optional wire features clients can negotiate, clients requesting none get plain JSON frames
+        self.subprotocols = [protocol.value for protocol in Subprotocol]
+
+        # permessage-deflate negotiated with clients, None if disabled
+        self.compression = create_compression(self.config.get("compression"))
+
+        # token bucket limits on incoming messages per connection and per source address, None if disabled
+        rate_limit_config = self.config.get("rate_limit", {})
+        self.connection_limiter = self.address_limiter = None
+        if rate_limit_config.get("enabled", False):
+            burst = rate_limit_config.get("burst", 2.0)
+            self.connection_limiter = RateLimiter(burst=burst, **rate_limit_config.get("connection", {}))
+            self.address_limiter = RateLimiter(burst=burst, **rate_limit_config.get("address", {}))
+        self.rate_limit_action = RateLimitAction(rate_limit_config.get("action", RateLimitAction.THROTTLE.value))
+
+        # metrics are served over plain HTTP on the websocket port, a room with the same name can't be joined by path
+        metrics_config = self.config.get("metrics", {})
+        self.metrics_path = metrics_config.get("path", "/metrics") if metrics_config.get("enabled", False) else None
+        self.lag_monitor = metrics.LoopLagMonitor(
+            metrics.LOOP_LAG, metrics.LOOP_LAG_LAST, metrics_config.get("lag_interval", 0.5))
+        # workers share their samples over the bus, as a scrape reaches whichever worker accepts it
+        self.metrics_publish_interval = metrics_config.get("publish_interval", 5.0)
+        self.metrics_publisher = None
+        # seconds a shutdown waits for connections to close before aborting them
+        self.drain_deadline = self.config.get("drain", {}).get("deadline", 8.0)
+        self.websocket_server = None
         self.running = False
         self.handler = handler
 
+        # parked sessions live in the memory of the worker that issued them, while SO_REUSEPORT hands a reconnect
+        # to any worker, so most resumes would fail and fall back to a join and leave
+        if self.workers > 1 and getattr(handler, "sessions", None) is not None:
+            log_message(logger, f"Session resume requires workers: 1, disabled with {self.workers} workers",
+                        logging.WARNING)
+            handler.sessions = None
+
     @log(logger, logging.INFO)
     def start(self):
         """
-        Starts the server
+        Starts the server, in worker processes under a supervisor if more than one worker is configured
         """
         self.running = True
-        start_server_async = websockets.serve(self.ws_handler_async, self.host, self.port)
-        asyncio.get_event_loop().run_until_complete(start_server_async)
+        if self.workers > 1:
+            # workers get SIGTERM from the supervisor and drain themselves, so allow them the deadline to exit
+            supervisor = Supervisor(
+                self.run_worker, self.workers, self.bus_path, shutdown_timeout=self.drain_deadline + 1)
+            self.on_signal(signal.SIGTERM, supervisor.stop)
+            asyncio.get_event_loop().run_until_complete(supervisor.run())
+            return
+
+        asyncio.get_event_loop().run_until_complete(self.handler.handle_startup())
+        asyncio.get_event_loop().run_until_complete(self.serve())
+        self.lag_monitor.start()
+        self.on_signal(signal.SIGTERM, self.begin_stop)
         asyncio.get_event_loop().run_forever()
 
-    @log(logger, logging.INFO)
+    def run_worker(self, index, bus_path):
+        """
+        Worker process entrypoint, serves on the shared port with SO_REUSEPORT
+        and relays chat events to the other workers through the broker
+
+        Args:
+            index (int): worker index
+            bus_path (str): broker unix socket path
+        """
+        # the forked loop belongs to the supervisor, workers need their own
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+
+        self.handler.attach_bus(BrokerBus(bus_path))
+        loop.run_until_complete(self.handler.handle_startup(worker=index, workers=self.workers))
+        loop.run_until_complete(self.serve(reuse_port=True))
+        self.lag_monitor.start()
+        if self.metrics_path is not None:
+            metrics.REGISTRY.worker = index
+            self.metrics_publisher = metrics.MetricsPublisher(
+                metrics.REGISTRY, self.handler.bus, self.metrics_publish_interval)
+            self.metrics_publisher.start()
+        self.on_signal(signal.SIGTERM, self.begin_stop)
+        log_message(logger, f"Worker {index} (pid {os.getpid()}) serving on {self.host}:{self.port}", logging.INFO)
+        loop.run_forever()
+
+    async def serve(self, host=None, port=None, **options):
+        """
+        Starts accepting connections on the current event loop, the handler must already be started
+
+        Args:
+            host (str, optional): address to bind. Defaults to None (configured host).
+            port (int, optional): port to bind, 0 for any free port. Defaults to None (configured port).
+            **options: additional websockets.serve keyword arguments
+
+        Returns:
+            WebSocketServer: the listening server
+        """
+        host = self.host if host is None else host
+        port = self.port if port is None else port
+        self.websocket_server = await websockets.serve(
+            self.ws_handler_async, host, port, **self.serve_options(), **options)
+        return self.websocket_server
+
+    def serve_options(self):
+        """
+        Returns:
+            dict: keyword arguments for websockets.serve shared by every way of running the server
+        """
+        return {
+            "subprotocols": self.subprotocols,
+            "process_request": self.process_request if self.metrics_path is not None else None,
+            # compression=None stops websockets adding its default deflate extension
+            "compression": None,
+            "extensions": [self.compression] if self.compression is not None else None,
+            **self.websocket_options
+        }
+
+    async def process_request(self, path, request_headers):
+        """
+        Answers plain HTTP requests for metrics before the websocket handshake
+
+        Args:
+            path (str): request path
+            request_headers (Headers): request headers
+
+        Returns:
+            Tuple[HTTPStatus, List[Tuple[str, str]], bytes]: metrics response, or None to continue the handshake
+        """
+        if path.split("?", 1)[0] != self.metrics_path:
+            return None
+        return HTTPStatus.OK, [("Content-Type", metrics.CONTENT_TYPE)], metrics.render().encode("utf-8")
+
+    @log(logger, logging.INFO, redact=("path",))
     async def ws_handler_async(self, websocket, path):
         """
         Async websocket handler
@@ -44,8 +183,8 @@ class Server:
             path (str): incoming connection resource path
         """
 
-        # new connection
-        await self.handler.handle_connection(websocket)
+        # new connection, path selects the room
+        await self.handler.handle_connection(websocket, path=path)
         try:
 
             # message in connection
@@ -53,9 +192,11 @@ class Server:
 
                 # If max_message_len is a valid value, slice message before handling
                 if self.max_message_len >= 0:
-                    await self.handler.handle_message(websocket, message[:self.max_message_len])
-                else:
-                    await self.handler.handle_message(websocket, message)
+                    message = message[:self.max_message_len]
+
+                if self.connection_limiter is not None and not await self.rate_limit(websocket, message):
+                    continue
+                await self.handler.handle_message(websocket, message)
 
         except websockets.exceptions.ConnectionClosed:
 
@@ -64,14 +205,89 @@ class Server:
         finally:
 
             # websocket disconnects
+            if self.connection_limiter is not None:
+                self.connection_limiter.forget(websocket)
             await self.handler.handle_disconnect(websocket)
 
+    async def rate_limit(self, websocket, message):
+        """
+        Applies the connection and source address rate limits to an incoming message,
+        taking the configured action if either is exceeded
+
+        Args:
+            websocket (Websocket): connection the message came from
+            message (str): incoming message
+
+        Returns:
+            bool: whether the message should be handled
+        """
+        command = self.handler.command_handler.is_command(message)
+        remote_address = getattr(websocket, "remote_address", None)
+        address = remote_address[0] if remote_address else None
+        # limits are in bytes on the wire, only non ASCII text needs encoding to count them
+        size = len(message) if isinstance(message, bytes) or message.isascii() else len(message.encode("utf-8"))
+
+        while True:
+            # both limits are checked before either is debited, so only an accepted message is charged, once
+            wait = self.connection_limiter.check(websocket, size, command)
+            if address is not None:
+                wait = max(wait, self.address_limiter.check(address, size, command))
+            if wait == 0:
+                self.connection_limiter.debit(websocket, size, command)
+                if address is not None:
+                    self.address_limiter.debit(address, size, command)
+                return True
+
+            if self.rate_limit_action == RateLimitAction.THROTTLE:
+                # not reading meanwhile pushes back on the client through TCP flow control
+                await asyncio.sleep(wait)
+            elif self.rate_limit_action == RateLimitAction.WARN:
+                await self.handler.send(Response(RATE_LIMIT_WARNING, Origin.SERVER), websocket)
+                return False
+            else:
+                log_message(logger, f"Disconnecting {address} for exceeding rate limits", logging.WARNING)
+                await websocket.close(1008, "rate limit exceeded")
+                return False
+
+    def on_signal(self, signum, callback):
+        """
+        Calls callback on the event loop when the process receives a signal, if the platform supports it
+
+        Args:
+            signum (int): signal number, e.g. signal.SIGTERM
+            callback (Callable[[], None]): called without arguments
+        """
+        try:
+            asyncio.get_event_loop().add_signal_handler(signum, callback)
+        except NotImplementedError:
+            log_message(logger, f"Signal {signum} handling is not supported on this platform", logging.WARNING)
+
+    def begin_stop(self):
+        """
+        Starts stopping the server, e.g. on SIGTERM. Further calls are ignored while it stops.
+        """
+        if self.running:
+            self.running = False
+            asyncio.ensure_future(self.stop())
+
+    async def drain(self):
+        """
+        Stops accepting connections and has the handler close the open ones within drain_deadline seconds
+        """
+        if self.websocket_server is not None:
+            # close() would also close connections, only the listening sockets are closed here
+            self.websocket_server.server.close()
+        await self.handler.handle_shutdown(self.drain_deadline)
+
     @log(logger, logging.CRITICAL)
     async def stop(self):
         """
-        Handles a server shutdown, waits for the handler to do whatever it needs to first
+        Handles a server shutdown, waits for the handler to drain connections first
         """
-        await self.handler.handle_shutdown()
+        self.lag_monitor.stop()
+        if self.metrics_publisher is not None:
+            self.metrics_publisher.stop()
+        await self.drain()
         asyncio.get_event_loop().stop()
         self.running = False
         log_message(logger, "SHUTDOWN COMPLETE", logging.CRITICAL)
@@ -0,0 +1,147 @@
+"""
+session issues resume tokens to connections, and parks users whose connection dropped so they can resume
+"""
+import asyncio
+import logging
+import secrets
+from urllib.parse import parse_qs
+from utils import log_message
+
+logger = logging.getLogger(__name__)
+
+# close codes of connections that dropped rather than left: going away, e.g. a proxy restarting, and abnormal closure
+PARKED_CLOSE_CODES = (1001, 1006)
+
+
+class SessionRegistry:
+    """
+    Resume tokens of connected and parked users. A parked user keeps their name and room for a grace window,
+    after which on_expire is called so the chatroom can tell others they left.
+    """
+
+    def __init__(self, grace, on_expire):
+        """
+        Args:
+            grace (float): seconds a parked user can be resumed for
+            on_expire (Callable[[User], Awaitable]): called when a parked user's grace window ends
+        """
+        self.grace = grace
+        self.on_expire = on_expire
+
+        # Dict[str, User], token -> user, connected or parked
+        self.users = dict()
+
+        # Dict[str, asyncio.TimerHandle], token of parked user -> expiry timer
+        self._timers = dict()
+
+        # Dict[str, str], name of parked user -> token, parked names stay taken
+        self._parked_names = dict()
+
+    def issue(self, user):
+        """
+        Issues a resume token for a newly connected user
+
+        Args:
+            user (User): connected user, its token is set
+
+        Returns:
+            str: resume token
+        """
+        user.token = secrets.token_urlsafe(16)
+        self.users[user.token] = user
+        return user.token
+
+    def park(self, user):
+        """
+        Keeps a user whose connection dropped resumable until the grace window ends
+
+        Args:
+            user (User): user to park, already removed from the chatroom
+        """
+        self._timers[user.token] = asyncio.get_event_loop().call_later(self.grace, self._expire, user)
+        self._parked_names[user.name] = user.token
+
+    def resume(self, token):
+        """
+        Looks up the user for a resume token, unparking them if parked
+
+        Args:
+            token (str): resume token presented by a client
+
+        Returns:
+            User: user for the token, parked or still connected, or None if the token is unknown or expired
+        """
+        user = self.users.get(token)
+        if user is None:
+            return None
+        timer = self._timers.pop(token, None)
+        if timer is not None:
+            timer.cancel()
+            self._parked_names.pop(user.name, None)
+        return user
+
+    def discard(self, user):
+        """
+        Forgets the token of a user who left, or whose parked session expired
+
+        Args:
+            user (User): user to forget
+        """
+        timer = self._timers.pop(user.token, None)
+        if timer is not None:
+            timer.cancel()
+            self._parked_names.pop(user.name, None)
+        self.users.pop(user.token, None)
+
+    def is_parked(self, name):
+        """
+        Args:
+            name (str): name to check
+
+        Returns:
+            bool: whether a parked user has the name
+        """
+        return name in self._parked_names
+
+    def clear(self):
+        """
+        Cancels every parked user's expiry, e.g. on shutdown
+        """
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+        self._parked_names.clear()
+        self.users.clear()
+
+    def _expire(self, user):
+        self.discard(user)
+        log_message(logger, f"Session of {user.name} expired", logging.INFO)
+        asyncio.ensure_future(self.on_expire(user))
+
+    def __len__(self):
+        """
+        Returns:
+            int: number of parked users
+        """
+        return len(self._timers)
+
+    def __repr__(self):
+        return f"<SessionRegistry {len(self.users)} sessions, {len(self._timers)} parked>"
+
+
+def resume_request(path):
+    """
+    Reads a resume request from a websocket path's query string, e.g. "/general?resume=<token>&last=<seq>"
+
+    Args:
+        path (str): websocket request path, may be None
+
+    Returns:
+        Tuple[str, int]: resume token, or None if not resuming, and the last sequence number received, 0 if missing
+    """
+    if path is None or "?" not in path:
+        return None, 0
+    query = parse_qs(path.split("?", 1)[1])
+    token = query.get("resume", [None])[0]
+    last = query.get("last", ["0"])[0]
+    return token, int(last) if last.isdigit() else 0
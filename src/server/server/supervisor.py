@@ -0,0 +1,91 @@
+"""
+supervisor runs the server in several worker processes and restarts workers that exit
+"""
+import asyncio
+import logging
+import multiprocessing
+import time
+from bus import Broker
+from utils import log, log_message
+
+logger = logging.getLogger(__name__)
+
+
+class Supervisor:
+    """
+    Forks worker processes and runs the bus broker that lets them behave as one server
+    """
+
+    def __init__(self, target, workers, bus_path, check_interval=1.0, shutdown_timeout=10.0):
+        """
+        Create a new supervisor
+
+        Args:
+            target (Callable[[int, str], None]): worker entrypoint, called with worker index and broker socket path
+            workers (int): number of worker processes
+            bus_path (str): unix socket path for the broker
+            check_interval (float, optional): seconds between worker health checks. Defaults to 1.0.
+            shutdown_timeout (float, optional): seconds workers get to exit after SIGTERM before they are killed.
+                Defaults to 10.0.
+        """
+        self.target = target
+        self.workers = workers
+        self.bus_path = bus_path
+        self.check_interval = check_interval
+        self.shutdown_timeout = shutdown_timeout
+        self.broker = Broker(bus_path)
+        self.processes = []
+        self.restarts = 0
+        self.running = False
+        self._context = multiprocessing.get_context("fork")
+
+    @log(logger, logging.INFO)
+    async def run(self):
+        """
+        Starts the broker and workers, then restarts any worker that exits until stopped
+        """
+        self.running = True
+        await self.broker.start()
+        self.processes = [self._spawn(index) for index in range(self.workers)]
+        try:
+            while self.running:
+                await asyncio.sleep(self.check_interval)
+                for index, process in enumerate(self.processes):
+                    if self.running and not process.is_alive():
+                        log_message(logger, f"Worker {process.name} exited with {process.exitcode}, restarting",
+                                    logging.ERROR)
+                        process.join()
+                        self.processes[index] = self._spawn(index)
+                        self.restarts += 1
+        finally:
+            self._terminate()
+            await self.broker.stop()
+
+    def stop(self):
+        """
+        Stops supervising, workers are terminated once run() notices
+        """
+        self.running = False
+
+    def _spawn(self, index):
+        process = self._context.Process(
+            target=self.target, args=(index, self.bus_path), name=f"chatroom-worker-{index}", daemon=True)
+        process.start()
+        return process
+
+    def _terminate(self):
+        # SIGTERM lets workers drain their connections in parallel, any still running at the timeout are killed
+        for process in self.processes:
+            if process.is_alive():
+                process.terminate()
+        deadline = time.monotonic() + self.shutdown_timeout
+        for process in self.processes:
+            process.join(max(0, deadline - time.monotonic()))
+            if process.is_alive():
+                log_message(logger, f"Worker {process.name} did not exit in time, killing it", logging.ERROR)
+                process.kill()
+                process.join()
+
+    def __repr__(self):
+        alive = sum(process.is_alive() for process in self.processes)
+        return f"<Supervisor workers: {alive}/{self.workers}, restarts: {self.restarts}>"
@@ -0,0 +1,65 @@
+"""
+templates compiles chat.yaml message templates once so rendering them is cheap
+"""
+from string import Template
+
+
+class CompiledTemplate:
+    """
+    A string.Template validated and compiled to a str.format string
+    """
+
+    def __init__(self, template, identifiers, name="template"):
+        """
+        Compiles a template
+
+        Args:
+            template (str): string.Template source, e.g. "$name has connected!"
+            identifiers (Iterable[str]): placeholders the template may use
+            name (str, optional): template name for error messages. Defaults to "template".
+
+        Raises:
+            ValueError: the template is malformed or uses an unknown placeholder
+        """
+        self.template = template
+        self.identifiers = frozenset(identifiers)
+
+        parts = []
+        position = 0
+        for match in Template.pattern.finditer(template):
+            parts.append(_escape(template[position:match.start()]))
+            position = match.end()
+
+            if match.group("escaped") is not None:
+                parts.append("$")
+                continue
+
+            identifier = match.group("named") or match.group("braced")
+            if identifier is None:
+                raise ValueError(f"Invalid placeholder in {name} at position {match.start()}: {template!r}")
+            if identifier not in self.identifiers:
+                raise ValueError(f"Unknown placeholder ${identifier} in {name}, expected one of "
+                                 f"{sorted(self.identifiers)}: {template!r}")
+            parts.append(f"{{{identifier}}}")
+        parts.append(_escape(template[position:]))
+
+        self._format = "".join(parts)
+
+    def render(self, **values):
+        """
+        Renders the template
+
+        Args:
+            **values: value for each placeholder
+
+        Returns:
+            str: rendered template
+        """
+        return self._format.format(**values)
+
+    def __repr__(self):
+        return f"<CompiledTemplate {self.template!r}>"
+
+
+def _escape(literal):
+    return literal.replace("{", "{{").replace("}", "}}")
@@ -1,24 +1,72 @@
 import datetime
+import time
 from uuid import uuid4
 
+# offset from the monotonic clock to wall clock time, fixed at startup so connection times are formatted consistently
+_WALL_CLOCK_OFFSET = time.time() - time.monotonic()
+
 
 class User:
     """
-    Stores user data for connected websocket client
+    Stores user data for connected websocket client.
+    Slotted and lazily populated, one exists per connection so its size counts against every idle connection.
     """
+    __slots__ = ("websocket", "name", "connected", "outbound", "binary", "room", "token", "_uuid")
 
-    def __init__(self, websocket, name):
+    def __init__(self, websocket, name, outbound=None, binary=False):
         """
         Creates a new user for a given websocket and name
 
         Args:
             websocket (Websocket): User websocket connection
             name (str): Users name
+            outbound (OutboundQueue, optional): queue for outgoing payloads. Defaults to None (send inline).
+            binary (bool, optional): whether the client negotiated the binary wire format. Defaults to False.
         """
         self.websocket = websocket
         self.name = name
-        self.connected_at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M")
-        self.uuid = str(uuid4())
+        # whole monotonic seconds, formatted only when connected_at is read
+        self.connected = int(time.monotonic())
+        self.outbound = outbound
+        self.binary = binary
+        self.room = None
+        # resume token, None if sessions are disabled
+        self.token = None
+        self._uuid = None
+
+    @property
+    def connected_at(self):
+        """
+        Returns:
+            str: local time the user connected, e.g. "2021-01-31 13:45"
+        """
+        return datetime.datetime.fromtimestamp(self.connected + _WALL_CLOCK_OFFSET).strftime("%Y-%m-%d %H:%M")
+
+    @property
+    def uuid(self):
+        """
+        Returns:
+            str: unique id for the user, created on first use
+        """
+        if self._uuid is None:
+            self._uuid = str(uuid4())
+        return self._uuid
+
+    @property
+    def queue_depth(self):
+        """
+        Returns:
+            int: number of payloads waiting to be sent to this user
+        """
+        return self.outbound.depth if self.outbound is not None else 0
+
+    @property
+    def dropped(self):
+        """
+        Returns:
+            int: number of payloads dropped by this user's slow consumer policy
+        """
+        return self.outbound.dropped if self.outbound is not None else 0
 
     def __repr__(self):
         """
@@ -27,4 +75,4 @@ class User:
         Returns:
             str: str representation of User
         """
-        return f"<User {self.name=},{self.connected_at=}, {self.websocket.open=}, {self.uuid=}>"
+        return f"<User {self.name=},{self.connected_at=}, {self.websocket.open=}, {self.uuid=}, {self.queue_depth=}, {self.dropped=}>"
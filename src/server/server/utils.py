@@ -1,6 +1,37 @@
 import datetime
 import logging
 import functools
+import inspect
+import asyncio
+import random
+import time
+import types
+
+
+class CallStats:
+    """
+    Call count and cumulative time for a hot path function
+    """
+    __slots__ = ("calls", "total_time")
+
+    def __init__(self):
+        self.calls = 0
+        self.total_time = 0.0
+
+    def __repr__(self):
+        return f"<CallStats calls: {self.calls}, total_time: {self.total_time:.6f}s>"
+
+
+# Dict[str, CallStats] keyed by qualified function name, populated by log(hot_path=True)
+call_stats = dict()
+
+
+def reset_call_stats():
+    """Resets all recorded hot path call statistics
+    """
+    for stats in call_stats.values():
+        stats.calls = 0
+        stats.total_time = 0.0
 
 
 def log_message(logger, message, level=logging.INFO):
@@ -14,11 +45,18 @@ def log_message(logger, message, level=logging.INFO):
     logger.log(level=level, msg=message)
 
 
-def log(logger, level=logging.DEBUG):
-    """logger factory, recieves logger to use and returns function decorator
+def log(logger, level=logging.DEBUG, sample_rate=1.0, hot_path=False, redact=()):
+    """logger factory, recieves logger to use and returns function decorator.
+    Arguments are only formatted if the level is enabled and the call is sampled.
 
     Args:
         logger (logging.logger): logger to use
+        level (logging.level, optional): logging level to use. Defaults to logging.DEBUG.
+        sample_rate (float, optional): fraction of calls to log. Defaults to 1.0.
+        hot_path (bool, optional): record call count and cumulative time in call_stats
+            instead of logging each call. Defaults to False.
+        redact (Tuple[str], optional): names of path arguments logged without their query string,
+            which may carry secrets such as resume tokens. Defaults to ().
     """
 
     def decorator(func):
@@ -32,16 +70,119 @@ def log(logger, level=logging.DEBUG):
             Callable: Wrapped function with logging
         """
 
+        if hot_path:
+            return _hot_path_wrapper(func)
+
+        # positions of redacted arguments when passed positionally
+        parameters = list(inspect.signature(func).parameters)
+        redacted = [(name, parameters.index(name)) for name in redact]
+
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
 
-            msg = f"{logger.__module__}: {func.__name__} ({repr(args)}, {repr(kwargs)})"
-            logger.log(level=level, msg=msg)
+            # check cheapest conditions first, repr of args is deferred to the logging handler
+            if logger.isEnabledFor(level) and (sample_rate >= 1.0 or random.random() < sample_rate):
+                logged_args, logged_kwargs = args, kwargs
+                if redacted:
+                    logged_args, logged_kwargs = list(args), dict(kwargs)
+                    for name, index in redacted:
+                        if index < len(logged_args):
+                            logged_args[index] = redact_query(logged_args[index])
+                        elif name in logged_kwargs:
+                            logged_kwargs[name] = redact_query(logged_kwargs[name])
+                    logged_args = tuple(logged_args)
+                logger.log(level, "%s: %s (%r, %r)", logger.name, func.__name__, logged_args, logged_kwargs)
             return func(*args, **kwargs)
 
         return wrapper
     return decorator
 
+
+def start_eagerly(coroutine):
+    """Runs a coroutine until it first has to wait, and only then wraps the rest of it in a task.
+    Most sends to a healthy websocket finish without waiting, so this skips creating a task for them.
+
+    Args:
+        coroutine (Coroutine): coroutine to start
+
+    Returns:
+        asyncio.Task: task finishing the coroutine, or None if it already finished
+
+    Raises:
+        Exception: whatever the coroutine raised before it first waited
+    """
+    try:
+        awaiting = coroutine.send(None)
+    except StopIteration:
+        return None
+    return asyncio.ensure_future(_resume(coroutine, awaiting))
+
+
+@types.coroutine
+def _resume(coroutine, awaiting):
+    # hands the future the coroutine is waiting on to the task, then steps it like `yield from` would
+    while True:
+        try:
+            value = yield awaiting
+        except BaseException as e:
+            step, argument = coroutine.throw, e
+        else:
+            step, argument = coroutine.send, value
+        try:
+            awaiting = step(argument)
+        except StopIteration as stop:
+            return stop.value
+
+
+def redact_query(path):
+    """Removes the query string from a request path, e.g. "/general?resume=..." becomes "/general?<redacted>"
+
+    Args:
+        path (str): request path, may be None
+
+    Returns:
+        str: path without its query string
+    """
+    if isinstance(path, str) and "?" in path:
+        return path.split("?", 1)[0] + "?<redacted>"
+    return path
+
+
+def _hot_path_wrapper(func):
+    """
+    Wraps func to record its call count and cumulative time in call_stats
+
+    Args:
+        func (Callable): Function or coroutine function to wrap
+
+    Returns:
+        Callable: Wrapped function
+    """
+    stats = call_stats.setdefault(func.__qualname__, CallStats())
+
+    if asyncio.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                stats.calls += 1
+                stats.total_time += time.perf_counter() - start
+
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            stats.calls += 1
+            stats.total_time += time.perf_counter() - start
+
+    return wrapper
+
 # def logged(func):
 #     """
 #     Function decorator to log calls.
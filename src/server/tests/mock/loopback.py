@@ -0,0 +1,383 @@
+"""
+loopback is an in-memory websocket transport for simulating many clients in one process without sockets.
+It implements the subset of the websockets protocol used by Server and Chatroom, with per-client
+latency, bandwidth and stalls, and the same send backpressure as a real connection.
+"""
+import asyncio
+from collections import deque
+import websockets
+from websockets.frames import Close
+
+
+def connection_closed(code, reason):
+    """
+    Args:
+        code (int): close code
+        reason (str): close reason
+
+    Returns:
+        websockets.exceptions.ConnectionClosed: the exception websockets raises on a closed connection
+    """
+    close = Close(code, reason)
+    if code in (1000, 1001):
+        return websockets.exceptions.ConnectionClosedOK(close, close, True)
+    return websockets.exceptions.ConnectionClosedError(close, close, True)
+
+
+class LoopbackTransport:
+    """
+    Stands in for a websocket's asyncio transport, enough to abort the connection
+    """
+
+    def __init__(self, websocket):
+        self.websocket = websocket
+
+    def abort(self):
+        """
+        Drops the connection without a closing handshake, both ends see code 1006
+        """
+        self.websocket._closed(1006, "")
+
+
+class LoopbackWebsocket:
+    """
+    Server side end of a loopback connection, what Server and Chatroom see as a websocket
+    """
+
+    def __init__(self, client, path, subprotocol, remote_address, high_water):
+        self.client = client
+        self.path = path
+        self.subprotocol = subprotocol
+        self.remote_address = remote_address
+        self.high_water = high_water
+        self.close_code = None
+        self.close_reason = ""
+        self.transport = LoopbackTransport(self)
+
+        # close frame sent by the server to a hung client, which never answers it, see close
+        self._closing = None
+        self._close_waiter = None
+
+        # frames sent by the client not yet read by the server, and a reader waiting for one
+        self._inbox = deque()
+        self._inbox_waiter = None
+
+        # waiters for the client to read enough that sent bytes drop below high_water
+        self._drain_waiters = deque()
+
+    @property
+    def open(self):
+        return self.close_code is None and self._closing is None
+
+    @property
+    def closed(self):
+        return self.close_code is not None
+
+    async def send(self, message):
+        """
+        Send a frame to the client. Like websockets, waits while more than high_water bytes are unread.
+
+        Args:
+            message (Union[str, bytes]): frame to send
+
+        Raises:
+            websockets.exceptions.ConnectionClosed: if the connection is closed or closing
+        """
+        if not self.open:
+            raise connection_closed(*(self._closing or (self.close_code, self.close_reason)))
+        self.client._transmit(message)
+        while self.client.unread_bytes > self.high_water and self.open:
+            waiter = asyncio.get_event_loop().create_future()
+            self._drain_waiters.append(waiter)
+            await waiter
+        if self.closed:
+            raise connection_closed(self.close_code, self.close_reason)
+
+    async def recv(self):
+        """
+        Returns:
+            Union[str, bytes]: next frame sent by the client
+
+        Raises:
+            websockets.exceptions.ConnectionClosed: if the connection closes first
+        """
+        while not self._inbox:
+            if self.closed:
+                raise connection_closed(self.close_code, self.close_reason)
+            self._inbox_waiter = asyncio.get_event_loop().create_future()
+            await self._inbox_waiter
+        return self._inbox.popleft()
+
+    def __aiter__(self):
+        return self._frames()
+
+    async def _frames(self):
+        # like websockets, iteration ends quietly on a normal close
+        try:
+            while True:
+                yield await self.recv()
+        except websockets.exceptions.ConnectionClosedOK:
+            return
+
+    async def close(self, code=1000, reason=""):
+        """
+        Close the connection from the server side. Like websockets, waits for the client to answer the close frame,
+        which a hung client never does, so the connection stays closing until it is aborted.
+
+        Args:
+            code (int, optional): close code. Defaults to 1000.
+            reason (str, optional): close reason. Defaults to "".
+        """
+        if self.closed:
+            return
+        if not self.client.hung:
+            self._closed(code, reason)
+            return
+        if self._closing is None:
+            self._closing = (code, reason)
+            self._close_waiter = asyncio.get_event_loop().create_future()
+        await asyncio.shield(self._close_waiter)
+
+    async def wait_closed(self):
+        while self.open:
+            await asyncio.sleep(0)
+
+    def _receive(self, message):
+        self._inbox.append(message)
+        self._wake_reader()
+
+    def _closed(self, code, reason):
+        if self.closed:
+            return
+        self.close_code, self.close_reason = code, reason
+        self.client.close_code, self.client.close_reason = code, reason
+        self._wake_reader()
+        self._drained()
+        self.client._wake_reader()
+        if self._close_waiter is not None and not self._close_waiter.done():
+            self._close_waiter.set_result(None)
+
+    def _wake_reader(self):
+        if self._inbox_waiter is not None and not self._inbox_waiter.done():
+            self._inbox_waiter.set_result(None)
+
+    def _drained(self):
+        while self._drain_waiters:
+            waiter = self._drain_waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def __repr__(self):
+        return f"<LoopbackWebsocket {self.remote_address}{self.path}, open: {self.open}>"
+
+
+class LoopbackClient:
+    """
+    Client side end of a loopback connection.
+    Frames sent by the server are delivered after latency, and no faster than bandwidth allows.
+    A stalled client stops reading, so the server's sends block once high_water bytes are unread.
+    """
+
+    def __init__(self, latency=0.0, bandwidth=None, keep=True):
+        """
+        Args:
+            latency (float, optional): one way delay in seconds. Defaults to 0.
+            bandwidth (float, optional): bytes per second from the server, None for unlimited. Defaults to None.
+            keep (bool, optional): keep received frames in received, otherwise only count them. Defaults to True.
+        """
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.keep = keep
+        self.websocket = None
+        self.close_code = None
+        self.close_reason = ""
+
+        self.received = deque()
+        self.frames_received = 0
+        self.bytes_received = 0
+
+        # bytes sent by the server and not yet read, including those still in flight
+        self.unread_bytes = 0
+        self.stalled = False
+        self.hung = False
+        self._link_free_at = 0.0
+        # frames on the link, delivered in order even if their timers fire in the same loop iteration
+        self._in_flight = deque()
+        self._unread = deque()
+        self._recv_waiter = None
+
+    @property
+    def open(self):
+        return self.close_code is None
+
+    async def send(self, message):
+        """
+        Send a frame to the server, arriving after latency
+
+        Args:
+            message (Union[str, bytes]): frame to send
+        """
+        if not self.open:
+            raise connection_closed(self.close_code, self.close_reason)
+        if self.latency > 0:
+            asyncio.get_event_loop().call_later(self.latency, self.websocket._receive, message)
+        else:
+            self.websocket._receive(message)
+
+    async def recv(self):
+        """
+        Reads the next frame, even while stalled
+
+        Returns:
+            Union[str, bytes]: next frame from the server
+        """
+        while not self._unread:
+            if not self.open:
+                raise connection_closed(self.close_code, self.close_reason)
+            self._recv_waiter = asyncio.get_event_loop().create_future()
+            try:
+                await self._recv_waiter
+            finally:
+                self._recv_waiter = None
+        return self._read()
+
+    async def close(self, code=1000, reason=""):
+        """
+        Close the connection from the client side
+
+        Args:
+            code (int, optional): close code. Defaults to 1000.
+            reason (str, optional): close reason. Defaults to "".
+        """
+        self.websocket._closed(code, reason)
+
+    def stall(self):
+        """
+        Stop reading frames, the server sees backpressure once high_water bytes are unread
+        """
+        self.stalled = True
+
+    def hang(self):
+        """
+        Stop responding entirely, like a dead peer: frames are not read and the close handshake is never completed
+        """
+        self.stalled = True
+        self.hung = True
+
+    def resume(self):
+        """
+        Read every delivered frame and keep reading as frames arrive
+        """
+        self.stalled = False
+        self.hung = False
+        while self._unread:
+            self._read()
+
+    def _wake_reader(self):
+        if self._recv_waiter is not None and not self._recv_waiter.done():
+            self._recv_waiter.set_result(None)
+
+    def _transmit(self, message):
+        size = len(message)
+        self.unread_bytes += size
+        delay = self.latency
+        if self.bandwidth:
+            # frames queue behind each other on the link
+            loop = asyncio.get_event_loop()
+            now = loop.time()
+            self._link_free_at = max(self._link_free_at, now) + size / self.bandwidth
+            delay += self._link_free_at - now
+        if delay > 0:
+            self._in_flight.append(message)
+            asyncio.get_event_loop().call_later(delay, self._land)
+        else:
+            self._deliver(message)
+
+    def _land(self):
+        self._deliver(self._in_flight.popleft())
+
+    def _deliver(self, message):
+        self._unread.append(message)
+        if self._recv_waiter is not None:
+            # a pending recv reads the frame, later frames wait for it rather than overtaking it
+            if not self._recv_waiter.done():
+                self._recv_waiter.set_result(None)
+        elif not self.stalled:
+            self._read()
+
+    def _read(self):
+        message = self._unread.popleft()
+        self.unread_bytes -= len(message)
+        self.frames_received += 1
+        self.bytes_received += len(message)
+        if self.keep:
+            self.received.append(message)
+        if self.unread_bytes <= self.websocket.high_water:
+            self.websocket._drained()
+        return message
+
+    def __repr__(self):
+        return f"<LoopbackClient frames: {self.frames_received}, unread: {self.unread_bytes}, stalled: {self.stalled}>"
+
+
+class LoopbackNetwork:
+    """
+    Connects loopback clients to a websocket handler such as Server.ws_handler_async,
+    running one handler task per connection as websockets.serve would
+    """
+
+    def __init__(self, handler, high_water=2**16):
+        """
+        Args:
+            handler (Callable[[LoopbackWebsocket, str], Awaitable]): connection handler taking (websocket, path)
+            high_water (int, optional): unread bytes at which server sends wait. Defaults to 64 KiB like websockets.
+        """
+        self.handler = handler
+        self.high_water = high_water
+        self.clients = []
+        self.handlers = []
+
+    async def connect(self, path="/", subprotocol=None, address="127.0.0.1", latency=0.0, bandwidth=None,
+                      keep=True):
+        """
+        Opens a connection and starts its handler
+
+        Args:
+            path (str, optional): request path. Defaults to "/".
+            subprotocol (str, optional): negotiated subprotocol. Defaults to None.
+            address (str, optional): client IP address. Defaults to "127.0.0.1".
+            latency (float, optional): one way delay in seconds. Defaults to 0.
+            bandwidth (float, optional): bytes per second to the client, None for unlimited. Defaults to None.
+            keep (bool, optional): keep received frames, otherwise only count them. Defaults to True.
+
+        Returns:
+            LoopbackClient: client end of the connection
+        """
+        client = LoopbackClient(latency, bandwidth, keep)
+        client.websocket = LoopbackWebsocket(client, path, subprotocol, (address, len(self.clients)), self.high_water)
+        self.clients.append(client)
+        self.handlers.append(asyncio.ensure_future(self.handler(client.websocket, path)))
+        # let the handler run its connection logic
+        await asyncio.sleep(0)
+        return client
+
+    async def settle(self, rounds=10):
+        """
+        Lets pending handler steps run, e.g. after connecting or sending
+
+        Args:
+            rounds (int, optional): event loop iterations to yield for. Defaults to 10.
+        """
+        for _ in range(rounds):
+            await asyncio.sleep(0)
+
+    async def close_all(self):
+        """
+        Closes every client and waits for their handlers to finish
+        """
+        for client in self.clients:
+            await client.close()
+        await asyncio.gather(*self.handlers, return_exceptions=True)
+
+    def __len__(self):
+        return len(self.clients)
@@ -9,18 +9,31 @@ class MockWebsocketClient:
         self.open = True
         self.incoming = []
 
-    async def __aiter__(self):
-        while True:
-            return self.message
+    def __aiter__(self):
+        return self._messages()
+
+    async def _messages(self):
+        while self.open:
+            yield self.message
             await asyncio.sleep(self.delay)
 
     async def send(self, message):
         self.incoming.append(message)
 
     async def recv(self):
-        return message
+        return self.message
 
-    async def close(self):
+    async def close(self, code=1000, reason=""):
         self.open = False
 
-    
+
+class StalledWebsocketClient(MockWebsocketClient):
+
+    async def send(self, message):
+        await asyncio.sleep(3600)
+
+
+class FailingWebsocketClient(MockWebsocketClient):
+
+    async def send(self, message):
+        raise ConnectionResetError("fake connection reset")
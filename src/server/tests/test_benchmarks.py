@@ -0,0 +1,64 @@
+import unittest
+import asyncio
+import os
+import sys
+import test_helper
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../server')))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../benchmarks')))
+from benchmarks import BENCHMARKS, cases, compare, create_chatroom, measure
+
+
+def result(median, stdev=0.0):
+    return {"median_us": median, "stdev_us": stdev}
+
+
+class TestBenchmarks(unittest.TestCase):
+
+    def test_cases(self):
+        names = [name for name, _ in cases("handle_message", ("room_size", "message_length"))]
+        self.assertIn("handle_message[room_size=100,message_length=256]", names)
+        self.assertEqual(len(names), 9)
+        self.assertEqual(list(cases("generate_name", ())), [("generate_name", {})])
+
+    def test_create_chatroom(self):
+        chatroom, websocket = create_chatroom(25, "../config/test_config/chat.yaml")
+        self.assertEqual(len(chatroom.connected), 25)
+        self.assertEqual(len(chatroom.connected[websocket].room), 25)
+
+    def test_measure(self):
+        loop = asyncio.new_event_loop()
+
+        async def noop():
+            pass
+
+        for func in (lambda: None, noop):
+            stats = measure(func, loop, min_time=0.001, repeat=3)
+            self.assertGreater(stats["loops"], 1)
+            self.assertLessEqual(stats["min_us"], stats["median_us"])
+        loop.close()
+
+    def test_every_benchmark_runs(self):
+        loop = asyncio.new_event_loop()
+        for name, (func, parameters) in BENCHMARKS.items():
+            arguments = {parameter: 10 for parameter in parameters}
+            bench = func(chat_config="../config/test_config/chat.yaml", **arguments)
+            outcome = bench()
+            if asyncio.iscoroutine(outcome):
+                loop.run_until_complete(outcome)
+        loop.close()
+
+    def test_compare(self):
+        baseline = {"benchmarks": {"a": result(10.0, 0.1), "b": result(10.0, 0.1), "c": result(10.0, 2.0)}}
+        current = {"benchmarks": {
+            "a": result(12.0, 0.1), "b": result(8.0, 0.1), "c": result(11.0, 2.0), "d": result(1.0)}}
+        lines, regressions = compare(baseline, current, 0.05)
+        self.assertEqual(regressions, 1)
+        self.assertTrue(lines[1].endswith("slower"))
+        self.assertTrue(lines[2].endswith("faster"))
+        # within noise
+        self.assertFalse(lines[3].rstrip().endswith(("slower", "faster")))
+        self.assertTrue(lines[4].endswith("new"))
+
+
+if __name__ == '__main__':
+    unittest.main()
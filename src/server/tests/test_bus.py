@@ -0,0 +1,126 @@
+import unittest
+import asyncio
+import os
+import sys
+import tempfile
+import test_helper
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../server')))
+from mock.mockwebsocketclient import MockWebsocketClient as Mwsc
+from chatroom import Chatroom
+from bus import LocalBus, BrokerBus, Broker
+
+
+class TestBus(unittest.TestCase):
+
+    def create_node(self, bus):
+        room = Chatroom("../config/test_config/chat.yaml")
+        room.attach_bus(bus)
+        test_helper.sync(room.handle_startup())
+        return room
+
+    def test_single_node_local_bus(self):
+        room = Chatroom("../config/test_config/chat.yaml")
+        test_helper.sync(room.handle_startup())
+        socket = Mwsc()
+        test_helper.sync(room.handle_connection(socket, "alone"))
+        test_helper.sync(room.handle_message(socket, "hello"))
+        self.assertEqual(len(room.remote), 0)
+
+        # broadcasts aren't even built for a bus without peers
+        published = []
+        room.bus.publish = lambda event: asyncio.sleep(0, published.append(event))
+        test_helper.sync(room.handle_message(socket, "again"))
+        self.assertFalse(room.bus.has_peers)
+        self.assertEqual(published, [])
+
+    def test_sessions_need_one_node(self):
+        self.assertIsNotNone(self.create_node(LocalBus()).sessions)
+        # a reconnect may reach another node, which doesn't have the parked session
+        self.assertIsNone(self.create_node(LocalBus([])).sessions)
+        self.assertTrue(BrokerBus("/nonexistent").shared)
+
+    def test_local_hub(self):
+        hub = []
+        node1 = self.create_node(LocalBus(hub))
+        alice = Mwsc()
+        test_helper.sync(node1.handle_connection(alice, "alice"))
+
+        # node2 learns about alice when it joins the hub
+        node2 = self.create_node(LocalBus(hub))
+        self.assertIn("alice", node2.remote)
+
+        bob = Mwsc()
+        test_helper.sync(node2.handle_connection(bob, "bob"))
+        self.assertIn("bob has connected", alice.incoming[-1])
+
+        test_helper.sync(node1.handle_message(alice, "hello from node1"))
+        self.assertIn("alice: hello from node1", bob.incoming[-1])
+        self.assertIn("USER", bob.incoming[-1])
+
+        self.assertEqual(node1.get_who(node1.connected[alice].room), "alice, bob")
+        self.assertTrue(node1.is_name_taken("bob"))
+
+        test_helper.sync(node1.command_handler.handle_command("!pm bob secret", node1.connected[alice], node1))
+        self.assertIn(node1.get_outgoing_pm("secret", "alice"), bob.incoming[-1])
+        self.assertIn(node1.get_pm_receipt("secret", "bob"), alice.incoming[-1])
+
+        test_helper.sync(node2.handle_disconnect(bob))
+        self.assertNotIn("bob", node1.remote)
+        self.assertIn("bob has disconnected", alice.incoming[-1])
+
+    def test_room_scoped_across_nodes(self):
+        hub = []
+        node1 = self.create_node(LocalBus(hub))
+        node2 = self.create_node(LocalBus(hub))
+        alice, bob, carol = Mwsc(), Mwsc(), Mwsc()
+        test_helper.sync(node1.handle_connection(alice, "alice", "/general"))
+        test_helper.sync(node2.handle_connection(bob, "bob", "/general"))
+        test_helper.sync(node2.handle_connection(carol, "carol"))
+
+        carol_count = len(carol.incoming)
+        test_helper.sync(node1.handle_message(alice, "general only"))
+        self.assertIn("general only", bob.incoming[-1])
+        self.assertEqual(len(carol.incoming), carol_count)
+        self.assertIn("#general (2)", node1.get_rooms())
+
+    def test_node_down(self):
+        hub = []
+        node1 = self.create_node(LocalBus(hub))
+        node2 = self.create_node(LocalBus(hub))
+        test_helper.sync(node2.handle_connection(Mwsc(), "bob"))
+        self.assertIn("bob", node1.remote)
+
+        test_helper.sync(node2.bus.stop())
+        self.assertNotIn("bob", node1.remote)
+
+    def test_broker(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "bus.sock")
+            broker = Broker(path)
+            test_helper.sync(broker.start())
+
+            node1 = self.create_node(BrokerBus(path))
+            node2 = self.create_node(BrokerBus(path))
+            alice, bob = Mwsc(), Mwsc()
+            test_helper.sync(node1.handle_connection(alice, "alice"))
+            test_helper.sync(node2.handle_connection(bob, "bob"))
+            self.wait_for(lambda: "bob" in node1.remote and "alice" in node2.remote)
+
+            test_helper.sync(node1.handle_message(alice, "over the broker"))
+            self.wait_for(lambda: "over the broker" in bob.incoming[-1])
+
+            test_helper.sync(node2.bus.stop())
+            self.wait_for(lambda: "bob" not in node1.remote)
+
+            test_helper.sync(node1.bus.stop())
+            test_helper.sync(broker.stop())
+
+    def wait_for(self, condition, timeout=2.0):
+        async def poll():
+            while not condition():
+                await asyncio.sleep(0.01)
+        test_helper.sync(asyncio.wait_for(poll(), timeout))
+
+
+if __name__ == '__main__':
+    unittest.main()
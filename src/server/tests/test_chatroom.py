@@ -1,12 +1,17 @@
 import unittest
 import asyncio
+import copy
+import json
 import os
 import sys
+import tempfile
 import test_helper
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../server')))
 from mock.mockwebsocketclient import MockWebsocketClient as Mwsc
-from chatroom import Chatroom
-from response import Response, Origin
+from mock.mockwebsocketclient import StalledWebsocketClient, FailingWebsocketClient
+from chatroom import Chatroom, AdjAnimalNameGenerator, load_words
+from user import User
+from response import Response, Origin, BINARY_HEADER, ORIGIN_CODES
 
 
 class TestServer(unittest.TestCase):
@@ -59,6 +64,87 @@ class TestServer(unittest.TestCase):
         self.assertEqual(resp.json(), room.connected[fake_websocket].websocket.incoming[-1])
         self.assertNotEqual(resp.json(), room.connected[fake_websocket2].websocket.incoming[-1])
 
+    def test_send_to_all_sequential(self):
+        config = test_helper.config_stream("../config/test_config/chat.yaml", broadcast={"concurrent": False})
+        room = Chatroom(config)
+        sockets = [Mwsc() for _ in range(3)]
+        for socket in sockets:
+            self.connect_fake_client(socket, room)
+
+        resp = Response("TO ALL")
+        test_helper.sync(room.send_to_all(resp))
+        for socket in sockets:
+            self.assertEqual(resp.json(), socket.incoming[-1])
+
+    def test_send_to_all_isolates_failures(self):
+        config = test_helper.config_stream(
+            "../config/test_config/chat.yaml", broadcast={"concurrent": True, "send_timeout": 0.05})
+        room = Chatroom(config)
+        healthy = Mwsc()
+        self.connect_fake_client(healthy, room)
+        stalled = StalledWebsocketClient()
+        failing = FailingWebsocketClient()
+        room.connected[stalled] = User(stalled, "stalled")
+        room.connected[failing] = User(failing, "failing")
+        healthy_late = Mwsc()
+        room.connected[healthy_late] = User(healthy_late, "late")
+
+        resp = Response("TO ALL")
+        test_helper.sync(room.send_to_all(resp))
+
+        self.assertEqual(resp.json(), healthy.incoming[-1])
+        self.assertEqual(resp.json(), healthy_late.incoming[-1])
+
+    def test_outbound_queue(self):
+        config = test_helper.config_stream(
+            "../config/test_config/chat.yaml", outbound_queue={"enabled": True, "max_size": 2, "policy": "drop_oldest"})
+        room = Chatroom(config)
+        fake_websocket = Mwsc()
+        fake_websocket2 = Mwsc()
+        self.connect_fake_client(fake_websocket, room)
+        self.connect_fake_client(fake_websocket2, room)
+
+        user = room.connected[fake_websocket]
+        self.assertIsNotNone(user.outbound)
+        resp = Response("TO ALL")
+        test_helper.sync(room.send_to_all(resp))
+        test_helper.sync(user.outbound.flush())
+        self.assertEqual(resp.json(), fake_websocket.incoming[-1])
+        self.assertEqual(user.queue_depth, 0)
+
+        test_helper.sync(room.handle_disconnect(fake_websocket))
+        self.assertTrue(user.outbound.closed)
+
+    def test_batching_opt_in(self):
+        config = test_helper.config_stream(
+            "../config/test_config/chat.yaml", outbound_queue={"enabled": True, "max_size": 100},
+            batching={"enabled": True, "flush_interval": 0.01, "max_bytes": 16384})
+        room = Chatroom(config)
+        batch_socket = Mwsc()
+        batch_socket.subprotocol = "chat.batch"
+        plain_socket = Mwsc()
+        self.connect_fake_client(batch_socket, room)
+        self.connect_fake_client(plain_socket, room)
+
+        async def flush():
+            await asyncio.sleep(0.05)
+            for user in room.connected.values():
+                await user.outbound.flush()
+
+        async def burst():
+            for i in range(5):
+                await room.send_to_all(Response(f"message {i}", Origin.SERVER))
+            await flush()
+
+        test_helper.sync(flush())
+        batch_socket.incoming.clear()
+        plain_socket.incoming.clear()
+        test_helper.sync(burst())
+
+        self.assertEqual(len(plain_socket.incoming), 5)
+        self.assertEqual(len(batch_socket.incoming), 1)
+        self.assertEqual(len(json.loads(batch_socket.incoming[0])), 5)
+
     def test_name_change(self):
         room = Chatroom("../config/test_config/chat.yaml")
         fake_websocket = Mwsc()
@@ -67,12 +153,168 @@ class TestServer(unittest.TestCase):
         self.connect_fake_client(fake_websocket2, room)
         asyncio.get_event_loop().run_until_complete(room.change_name(fake_websocket, "new_name"))
 
-        expected = Response(room.get_name_change_notification("old_name", "new_name"), Origin.SERVER)
+        # room broadcasts are numbered
+        expected = Response(
+            room.get_name_change_notification("old_name", "new_name"), Origin.SERVER, room.rooms.get("lobby").seq)
 
         self.assertEqual(expected.json(), room.connected[fake_websocket].websocket.incoming[-1])
         self.assertEqual(expected.json(), room.connected[fake_websocket2].websocket.incoming[-1])
         self.assertEqual(room.connected[fake_websocket].name, "new_name")
 
+    def test_name_index(self):
+        room = Chatroom("../config/test_config/chat.yaml")
+        fake_websocket = Mwsc()
+        fake_websocket2 = Mwsc()
+        self.connect_fake_client(fake_websocket, room, "first")
+        self.connect_fake_client(fake_websocket2, room, "second")
+
+        self.assertIs(room.find_user("first"), room.connected[fake_websocket])
+        self.assertIsNone(room.find_user("missing"))
+
+        test_helper.sync(room.change_name(fake_websocket, "renamed"))
+        self.assertIsNone(room.find_user("first"))
+        self.assertIs(room.find_user("renamed"), room.connected[fake_websocket])
+
+        test_helper.sync(room.handle_disconnect(fake_websocket2))
+        self.assertIsNone(room.find_user("second"))
+        self.assertEqual(room.get_who(), "renamed")
+
+    def test_unique_names(self):
+        room = Chatroom("../config/test_config/chat.yaml")
+        fake_websocket = Mwsc()
+        fake_websocket2 = Mwsc()
+        self.connect_fake_client(fake_websocket, room, "taken")
+        self.connect_fake_client(fake_websocket2, room, "taken")
+
+        self.assertNotEqual(room.connected[fake_websocket2].name, "taken")
+        changed = test_helper.sync(room.change_name(fake_websocket2, "taken"))
+        self.assertFalse(changed)
+        self.assertIn("already taken", fake_websocket2.incoming[-1])
+        self.assertIs(room.find_user("taken"), room.connected[fake_websocket])
+
+    def test_who_cache(self):
+        room = Chatroom("../config/test_config/chat.yaml")
+        fake_websocket = Mwsc()
+        self.connect_fake_client(fake_websocket, room, "first")
+        who = room.get_who()
+        self.assertIs(who, room.get_who())
+
+        self.connect_fake_client(Mwsc(), room, "second")
+        self.assertEqual(room.get_who(), "first, second")
+
+    def test_rooms(self):
+        room = Chatroom("../config/test_config/chat.yaml")
+        lobby_socket = Mwsc()
+        general_socket = Mwsc()
+        general_socket2 = Mwsc()
+        test_helper.sync(room.handle_connection(lobby_socket, "lobby_user"))
+        test_helper.sync(room.handle_connection(general_socket, "general_user", "/general"))
+        test_helper.sync(room.handle_connection(general_socket2, "general_user2", "/general"))
+
+        self.assertEqual(room.connected[lobby_socket].room.name, "lobby")
+        self.assertEqual(room.connected[general_socket].room.name, "general")
+
+        lobby_count = len(lobby_socket.incoming)
+        test_helper.sync(room.handle_message(general_socket, "hello general"))
+        self.assertIn("hello general", general_socket2.incoming[-1])
+        self.assertEqual(len(lobby_socket.incoming), lobby_count)
+        self.assertEqual(room.get_who(room.connected[general_socket].room), "general_user, general_user2")
+
+    def test_change_room(self):
+        room = Chatroom("../config/test_config/chat.yaml")
+        mover = Mwsc()
+        stayer = Mwsc()
+        test_helper.sync(room.handle_connection(mover, "mover"))
+        test_helper.sync(room.handle_connection(stayer, "stayer"))
+
+        self.assertTrue(test_helper.sync(room.change_room(mover, "general")))
+        self.assertEqual(room.connected[mover].room.name, "general")
+        self.assertIn(room.get_room_leave_notification("mover", "lobby"), stayer.incoming[-1])
+        self.assertIn(room.get_room_greeting("general"), mover.incoming[-1])
+        self.assertFalse(test_helper.sync(room.change_room(mover, "general")))
+
+    def test_history_replay(self):
+        room = Chatroom("../config/test_config/chat.yaml")
+        sender = Mwsc()
+        self.connect_fake_client(sender, room, "sender")
+        for i in range(3):
+            test_helper.sync(room.handle_message(sender, f"message {i}"))
+
+        late = Mwsc()
+        late.subprotocol = "chat.batch"
+        self.connect_fake_client(late, room, "late")
+        replay = [frame for frame in late.incoming if frame.startswith("[")]
+        self.assertEqual(len(replay), 1)
+        messages = json.loads(replay[0])
+        self.assertEqual([m["body"] for m in messages], [f"sender: message {i}" for i in range(3)])
+
+        test_helper.sync(room.command_handler.handle_command("!history 2", room.connected[late], room))
+        self.assertEqual(len(json.loads(late.incoming[-1])), 2)
+
+        # clients that didn't negotiate batches get one message per frame
+        plain = Mwsc()
+        self.connect_fake_client(plain, room, "plain")
+        self.assertFalse(any(frame.startswith("[") for frame in plain.incoming))
+        replay = [json.loads(frame) for frame in plain.incoming]
+        self.assertEqual([m["body"] for m in replay if m["origin"] == "USER"], [f"sender: message {i}" for i in range(3)])
+
+    def test_history_size_only(self):
+        room = Chatroom(test_helper.config_stream("../config/test_config/chat.yaml", history={"size": 5}))
+        sender = Mwsc()
+        self.connect_fake_client(sender, room, "sender")
+        test_helper.sync(room.handle_message(sender, "kept"))
+        self.assertEqual(len(room.rooms.get("lobby").history), 1)
+
+    def test_message_log(self):
+        with tempfile.TemporaryDirectory() as directory:
+            config = test_helper.config_stream(
+                "../config/test_config/chat.yaml", persistence={"enabled": True, "directory": directory})
+            room = Chatroom(config)
+            test_helper.sync(room.handle_startup())
+            sender = Mwsc()
+            self.connect_fake_client(sender, room, "sender")
+            test_helper.sync(room.handle_message(sender, "local"))
+            # chat messages relayed from other nodes are logged too
+            relayed = Response("remote: relayed", Origin.USER)
+            test_helper.sync(room.handle_bus_event({
+                "type": "broadcast", "node": "other", "room": "lobby", "response": relayed.data,
+                "sentAtMs": relayed.sent_at_ms}))
+            room.message_log.close()
+
+            config.seek(0)
+            restarted = Chatroom(config)
+            test_helper.sync(restarted.handle_startup())
+            late = Mwsc()
+            late.subprotocol = "chat.batch"
+            self.connect_fake_client(late, restarted, "late")
+            replay = [frame for frame in late.incoming if frame.startswith("[")]
+            payloads = test_helper.sync(restarted.get_history(restarted.rooms.get("lobby"), 10))
+            restarted.message_log.close()
+
+        self.assertEqual([m["body"] for m in json.loads(replay[0])], ["sender: local", "remote: relayed"])
+        self.assertEqual([json.loads(payload)["body"] for payload in payloads], ["sender: local", "remote: relayed"])
+
+    def test_binary_client(self):
+        room = Chatroom("../config/test_config/chat.yaml")
+        binary_socket = Mwsc()
+        binary_socket.subprotocol = "chat.bin"
+        json_socket = Mwsc()
+        self.connect_fake_client(binary_socket, room, "binary")
+        self.connect_fake_client(json_socket, room, "json")
+        self.assertTrue(room.connected[binary_socket].binary)
+
+        test_helper.sync(room.handle_message(json_socket, "hello"))
+        self.assertEqual(json.loads(json_socket.incoming[-1])["origin"], Origin.SELF.value)
+        record = binary_socket.incoming[-1]
+        self.assertIsInstance(record, bytes)
+        code, _, seq, length = BINARY_HEADER.unpack_from(record)
+        self.assertEqual(seq, room.rooms.get("lobby").seq)
+        self.assertEqual(code, ORIGIN_CODES[Origin.USER.value])
+        self.assertEqual(record[BINARY_HEADER.size:].decode("utf-8"), "json: hello")
+
+        test_helper.sync(room.command_handler.handle_command("!history 5", room.connected[binary_socket], room))
+        self.assertEqual(binary_socket.incoming[-1], room.rooms.get("lobby").history.recent(1, binary=True)[0])
+
     def test_handle_shutdown(self):
         room = Chatroom("../config/test_config/chat.yaml")
         fake_websocket = Mwsc()
@@ -92,6 +334,94 @@ class TestServer(unittest.TestCase):
     def connect_fake_client(self, fake_websocket, chatroom, name=None):
         asyncio.get_event_loop().run_until_complete(chatroom.handle_connection(fake_websocket, name))
 
+    def test_generated_names_released(self):
+        room = Chatroom("../config/test_config/chat.yaml")
+        fake_websocket = Mwsc()
+        fake_websocket2 = Mwsc()
+        self.connect_fake_client(fake_websocket, room)
+        self.connect_fake_client(fake_websocket2, room)
+        generated, generated2 = room.connected[fake_websocket].name, room.connected[fake_websocket2].name
+        self.assertEqual(len(room.name_generator), 2)
+
+        test_helper.sync(room.change_name(fake_websocket, "renamed"))
+        test_helper.sync(room.handle_disconnect(fake_websocket2))
+        self.assertEqual(len(room.name_generator), 0)
+        self.assertEqual(list(room.name_generator._released), [generated, generated2])
+
+    def test_worker_names_disjoint(self):
+        # workers are forked from one process, so they start with copies of the same generator
+        workers = [Chatroom("../config/test_config/chat.yaml") for _ in range(2)]
+        workers[1].name_generator = copy.deepcopy(workers[0].name_generator)
+        names = []
+        for index, worker in enumerate(workers):
+            test_helper.sync(worker.handle_startup(worker=index, workers=2))
+            sockets = [Mwsc() for _ in range(20)]
+            for socket in sockets:
+                self.connect_fake_client(socket, worker)
+            names.append({worker.connected[socket].name for socket in sockets})
+        self.assertEqual(len(names[0]), 20)
+        self.assertFalse(names[0] & names[1])
+
+    def test_names_held_remotely_not_kept(self):
+        room = Chatroom("../config/test_config/chat.yaml")
+        taken = copy.deepcopy(room.name_generator).generate_name()
+        room.remote.add(taken, "other", "lobby")
+        socket = Mwsc()
+        self.connect_fake_client(socket, room)
+        self.assertNotEqual(room.connected[socket].name, taken)
+        self.assertEqual(len(room.name_generator), 1)
+
+
+class TestAdjAnimalNameGenerator(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.adjectives = os.path.join(self.directory.name, "adjectives.txt")
+        self.animals = os.path.join(self.directory.name, "animals.txt")
+        with open(self.adjectives, "w") as file:
+            file.write("red\nblue\nred\ngreen\n")
+        with open(self.animals, "w") as file:
+            file.write("fox\nowl\n\n")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_unique_until_exhausted(self):
+        generator = AdjAnimalNameGenerator(self.adjectives, self.animals)
+        # duplicate and blank lines are skipped
+        self.assertEqual(generator.combinations, 6)
+        names = [generator.generate_name() for _ in range(6)]
+        self.assertEqual(sorted(names), ["BlueFox", "BlueOwl", "GreenFox", "GreenOwl", "RedFox", "RedOwl"])
+
+        # exhausted, released names are reused before suffixes
+        generator.release(names[3])
+        generator.release("NotGenerated")
+        self.assertEqual(generator.generate_name(), names[3])
+        suffixed = [generator.generate_name() for _ in range(6)]
+        self.assertEqual(sorted(suffixed), sorted(f"{name}2" for name in names))
+        self.assertEqual(len(generator), 12)
+
+    def test_partitioned_copies(self):
+        generator = AdjAnimalNameGenerator(self.adjectives, self.animals)
+        copies = [copy.deepcopy(generator) for _ in range(3)]
+        for index, other in enumerate(copies):
+            other.partition(index, 3)
+        names = [[other.generate_name() for _ in range(4)] for other in copies]
+        # 12 names cover every combination once and every suffixed one once, whichever copy handed them out
+        flat = [name for partition in names for name in partition]
+        self.assertEqual(len(set(flat)), 12)
+
+    def test_words_cached(self):
+        generator = AdjAnimalNameGenerator(self.adjectives, self.animals)
+        other = AdjAnimalNameGenerator(self.adjectives, self.animals)
+        self.assertIs(generator.adjectives, other.adjectives)
+        self.assertEqual(load_words(self.animals), ("Fox", "Owl"))
+
+    def test_full_word_lists(self):
+        generator = AdjAnimalNameGenerator("../server/Data/adjectives.txt", "../server/Data/animals.txt")
+        names = [generator.generate_name() for _ in range(50000)]
+        self.assertEqual(len(set(names)), 50000)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -5,9 +5,10 @@ import sys
 import test_helper
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../server')))
 from chatroom import Chatroom
-from command_handler import CommandHandler
+from command_handler import CommandHandler, registered, COMMAND_TIMEOUTS
 from user import User
 from mock.mockwebsocketclient import MockWebsocketClient as Mwsc
+from mock.mockwebsocketclient import StalledWebsocketClient
 from response import Response, Origin
 
 
@@ -93,6 +94,94 @@ class TestCommandHandler(unittest.TestCase):
             room.command_handler.handle_command("!pm test ", room.connected[sender], room)
         )
 
+    def test_join_leave_rooms(self):
+        room = Chatroom("../config/test_config/chat.yaml")
+        socket = Mwsc()
+        test_helper.sync(room.handle_connection(socket, "user"))
+        user = room.connected[socket]
+
+        test_helper.sync(room.command_handler.handle_command("!join general", user, room))
+        self.assertEqual(user.room.name, "general")
+
+        test_helper.sync(room.command_handler.handle_command("!rooms", user, room))
+        self.assertIn("#general (1)", socket.incoming[-1])
+
+        test_helper.sync(room.command_handler.handle_command("!leave", user, room))
+        self.assertEqual(user.room.name, "lobby")
+
+        test_helper.sync(room.command_handler.handle_command("!join bad room!", user, room))
+        self.assertIn("!join usage", socket.incoming[-1])
+        self.assertEqual(user.room.name, "lobby")
+
+
+    def test_resolve(self):
+        handler = CommandHandler()
+        self.assertEqual(handler.resolve("!help"), "!help")
+        self.assertEqual(handler.resolve("!?"), "!help")
+        self.assertEqual(handler.resolve("!nick"), "!setname")
+        self.assertEqual(handler.resolve("!he"), "!help")
+        self.assertEqual(handler.resolve("!hi"), "!history")
+        self.assertEqual(handler.resolve("!h"), ["!help", "!history"])
+        self.assertIsNone(handler.resolve("!fake"))
+        self.assertIsNone(handler.resolve("!"))
+
+    def test_prefix_and_alias(self):
+        room = Chatroom("../config/test_config/chat.yaml")
+        socket = Mwsc()
+        test_helper.sync(room.handle_connection(socket, "user"))
+        user = room.connected[socket]
+
+        test_helper.sync(room.command_handler.handle_command("!NICK renamed", user, room))
+        self.assertEqual(user.name, "renamed")
+
+        test_helper.sync(room.command_handler.handle_command("!pi", user, room))
+        self.assertIn("pong!", socket.incoming[-1])
+
+        test_helper.sync(room.command_handler.handle_command("!p", user, room))
+        self.assertIn("ambiguous", socket.incoming[-1])
+
+    def test_timeout(self):
+        async def slow(handler, user, chatroom, args):
+            await asyncio.sleep(10)
+
+        registered["!slow"] = slow
+        try:
+            handler = CommandHandler(timeout=0.01)
+            room = Chatroom("../config/test_config/chat.yaml")
+            socket = Mwsc()
+            user = User(socket, "Test")
+            test_helper.sync(handler.handle_command("!slow", user, room))
+            self.assertIn("took too long", socket.incoming[-1])
+            self.assertEqual(COMMAND_TIMEOUTS.labels("!slow").value, 1)
+        finally:
+            del registered["!slow"]
+        # the table follows the registry
+        self.assertIsNone(handler.resolve("!slow"))
+
+    def test_timeout_cancels_only_the_command(self):
+        config = test_helper.config_stream("../config/test_config/chat.yaml", broadcast={"concurrent": False})
+        room = Chatroom(config)
+        handler = CommandHandler(timeout=0.05)
+        mover = Mwsc()
+        test_helper.sync(room.handle_connection(mover, "mover"))
+        # a member of the old room that never reads holds up the leave notification
+        stalled = StalledWebsocketClient()
+        stalled_user = User(stalled, "stalled")
+        room.connected[stalled] = stalled_user
+        stalled_user.room = room.rooms.join("lobby", stalled, stalled_user)
+
+        async def run():
+            await handler.handle_command("!join general", room.connected[mover], room)
+            # the connection's task carries on
+            await asyncio.sleep(0)
+            return True
+
+        self.assertTrue(test_helper.sync(run()))
+        self.assertIn("took too long", mover.incoming[-1])
+        user = room.connected[mover]
+        self.assertEqual(user.room.name, "general")
+        self.assertIn(mover, user.room.members)
+        self.assertNotIn(mover, room.rooms.get("lobby").members)
 
 if __name__ == '__main__':
     unittest.main()
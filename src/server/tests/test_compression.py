@@ -0,0 +1,73 @@
+import unittest
+import os
+import sys
+import test_helper
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../server')))
+from websockets.extensions.permessage_deflate import PerMessageDeflate
+from websockets.frames import Frame, OP_TEXT
+from compression import create_compression, ThresholdPerMessageDeflate
+import metrics
+
+
+def negotiate(factory):
+    return factory.process_request_params([], [])[1]
+
+
+class TestCompression(unittest.TestCase):
+
+    def test_disabled(self):
+        self.assertIsNone(create_compression({"enabled": False}))
+        # off unless configured
+        self.assertIsNone(create_compression(None))
+        self.assertIsNone(create_compression({"threshold": 100}))
+        self.assertIsNotNone(create_compression({"enabled": True}))
+
+    def test_client_no_context_takeover(self):
+        extension = negotiate(create_compression({"enabled": True, "client_no_context_takeover": True}))
+        self.assertTrue(extension.remote_no_context_takeover)
+        self.assertFalse(hasattr(extension, "decoder"))
+
+    def test_threshold(self):
+        extension = negotiate(create_compression({"enabled": True, "threshold": 100}))
+        self.assertIsInstance(extension, ThresholdPerMessageDeflate)
+
+        small = Frame(OP_TEXT, b"x" * 99)
+        self.assertIs(extension.encode(small), small)
+        self.assertEqual(extension.stats.skipped, 1)
+
+        large = extension.encode(Frame(OP_TEXT, b"x" * 1000))
+        self.assertTrue(large.rsv1)
+        self.assertLess(len(large.data), 1000)
+        self.assertEqual(extension.stats.compressed, 1)
+
+        decoder = PerMessageDeflate(False, False, 15, 15)
+        self.assertEqual(decoder.decode(large).data, b"x" * 1000)
+
+    def test_shared_without_context_takeover(self):
+        factory = create_compression({"enabled": True, "no_context_takeover": True})
+        first, second = negotiate(factory), negotiate(factory)
+        payload = b"hello everyone " * 20
+
+        encoded = first.encode(Frame(OP_TEXT, payload))
+        self.assertIs(second.encode(Frame(OP_TEXT, payload)).data, encoded.data)
+        self.assertEqual(factory.stats.compressed, 2)
+        self.assertEqual(factory.stats.shared, 1)
+        self.assertLess(factory.stats.ratio, 1.0)
+        text = metrics.render()
+        self.assertIn("chat_compression_compressed_total 2", text)
+        self.assertIn("chat_compression_shared_total 1", text)
+
+        decoder = PerMessageDeflate(True, True, 15, 15)
+        self.assertEqual(decoder.decode(encoded).data, payload)
+
+    def test_not_shared_with_context_takeover(self):
+        factory = create_compression({"enabled": True, "no_context_takeover": False})
+        first, second = negotiate(factory), negotiate(factory)
+        payload = b"hello everyone " * 20
+        first.encode(Frame(OP_TEXT, payload))
+        second.encode(Frame(OP_TEXT, payload))
+        self.assertEqual(factory.stats.shared, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
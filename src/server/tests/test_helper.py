@@ -1,9 +1,21 @@
 import logging
 import asyncio
+import io
+import yaml
 
 # supress test logging
 logging.disable(logging.CRITICAL)
 
 
 def sync(awaitable):
-    return asyncio.get_event_loop().run_until_complete(awaitable)
\ No newline at end of file
+    return asyncio.get_event_loop().run_until_complete(awaitable)
+
+
+def config_stream(config_path, **overrides):
+    """
+    Loads a yaml config, applies top level overrides, and returns it as a stream for ConfigManager
+    """
+    with open(config_path) as file:
+        config = yaml.safe_load(file)
+    config.update(overrides)
+    return io.StringIO(yaml.safe_dump(config))
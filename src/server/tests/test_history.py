@@ -0,0 +1,71 @@
+import unittest
+import os
+import sys
+import json
+import test_helper
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../server')))
+from history import MessageHistory
+from response import Response, Origin
+
+
+class TestHistory(unittest.TestCase):
+
+    def test_recent(self):
+        history = MessageHistory(10, 10000)
+        responses = [Response(str(i), Origin.USER) for i in range(5)]
+        for response in responses:
+            history.append(response)
+        self.assertEqual(history.recent(3), [response.json() for response in responses[2:]])
+        self.assertEqual(history.recent(100), [response.json() for response in responses])
+        self.assertEqual(history.recent(3, binary=True), [response.binary() for response in responses[2:]])
+        self.assertEqual(history.recent(0), [])
+
+    def test_since(self):
+        history = MessageHistory(3, 10000)
+        responses = [Response(str(i), Origin.USER, seq) for seq, i in enumerate(range(5), 1)]
+        for response in responses:
+            history.append(response)
+        self.assertEqual(history.since(3), [response.json() for response in responses[3:]])
+        self.assertEqual(history.since(5), [])
+        # older messages are no longer kept
+        self.assertEqual(history.since(0, binary=True), [response.binary() for response in responses[2:]])
+
+    def test_message_limit(self):
+        history = MessageHistory(3, 10000)
+        for i in range(5):
+            history.append(Response(str(i), Origin.USER))
+        self.assertEqual(len(history), 3)
+        self.assertEqual([json.loads(payload)["body"] for payload in history.recent(3)], ["2", "3", "4"])
+
+    def test_disabled(self):
+        class Unencodable(Response):
+            def json(self):
+                raise AssertionError("encoded while history is disabled")
+
+        history = MessageHistory(0)
+        history.append(Unencodable("x", Origin.USER))
+        self.assertEqual(len(history), 0)
+
+    def test_no_byte_limit(self):
+        history = MessageHistory(3)
+        for i in range(5):
+            history.append(Response("x" * 1000, Origin.USER))
+        self.assertEqual(len(history), 3)
+
+    def test_byte_limit(self):
+        response = Response("x" * 100, Origin.USER)
+        history = MessageHistory(100, 10000)
+        history.append(response)
+        size = history.bytes
+        history = MessageHistory(100, size * 2)
+        for _ in range(5):
+            history.append(response)
+        self.assertEqual(len(history), 2)
+        self.assertLessEqual(history.bytes, size * 2)
+
+        history.append(Response("y" * 1000, Origin.USER))
+        self.assertEqual(len(history), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
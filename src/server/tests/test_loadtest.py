@@ -0,0 +1,58 @@
+import unittest
+import os
+import sys
+import test_helper
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../server')))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../loadtest')))
+from loadtest import LoadTest, percentile, process_stats
+from chatroom import Chatroom
+from server import Server
+
+
+class TestLoadTest(unittest.TestCase):
+
+    def test_percentile(self):
+        samples = list(range(100))
+        self.assertEqual(percentile(samples, 0.5), 50)
+        self.assertEqual(percentile(samples, 0.99), 99)
+        self.assertEqual(percentile(samples, 1.0), 99)
+        self.assertEqual(percentile([], 0.5), 0.0)
+
+    def test_process_stats(self):
+        stats = process_stats()
+        self.assertGreater(stats["rss_bytes"], 0)
+        self.assertGreaterEqual(stats["cpu_seconds"], 0)
+
+    def test_run(self):
+        self._run(["chat.batch"])
+
+    def test_run_binary(self):
+        # binary frames are decoded rather than parsed as JSON
+        self._run(["chat.bin", "chat.batch"])
+
+    def _run(self, subprotocols):
+        chat = Chatroom("../config/test_config/chat.yaml")
+        server = Server("../config/test_config/server.yaml", chat)
+
+        async def run():
+            await chat.handle_startup()
+            websocket_server = await server.serve("127.0.0.1", 0)
+            port = websocket_server.sockets[0].getsockname()[1]
+            load_test = LoadTest(f"ws://127.0.0.1:{port}", clients=20, rooms=2, senders=2, rate=10, duration=0.3,
+                                 connect_concurrency=10, subprotocols=subprotocols, server_stats=process_stats)
+            results = await load_test.run(drain=0.2)
+            websocket_server.close()
+            await websocket_server.wait_closed()
+            return results
+
+        results = test_helper.sync(run())
+        self.assertEqual(results["connections"]["opened"], 20)
+        self.assertGreater(results["messages"]["sent"], 0)
+        # every message reaches the 10 members of its room, including the sender
+        self.assertEqual(results["messages"]["delivered"], results["messages"]["sent"] * 10)
+        self.assertGreater(results["latency_ms"]["p50"], 0)
+        self.assertLessEqual(results["latency_ms"]["p99"], results["latency_ms"]["max"])
+
+
+if __name__ == '__main__':
+    unittest.main()
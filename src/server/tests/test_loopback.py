@@ -0,0 +1,221 @@
+import unittest
+import asyncio
+import json
+import os
+import sys
+import time
+import test_helper
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../server')))
+from mock.loopback import LoopbackNetwork
+from mock.mockwebsocketclient import MockWebsocketClient as Mwsc
+from chatroom import Chatroom, SHUTDOWN_ABORTED
+from response import Response, Origin
+from server import Server
+
+
+def create_server(**chat_overrides):
+    chat = Chatroom(test_helper.config_stream("../config/test_config/chat.yaml", **chat_overrides))
+    return Server("../config/test_config/server.yaml", chat)
+
+
+class TestLoopback(unittest.TestCase):
+
+    def test_fan_out(self):
+        server = create_server()
+
+        async def run():
+            network = LoopbackNetwork(server.ws_handler_async)
+            clients = [await network.connect(f"/room{i % 10}", keep=False) for i in range(300)]
+            await network.settle()
+            before = [client.frames_received for client in clients]
+            for sender in clients[:10]:
+                await sender.send("hello")
+            await network.settle()
+            delivered = [client.frames_received - count for client, count in zip(clients, before)]
+            await network.close_all()
+            return delivered
+
+        delivered = test_helper.sync(run())
+        # one message per room, everyone in the room including the sender receives it once
+        self.assertEqual(delivered, [1] * 300)
+        self.assertEqual(len(server.handler.connected), 0)
+
+    def test_latency_and_bandwidth(self):
+        server = create_server()
+
+        async def run():
+            loop = asyncio.get_event_loop()
+            network = LoopbackNetwork(server.ws_handler_async)
+            slow = await network.connect(latency=0.05)
+            start = loop.time()
+            greeting = json.loads(await slow.recv())
+            latency = loop.time() - start
+
+            narrow = await network.connect(bandwidth=2000)
+            await narrow.recv()
+            start = loop.time()
+            for _ in range(3):
+                await server.handler.send_to_all(server.handler.shutdown_response, local_only=True)
+            frames = [await narrow.recv() for _ in range(3)]
+            transfer = loop.time() - start
+            await network.close_all()
+            return greeting, latency, transfer, sum(len(frame) for frame in frames)
+
+        greeting, latency, transfer, size = test_helper.sync(run())
+        self.assertEqual(greeting["origin"], "SERVER")
+        self.assertGreaterEqual(latency, 0.05)
+        self.assertGreaterEqual(transfer, size / 2000 * 0.9)
+
+    def test_stall_backpressure(self):
+        outbound_queue = {"enabled": True, "max_size": 8, "policy": "drop_oldest"}
+        server = create_server(outbound_queue=outbound_queue)
+
+        async def run():
+            network = LoopbackNetwork(server.ws_handler_async, high_water=1000)
+            sender = await network.connect()
+            stalled = await network.connect()
+            await network.settle()
+            stalled.stall()
+            for i in range(100):
+                await sender.send(f"message {i}")
+                await network.settle(20)
+            user = server.handler.connected[stalled.websocket]
+            dropped, unread = user.dropped, stalled.unread_bytes
+            stalled.resume()
+            await network.settle(50)
+            await network.close_all()
+            return sender, stalled, dropped, unread
+
+        sender, stalled, dropped, unread = test_helper.sync(run())
+        # the healthy sender is unaffected, the stalled client's queue sheds load
+        self.assertEqual(sum("message" in frame for frame in sender.received), 100)
+        self.assertGreater(dropped, 0)
+        self.assertGreater(unread, 1000)
+        self.assertIn("message 99", stalled.received[-1])
+
+    def test_shutdown(self):
+        server = create_server()
+
+        async def run():
+            network = LoopbackNetwork(server.ws_handler_async)
+            clients = [await network.connect() for _ in range(50)]
+            await network.settle()
+            await server.handler.handle_shutdown()
+            await asyncio.gather(*network.handlers)
+            return clients
+
+        clients = test_helper.sync(run())
+        self.assertTrue(all(not client.open for client in clients))
+        self.assertIn(server.handler.get_shutdown_notification(), clients[0].received[-1])
+        self.assertEqual(len(server.handler.connected), 0)
+        # clients are told to reconnect, each after its own delay, and nobody is told the others left
+        self.assertTrue(all(client.close_code == 1012 for client in clients))
+        self.assertRegex(clients[0].close_reason, r"^reconnect in \d+ms$")
+        self.assertGreater(len({client.close_reason for client in clients}), 1)
+        self.assertFalse(any("disconnected" in frame for client in clients for frame in client.received))
+
+    def test_shutdown_deadline(self):
+        server = create_server()
+
+        async def run():
+            network = LoopbackNetwork(server.ws_handler_async, high_water=1000)
+            healthy = await network.connect()
+            stalled = await network.connect()
+            await network.settle()
+            stalled.stall()
+            # a peer that stopped reading, sends to it wait until it is aborted
+            blocked = asyncio.ensure_future(server.handler.send(Response("x" * 2000, Origin.SERVER), stalled.websocket))
+            await network.settle()
+            start = time.perf_counter()
+            await server.handler.handle_shutdown(0.1)
+            elapsed = time.perf_counter() - start
+            await asyncio.gather(blocked, *network.handlers, return_exceptions=True)
+            return healthy, stalled, elapsed
+
+        healthy, stalled, elapsed = test_helper.sync(run())
+        self.assertLess(elapsed, 1)
+        self.assertEqual(healthy.close_code, 1012)
+        self.assertEqual(stalled.close_code, 1006)
+        self.assertEqual(len(server.handler.connected), 0)
+
+    def test_shutdown_unanswered_close(self):
+        server = create_server()
+
+        async def run():
+            network = LoopbackNetwork(server.ws_handler_async)
+            healthy = await network.connect()
+            dead = await network.connect()
+            await network.settle()
+            # the notification is sent but the close frame is never answered, the connection stays closing
+            dead.hang()
+            start = time.perf_counter()
+            await server.handler.handle_shutdown(0.1)
+            elapsed = time.perf_counter() - start
+            await asyncio.gather(*network.handlers, return_exceptions=True)
+            return healthy, dead, elapsed
+
+        aborted = SHUTDOWN_ABORTED.value
+        healthy, dead, elapsed = test_helper.sync(run())
+        self.assertLess(elapsed, 1)
+        self.assertEqual(healthy.close_code, 1012)
+        self.assertEqual(dead.close_code, 1006)
+        self.assertEqual(SHUTDOWN_ABORTED.value, aborted + 1)
+        self.assertEqual(len(server.handler.connected), 0)
+
+    def test_resume(self):
+        server = create_server()
+
+        async def run():
+            network = LoopbackNetwork(server.ws_handler_async)
+            alice = await network.connect("/general")
+            bob = await network.connect("/general")
+            await network.settle()
+            await alice.send("before")
+            await network.settle()
+            session = [json.loads(frame) for frame in alice.received if "SESSION" in frame][-1]
+            last = max(json.loads(frame).get("seq", 0) for frame in alice.received if frame.startswith("{"))
+            name = next(iter(server.handler.connected.values())).name
+
+            # the connection drops, bob keeps talking in the meantime
+            await alice.close(1006)
+            await network.settle()
+            bob.received.clear()
+            await bob.send("one")
+            await bob.send("two")
+            await network.settle()
+
+            resumed = await network.connect(f"/general?resume={session['body']}&last={last}", "chat.batch")
+            await network.settle()
+            names = [user.name for user in server.handler.connected.values()]
+            await network.close_all()
+            return session, name, names, [json.loads(frame) for frame in resumed.received], list(bob.received)
+
+        session, name, names, received, bob_received = test_helper.sync(run())
+        self.assertEqual(session["seq"], 0)
+        # no greeting, only the token and the messages missed while disconnected
+        self.assertEqual(received[0]["origin"], "SESSION")
+        self.assertEqual(received[0]["body"], session["body"])
+        self.assertEqual([response["body"].split(": ", 1)[1] for response in received[1]], ["one", "two"])
+        self.assertEqual(received[0]["seq"], received[1][-1]["seq"])
+        self.assertIn(name, names)
+        # bob saw neither a disconnect nor a join
+        self.assertEqual(len(bob_received), 2)
+        self.assertEqual(len(server.handler.connected), 0)
+
+    def test_mock_iteration(self):
+        websocket = Mwsc("fake", itr_delay=0)
+
+        async def run():
+            messages = []
+            async for message in websocket:
+                messages.append(message)
+                if len(messages) == 3:
+                    await websocket.close()
+            return messages
+
+        self.assertEqual(test_helper.sync(run()), ["fake"] * 3)
+        self.assertEqual(test_helper.sync(websocket.recv()), "fake")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import unittest
+import os
+import sys
+import tempfile
+import test_helper
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../server')))
+from mock.mockwebsocketclient import MockWebsocketClient as Mwsc
+from message_log import MessageLog
+from chatroom import Chatroom
+
+
+class TestMessageLog(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.directory = self.tempdir.name
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_append_and_reopen(self):
+        message_log = MessageLog(self.directory)
+        for i in range(10):
+            message_log.append("lobby" if i % 2 == 0 else "general", f"message {i}")
+        message_log.close()
+
+        message_log = MessageLog(self.directory)
+        self.assertEqual(message_log.end, 10)
+        self.assertEqual(message_log.recent("general", 2), ["message 7", "message 9"])
+        self.assertEqual(message_log.read_from(3, 2), [("general", "message 3"), ("lobby", "message 4")])
+        message_log.close()
+
+    def test_segments(self):
+        message_log = MessageLog(self.directory, segment_bytes=100, index_interval=2)
+        for i in range(50):
+            message_log.append("lobby", f"message {i}")
+        message_log.flush()
+
+        self.assertGreater(len(message_log.segments), 1)
+        self.assertEqual(message_log.end, 50)
+        self.assertEqual([payload for _, payload in message_log.read_from(20, 30)],
+                         [f"message {i}" for i in range(20, 50)])
+        self.assertEqual(message_log.recent("lobby", 3), ["message 47", "message 48", "message 49"])
+        message_log.close()
+
+        # older segments are indexed lazily after reopening
+        message_log = MessageLog(self.directory, segment_bytes=100, index_interval=2)
+        self.assertEqual(message_log.read_from(5, 1), [("lobby", "message 5")])
+        message_log.close()
+
+    def test_torn_tail(self):
+        message_log = MessageLog(self.directory)
+        message_log.append("lobby", "complete")
+        message_log.close()
+
+        path = message_log.segments[-1].path
+        size = os.path.getsize(path)
+        with open(path, "ab") as file:
+            file.write(b"\x00\x00\x01\x00torn")
+
+        message_log = MessageLog(self.directory)
+        self.assertEqual(os.path.getsize(path), size)
+        self.assertEqual(message_log.recent("lobby", 10), ["complete"])
+        message_log.append("lobby", "after recovery")
+        message_log.close()
+
+        message_log = MessageLog(self.directory)
+        self.assertEqual(message_log.recent("lobby", 10), ["complete", "after recovery"])
+        message_log.close()
+
+    def test_retention(self):
+        message_log = MessageLog(self.directory, segment_bytes=100, retention_bytes=300)
+        for i in range(100):
+            message_log.append("lobby", f"message {i}")
+        message_log.close()
+
+        self.assertLessEqual(sum(segment.size for segment in message_log.segments), 300 + 100)
+        self.assertEqual(len(os.listdir(self.directory)), len(message_log.segments))
+        self.assertEqual(message_log.recent("lobby", 1), ["message 99"])
+
+    def test_chatroom_persistence(self):
+        persistence = {"enabled": True, "directory": self.directory}
+        room = Chatroom(test_helper.config_stream("../config/test_config/chat.yaml", persistence=persistence))
+        test_helper.sync(room.handle_startup())
+        socket = Mwsc()
+        test_helper.sync(room.handle_connection(socket, "sender"))
+        test_helper.sync(room.handle_message(socket, "persisted"))
+        test_helper.sync(room.handle_shutdown())
+
+        # a restarted chatroom replays the persisted message to new connections
+        room = Chatroom(test_helper.config_stream("../config/test_config/chat.yaml", persistence=persistence))
+        test_helper.sync(room.handle_startup())
+        socket = Mwsc()
+        test_helper.sync(room.handle_connection(socket, "reader"))
+        self.assertTrue(any("sender: persisted" in frame for frame in socket.incoming))
+        test_helper.sync(room.handle_shutdown())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+import unittest
+import asyncio
+import json
+import os
+import time
+import sys
+import test_helper
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../server')))
+from mock.mockwebsocketclient import MockWebsocketClient as Mwsc
+from metrics import Registry, LoopLagMonitor, MetricsPublisher, Histogram, Gauge
+from bus import LocalBus
+from chatroom import Chatroom
+from server import Server
+import metrics
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_counter_and_gauge(self):
+        registry = Registry()
+        counter = registry.counter("test_total", "A counter", ("kind",))
+        counter.labels("a").inc()
+        counter.labels("a").inc(2)
+        counter.labels('q"uote').inc()
+        registry.gauge("test_gauge", "A gauge", function=lambda: 7)
+        self.assertIs(registry.counter("test_total", "A counter", ("kind",)), counter)
+        with self.assertRaises(ValueError):
+            registry.histogram("test_total", "Not a counter")
+
+        text = registry.render()
+        self.assertIn("# TYPE test_total counter", text)
+        self.assertIn('test_total{kind="a"} 3', text)
+        self.assertIn('test_total{kind="q\\"uote"} 1', text)
+        self.assertIn("test_gauge 7", text)
+
+    def test_histogram(self):
+        registry = Registry()
+        histogram = registry.histogram("test_seconds", "A histogram", buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 5.0):
+            histogram.observe(value)
+
+        text = registry.render()
+        self.assertIn('test_seconds_bucket{le="0.1"} 2', text)
+        self.assertIn('test_seconds_bucket{le="1.0"} 3', text)
+        self.assertIn('test_seconds_bucket{le="+Inf"} 4', text)
+        self.assertIn("test_seconds_count 4", text)
+        self.assertIn("test_seconds_sum 5.65", text)
+
+    def test_worker_samples(self):
+        worker0, worker1 = Registry(), Registry()
+        worker0.worker, worker1.worker = 0, 1
+        worker0.counter("test_total", "A counter").inc(3)
+        worker1.counter("test_total", "A counter").inc(5)
+        hub, received = [], []
+        sender, receiver = LocalBus(hub), LocalBus(hub)
+        receiver.subscribe(lambda event: asyncio.sleep(0, received.append(event)))
+
+        async def run():
+            await sender.start()
+            await receiver.start()
+            publisher = MetricsPublisher(worker0, sender, interval=10)
+            publisher.start()
+            await asyncio.sleep(0.01)
+            publisher.stop()
+
+        test_helper.sync(run())
+        # events cross the broker as JSON
+        event = json.loads(json.dumps([event for event in received if event["type"] == "metrics"][0]))
+        worker1.peers[event["node"]] = event["samples"]
+
+        text = worker1.render()
+        self.assertEqual(text.count("# TYPE test_total counter"), 1)
+        self.assertIn('test_total{worker="1"} 5', text)
+        self.assertIn('test_total{worker="0"} 3', text)
+
+    def test_chatroom_metrics(self):
+        room = Chatroom("../config/test_config/chat.yaml")
+        websocket = Mwsc()
+        test_helper.sync(room.handle_connection(websocket, "counted"))
+        received = metrics.REGISTRY.metrics["chat_messages_received_total"].value
+        commands = metrics.REGISTRY.metrics["chat_commands_total"].labels("!ping").value
+        test_helper.sync(room.handle_message(websocket, "hello"))
+        test_helper.sync(room.handle_message(websocket, "!ping"))
+
+        self.assertEqual(metrics.REGISTRY.metrics["chat_messages_received_total"].value, received + 2)
+        self.assertEqual(metrics.REGISTRY.metrics["chat_commands_total"].labels("!ping").value, commands + 1)
+        text = metrics.render()
+        self.assertIn("chat_connections 1", text)
+        self.assertIn('chat_command_duration_seconds_count{command="!ping"}', text)
+        self.assertIn("chat_broadcast_duration_seconds_count", text)
+
+    def test_loop_lag(self):
+        histogram, gauge = Histogram("lag", "lag"), Gauge("last", "last")
+        monitor = LoopLagMonitor(histogram, gauge, interval=0.01)
+
+        async def run():
+            monitor.start()
+            await asyncio.sleep(0.02)
+            # block the loop so the monitor wakes up late
+            time.sleep(0.05)
+            await asyncio.sleep(0.02)
+            monitor.stop()
+
+        test_helper.sync(run())
+        self.assertGreater(histogram.count, 0)
+        self.assertGreaterEqual(histogram.sum, 0.03)
+
+    def test_endpoint(self):
+        chat = Chatroom("../config/test_config/chat.yaml")
+        server = Server("../config/test_config/server.yaml", chat)
+
+        async def run():
+            await chat.handle_startup()
+            websocket_server = await server.serve("127.0.0.1", 0)
+            port = websocket_server.sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(b"GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n")
+            response = await reader.read()
+            writer.close()
+            websocket_server.close()
+            await websocket_server.wait_closed()
+            return response.decode("utf-8")
+
+        response = test_helper.sync(run())
+        self.assertTrue(response.startswith("HTTP/1.1 200"))
+        self.assertIn("text/plain; version=0.0.4", response)
+        self.assertIn("# TYPE chat_connections gauge", response)
+        self.assertIsNone(test_helper.sync(server.process_request("/general", {})))
+
+
+if __name__ == '__main__':
+    unittest.main()
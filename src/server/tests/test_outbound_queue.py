@@ -0,0 +1,123 @@
+import unittest
+import asyncio
+import json
+import os
+import sys
+import test_helper
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../server')))
+from mock.mockwebsocketclient import MockWebsocketClient as Mwsc
+from outbound_queue import OutboundQueue, SlowConsumerPolicy, MESSAGES_WRITTEN, FRAMES_WRITTEN
+from response import Response, Origin
+
+
+class TestOutboundQueue(unittest.TestCase):
+
+    def test_writer_sends_in_order(self):
+        socket = Mwsc()
+
+        async def run():
+            queue = OutboundQueue(socket, 10)
+            queue.start()
+            for i in range(5):
+                queue.put(str(i), Origin.USER.value)
+            await queue.flush()
+            await queue.stop()
+
+        test_helper.sync(run())
+        self.assertEqual(socket.incoming, ["0", "1", "2", "3", "4"])
+
+    def test_drop_oldest(self):
+        queue = OutboundQueue(Mwsc(), 3, SlowConsumerPolicy.DROP_OLDEST)
+        for i in range(5):
+            self.assertTrue(queue.put(str(i), Origin.USER.value))
+
+        self.assertEqual(queue.depth, 3)
+        self.assertEqual(queue.dropped, 2)
+        self.assertEqual([payload for payload, _ in queue._queue], ["2", "3", "4"])
+
+    def test_drop_chat(self):
+        queue = OutboundQueue(Mwsc(), 3, SlowConsumerPolicy.DROP_CHAT)
+        queue.put("server", Origin.SERVER.value)
+        queue.put("chat 1", Origin.USER.value)
+        queue.put("private", Origin.PRIVATE.value)
+        queue.put("chat 2", Origin.USER.value)
+        queue.put("server 2", Origin.SERVER.value)
+
+        self.assertEqual([payload for payload, _ in queue._queue], ["server", "private", "server 2"])
+        self.assertFalse(queue.put("chat 3", Origin.USER.value))
+        self.assertEqual(queue.dropped, 3)
+
+    def test_disconnect(self):
+        socket = Mwsc()
+
+        async def run():
+            queue = OutboundQueue(socket, 2, SlowConsumerPolicy.DISCONNECT)
+            queue.put("1", Origin.USER.value)
+            queue.put("2", Origin.USER.value)
+            self.assertFalse(queue.put("3", Origin.USER.value))
+            await asyncio.sleep(0)
+            return queue
+
+        queue = test_helper.sync(run())
+        self.assertTrue(queue.closed)
+        self.assertEqual(queue.depth, 0)
+        self.assertFalse(socket.open)
+        self.assertFalse(queue.put("4", Origin.SERVER.value))
+
+    def test_coalesce(self):
+        socket = Mwsc()
+        messages, frames = MESSAGES_WRITTEN.value, FRAMES_WRITTEN.value
+
+        async def run():
+            queue = OutboundQueue(socket, 100, batch_interval=0.01, batch_bytes=1000)
+            queue.start()
+            queue.put('{"n": 0}', Origin.USER.value)
+            queue.put('[{"n": 1},{"n": 2}]', Origin.SERVER.value)
+            queue.put('{"n": 3}', Origin.USER.value)
+            await asyncio.sleep(0.05)
+            await queue.flush()
+            await queue.stop()
+            return queue
+
+        queue = test_helper.sync(run())
+        self.assertEqual(len(socket.incoming), 1)
+        self.assertEqual([m["n"] for m in json.loads(socket.incoming[0])], [0, 1, 2, 3])
+        self.assertEqual(queue.frames_sent, 1)
+        self.assertEqual(queue.messages_sent, 3)
+        # exported as totals over every queue
+        self.assertEqual(FRAMES_WRITTEN.value - frames, 1)
+        self.assertEqual(MESSAGES_WRITTEN.value - messages, 3)
+
+    def test_coalesce_max_bytes(self):
+        socket = Mwsc()
+
+        async def run():
+            queue = OutboundQueue(socket, 100, batch_interval=0.0, batch_bytes=20)
+            for i in range(4):
+                queue.put(f'{{"n": {i}}}', Origin.USER.value)
+            queue.start()
+            await queue.flush()
+            await queue.stop()
+
+        test_helper.sync(run())
+        self.assertEqual(len(socket.incoming), 2)
+        self.assertEqual(json.loads(socket.incoming[0]), [{"n": 0}, {"n": 1}])
+
+    def test_coalesce_binary(self):
+        socket = Mwsc()
+        records = [Response(f"message {i}", Origin.USER).binary() for i in range(3)]
+
+        async def run():
+            queue = OutboundQueue(socket, 100, batch_interval=0.0, batch_bytes=1000)
+            for record in records:
+                queue.put(record, Origin.USER.value)
+            queue.start()
+            await queue.flush()
+            await queue.stop()
+
+        test_helper.sync(run())
+        self.assertEqual(socket.incoming, [b"".join(records)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+import os
+import sys
+import test_helper
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../server')))
+from rate_limit import RateLimiter
+
+
+class TestRateLimit(unittest.TestCase):
+
+    def test_burst_then_refill(self):
+        limiter = RateLimiter(messages_per_second=2, burst=2.0)
+        for _ in range(4):
+            self.assertEqual(limiter.acquire("client", 10, now=0.0), 0.0)
+        self.assertAlmostEqual(limiter.acquire("client", 10, now=0.0), 0.5)
+        self.assertEqual(limiter.acquire("client", 10, now=0.5), 0.0)
+        self.assertGreater(limiter.acquire("client", 10, now=0.5), 0.0)
+
+        # keys are independent
+        self.assertEqual(limiter.acquire("other", 10, now=0.5), 0.0)
+
+    def test_bytes_and_commands(self):
+        limiter = RateLimiter(bytes_per_second=100, commands_per_second=1, burst=1.0)
+        self.assertEqual(limiter.acquire("client", 60, now=0.0), 0.0)
+        self.assertAlmostEqual(limiter.acquire("client", 60, now=0.0), 0.2)
+
+        self.assertEqual(limiter.acquire("client", 1, command=True, now=0.0), 0.0)
+        self.assertAlmostEqual(limiter.acquire("client", 1, command=True, now=0.0), 1.0)
+        self.assertEqual(limiter.acquire("client", 1, now=0.0), 0.0)
+
+        # messages larger than the bucket are still allowed once it is full
+        self.assertEqual(limiter.acquire("large", 1000, now=0.0), 0.0)
+
+    def test_check_then_debit(self):
+        limiter = RateLimiter(messages_per_second=1, bytes_per_second=100, burst=1.0)
+        for _ in range(3):
+            self.assertEqual(limiter.check("client", 60, now=0.0), 0.0)
+        limiter.debit("client", 60)
+        self.assertAlmostEqual(limiter.check("client", 60, now=0.0), 1.0)
+        self.assertAlmostEqual(limiter.acquire("client", 60, now=0.5), 0.5)
+        self.assertEqual(limiter.acquire("client", 60, now=1.0), 0.0)
+
+    def test_unlimited(self):
+        limiter = RateLimiter()
+        for _ in range(1000):
+            self.assertEqual(limiter.acquire("client", 1000, command=True, now=0.0), 0.0)
+
+    def test_idle_buckets_expire(self):
+        limiter = RateLimiter(messages_per_second=1, burst=2.0)
+        for i in range(100):
+            limiter.acquire(i, 1, now=0.0)
+        self.assertEqual(len(limiter), 100)
+
+        # each acquire examines a couple of the oldest buckets
+        for _ in range(60):
+            limiter.acquire("active", 1, now=10.0)
+        self.assertLess(len(limiter), 100)
+        for _ in range(60):
+            limiter.acquire("active", 1, now=10.0)
+        self.assertEqual(len(limiter), 1)
+
+        limiter.forget("active")
+        self.assertEqual(len(limiter), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,8 +3,11 @@ import os
 import sys
 #import test_helper
 import logging
+import json
+import time
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../server')))
-from response import Response, Origin
+from response import Response, Origin, BINARY_HEADER, ORIGIN_CODES, SENT_AT_FORMAT
+from clock import CoarseClock
 from utils import log, log_message
 
 
@@ -20,6 +23,100 @@ class TestResponse(unittest.TestCase):
         self.assertEqual(resp.data["body"], "data")
         self.assertEqual(resp.data["origin"], Origin.SERVER.value)
 
+    def test_json(self):
+        resp = Response("da\"ta\n", Origin.USER)
+        self.assertEqual(json.loads(resp.json()), resp.data)
+        self.assertEqual(resp.json(), json.dumps(resp.data))
+
+    def test_json_encoded_once(self):
+        resp = Response("data", Origin.USER)
+        self.assertIs(resp.json(), resp.json())
+
+    def test_with_origin(self):
+        resp = Response("data", Origin.USER)
+        copy = resp.with_origin(Origin.SELF)
+        self.assertEqual(copy.data["body"], "data")
+        self.assertEqual(copy.data["origin"], Origin.SELF.value)
+        self.assertEqual(copy.data["sentAt"], resp.data["sentAt"])
+        self.assertEqual(resp.data["origin"], Origin.USER.value)
+        self.assertEqual(copy.json(), json.dumps(copy.data))
+
+    def test_restamp(self):
+        resp = Response.from_data({"body": "data", "origin": Origin.SERVER.value, "sentAt": "01/01/2021, 00:00:00"})
+        copy = resp.restamp()
+        self.assertNotEqual(copy.data["sentAt"], "01/01/2021, 00:00:00")
+        self.assertGreater(copy.sent_at_ms, resp.sent_at_ms)
+        self.assertEqual(copy.data["origin"], Origin.SERVER.value)
+        self.assertEqual(copy.json(), json.dumps(copy.data))
+
+    def test_immutable(self):
+        resp = Response("data", Origin.USER)
+        with self.assertRaises(AttributeError):
+            resp.body = "changed"
+        with self.assertRaises(AttributeError):
+            resp.extra = "value"
+        resp.data["body"] = "changed"
+        self.assertEqual(resp.body, "data")
+
+    def test_interned_origin(self):
+        resp = Response.from_json(Response("data", Origin.USER).json())
+        self.assertIs(resp.origin, Origin.USER.value)
+
+    def test_coarse_clock(self):
+        clock = CoarseClock(SENT_AT_FORMAT)
+        sent_at, sent_at_ms = clock.now()
+        again, again_ms = clock.now()
+        self.assertGreaterEqual(again_ms, sent_at_ms)
+        if again_ms // 1000 == sent_at_ms // 1000:
+            # formatted once per second
+            self.assertIs(again, sent_at)
+        self.assertEqual(sent_at, time.strftime(SENT_AT_FORMAT, time.localtime(sent_at_ms // 1000)))
+
+    def test_binary(self):
+        resp = Response("dätä", Origin.USER)
+        payload = resp.binary()
+        code, sent_at_ms, seq, length = BINARY_HEADER.unpack_from(payload)
+        self.assertEqual(code, ORIGIN_CODES[Origin.USER.value])
+        self.assertEqual(sent_at_ms, resp.sent_at_ms)
+        self.assertEqual(seq, 0)
+        self.assertEqual(payload[BINARY_HEADER.size:].decode("utf-8"), "dätä")
+        self.assertEqual(length, len("dätä".encode("utf-8")))
+        self.assertIs(resp.binary(), payload)
+        self.assertLess(len(payload), len(resp.json()))
+
+    def test_from_binary(self):
+        first = Response("dätä", Origin.USER, 7)
+        second = Response("data", Origin.SERVER)
+        decoded = Response.from_binary(first.binary() + second.binary())
+        self.assertEqual([resp.data for resp in decoded], [first.data, second.data])
+        self.assertEqual([resp.sent_at_ms for resp in decoded], [first.sent_at_ms, second.sent_at_ms])
+        self.assertIs(decoded[1].origin, Origin.SERVER.value)
+        self.assertEqual(Response.from_binary(b""), [])
+
+    def test_seq(self):
+        resp = Response("data", Origin.USER, 7)
+        self.assertEqual(json.loads(resp.json()), resp.data)
+        self.assertEqual(resp.data["seq"], 7)
+        self.assertEqual(BINARY_HEADER.unpack_from(resp.binary())[2], 7)
+        self.assertEqual(resp.with_origin(Origin.SELF).seq, 7)
+        self.assertNotIn("seq", Response("data", Origin.USER).data)
+
+        copy = resp.with_seq(8)
+        self.assertEqual(copy.seq, 8)
+        self.assertEqual(resp.seq, 7)
+        # sequence numbers are only kept when given, not read from another node's or log's data
+        self.assertIsNone(Response.from_json(resp.json()).seq)
+        self.assertNotIn("seq", json.loads(Response.from_json(resp.json()).json()))
+        self.assertEqual(Response.from_json(resp.json(), 7).json(), resp.json())
+
+    def test_from_json(self):
+        resp = Response("data", Origin.USER)
+        copy = Response.from_json(resp.json())
+        self.assertEqual(copy.data, resp.data)
+        # sentAt has second precision
+        self.assertEqual(copy.sent_at_ms // 1000, resp.sent_at_ms // 1000)
+        self.assertEqual(copy.with_origin(Origin.SELF).sent_at_ms, copy.sent_at_ms)
+
 
 if __name__ == "__main__":
     unittest.main()
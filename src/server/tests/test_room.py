@@ -0,0 +1,62 @@
+import unittest
+import os
+import sys
+import test_helper
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../server')))
+from mock.mockwebsocketclient import MockWebsocketClient as Mwsc
+from room import RoomRegistry
+from user import User
+
+
+class TestRoom(unittest.TestCase):
+
+    def test_room_name(self):
+        registry = RoomRegistry("lobby")
+        self.assertEqual(registry.room_name(None), "lobby")
+        self.assertEqual(registry.room_name("/"), "lobby")
+        self.assertEqual(registry.room_name("/General"), "general")
+        self.assertEqual(registry.room_name("/general?token=abc"), "general")
+        self.assertEqual(registry.room_name("/not a room"), "lobby")
+        self.assertEqual(registry.room_name("/" + "a" * 33), "lobby")
+
+    def test_join_leave(self):
+        registry = RoomRegistry("lobby")
+        socket = Mwsc()
+        room = registry.join("general", socket, User(socket, "name"))
+        self.assertIs(registry.get("general"), room)
+        self.assertEqual(room.get_who(), "name")
+
+        registry.leave(room, socket)
+        self.assertEqual(len(room), 0)
+        self.assertEqual(room.get_who(), "")
+
+    def test_evict_idle(self):
+        registry = RoomRegistry("lobby", idle_timeout=10)
+        socket = Mwsc()
+        user = User(socket, "name")
+        lobby = registry.join("lobby", socket, user)
+        registry.leave(lobby, socket)
+        room = registry.join("general", socket, user)
+        registry.leave(room, socket)
+
+        self.assertEqual(registry.evict_idle(), 0)
+        self.assertIsNotNone(registry.get("general"))
+
+        self.assertEqual(registry.evict_idle(now=float("inf")), 1)
+        self.assertIsNone(registry.get("general"))
+        self.assertIsNotNone(registry.get("lobby"))
+
+    def test_rejoin_prevents_eviction(self):
+        registry = RoomRegistry("lobby", idle_timeout=10)
+        socket = Mwsc()
+        user = User(socket, "name")
+        room = registry.join("general", socket, user)
+        registry.leave(room, socket)
+        registry.join("general", socket, user)
+
+        self.assertEqual(registry.evict_idle(now=float("inf")), 0)
+        self.assertIs(registry.get("general"), room)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,12 +1,13 @@
 import unittest
 import asyncio
-import threading
-import time
+import json
 import os
 import sys
 import test_helper
+import websockets
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../server')))
-from server import Server
+from server import Server, RATE_LIMIT_WARNING
+from rate_limit import RateLimitAction
 from chatroom import Chatroom
 from config_manager import ConfigManager
 from mock.mockwebsocketclient import MockWebsocketClient as Mwsc
@@ -25,27 +26,123 @@ class TestServer(unittest.TestCase):
         self.assertFalse(server.running)
         self.assertIsNotNone(server.handler)
         self.assertEqual(server.handler, chat)
+        self.assertEqual(server.workers, server_config["workers"])
 
-    # yikes
-    # def test_server_start(self):
-    #     startup_delay = 3.0
-    #     host = "localhost"
-    #     port = 5000
-
-    #     server = Server(host, port)
-    #     loop = asyncio.new_event_loop()
-
-    #     def otherthread():
-    #         print(id(server))
-    #         asyncio.set_event_loop(loop)
-    #         server.start()
-
-    #     thread = threading.Thread(target=otherthread)
-    #     thread.start()
-    #     time.sleep(startup_delay)
-    #     self.assertTrue(server.running)
-    #     server.stop()
-    #     thread.join()
+    def test_sessions_need_one_worker(self):
+        chat = Chatroom("../config/test_config/chat.yaml")
+        self.assertIsNotNone(chat.sessions)
+        Server(test_helper.config_stream("../config/test_config/server.yaml", workers=2), chat)
+        self.assertIsNone(chat.sessions)
+
+    def test_rate_limit(self):
+        rate_limit = {
+            "enabled": True, "action": "warn", "burst": 1.0,
+            "connection": {"messages_per_second": 2}, "address": {}}
+        chat = Chatroom("../config/test_config/chat.yaml")
+        server = Server(test_helper.config_stream("../config/test_config/server.yaml", rate_limit=rate_limit), chat)
+        websocket = Mwsc()
+        test_helper.sync(chat.handle_connection(websocket, "flooder"))
+
+        self.assertTrue(test_helper.sync(server.rate_limit(websocket, "one")))
+        self.assertTrue(test_helper.sync(server.rate_limit(websocket, "two")))
+        self.assertFalse(test_helper.sync(server.rate_limit(websocket, "three")))
+        self.assertIn(RATE_LIMIT_WARNING, websocket.incoming[-1])
+
+        server.rate_limit_action = RateLimitAction.DISCONNECT
+        self.assertFalse(test_helper.sync(server.rate_limit(websocket, "four")))
+        self.assertFalse(websocket.open)
+
+        server.rate_limit_action = RateLimitAction.THROTTLE
+        self.assertTrue(test_helper.sync(server.rate_limit(Mwsc(), "five")))
+
+    def test_rate_limit_charges_accepted_messages_once(self):
+        rate_limit = {
+            "enabled": True, "action": "warn", "burst": 1.0,
+            "connection": {"messages_per_second": 2}, "address": {"messages_per_second": 1}}
+        chat = Chatroom("../config/test_config/chat.yaml")
+        server = Server(test_helper.config_stream("../config/test_config/server.yaml", rate_limit=rate_limit), chat)
+        websocket = Mwsc()
+        websocket.remote_address = ("10.0.0.1", 1234)
+        test_helper.sync(chat.handle_connection(websocket, "flooder"))
+
+        self.assertTrue(test_helper.sync(server.rate_limit(websocket, "one")))
+        # the address limit rejects this one, the connection's bucket is left alone
+        self.assertFalse(test_helper.sync(server.rate_limit(websocket, "two")))
+        server.address_limiter.forget("10.0.0.1")
+        self.assertTrue(test_helper.sync(server.rate_limit(websocket, "three")))
+        self.assertFalse(test_helper.sync(server.rate_limit(websocket, "four")))
+
+    def test_rate_limit_counts_utf8_bytes(self):
+        rate_limit = {
+            "enabled": True, "action": "warn", "burst": 1.0,
+            "connection": {"bytes_per_second": 100}, "address": {}}
+        chat = Chatroom("../config/test_config/chat.yaml")
+        server = Server(test_helper.config_stream("../config/test_config/server.yaml", rate_limit=rate_limit), chat)
+        websocket = Mwsc()
+        test_helper.sync(chat.handle_connection(websocket, "emoji"))
+
+        # 30 characters, 120 bytes
+        self.assertTrue(test_helper.sync(server.rate_limit(websocket, "\U0001F600" * 30)))
+        self.assertFalse(test_helper.sync(server.rate_limit(websocket, "a")))
+
+    def test_serve(self):
+        chat = Chatroom("../config/test_config/chat.yaml")
+        server = Server("../config/test_config/server.yaml", chat)
+
+        async def run():
+            await chat.handle_startup()
+            websocket_server = await server.serve("127.0.0.1", 0)
+            port = websocket_server.sockets[0].getsockname()[1]
+            async with websockets.connect(f"ws://127.0.0.1:{port}/general", subprotocols=["chat.batch"]) as client:
+                greeting = json.loads(await client.recv())
+                self.assertEqual(client.subprotocol, "chat.batch")
+                # buffer limits come from server.yaml, and the client was asked not to keep compression context
+                connection = next(iter(websocket_server.websockets))
+                self.assertEqual(connection.max_size, server.websocket_options["max_size"])
+                self.assertEqual(connection.max_queue, server.websocket_options["max_queue"])
+                self.assertTrue(client.extensions[0].local_no_context_takeover)
+                await client.send("hello")
+                while True:
+                    response = json.loads(await client.recv())
+                    if response["origin"] == "SELF":
+                        break
+            websocket_server.close()
+            await websocket_server.wait_closed()
+            return greeting, response
+
+        greeting, response = test_helper.sync(run())
+        self.assertEqual(greeting["origin"], "SERVER")
+        self.assertTrue(response["body"].endswith(": hello"))
+        self.assertEqual(len(chat.connected), 0)
+
+    def test_drain(self):
+        chat = Chatroom("../config/test_config/chat.yaml")
+        server = Server("../config/test_config/server.yaml", chat)
+
+        async def run():
+            await chat.handle_startup()
+            websocket_server = await server.serve("127.0.0.1", 0)
+            port = websocket_server.sockets[0].getsockname()[1]
+            async with websockets.connect(f"ws://127.0.0.1:{port}/general") as client:
+                await client.recv()
+                await server.drain()
+                messages = []
+                with self.assertRaises(websockets.exceptions.ConnectionClosedError):
+                    while True:
+                        messages.append(await client.recv())
+                close_code, close_reason = client.close_code, client.close_reason
+            # no longer listening
+            with self.assertRaises(OSError):
+                await websockets.connect(f"ws://127.0.0.1:{port}/general")
+            websocket_server.close()
+            await websocket_server.wait_closed()
+            return messages, close_code, close_reason
+
+        messages, close_code, close_reason = test_helper.sync(run())
+        self.assertIn(chat.get_shutdown_notification(), messages[-1])
+        self.assertEqual(close_code, 1012)
+        self.assertTrue(close_reason.startswith("reconnect in "))
+        self.assertEqual(len(chat.connected), 0)
 
 
 if __name__ == '__main__':
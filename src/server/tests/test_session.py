@@ -0,0 +1,68 @@
+import unittest
+import asyncio
+import os
+import sys
+import test_helper
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../server')))
+from session import SessionRegistry, resume_request
+from user import User
+
+
+class TestSessionRegistry(unittest.TestCase):
+
+    def test_park_and_resume(self):
+        expired = []
+
+        async def run():
+            sessions = SessionRegistry(0.05, lambda user: asyncio.sleep(0, expired.append(user)))
+            user = User(None, "Alice")
+            token = sessions.issue(user)
+            self.assertEqual(user.token, token)
+            # a connected user can be resumed too, e.g. when their old connection hasn't timed out yet
+            self.assertIs(sessions.resume(token), user)
+            self.assertIsNone(sessions.resume("unknown"))
+
+            sessions.park(user)
+            self.assertTrue(sessions.is_parked("Alice"))
+            self.assertEqual(len(sessions), 1)
+            self.assertIs(sessions.resume(token), user)
+            self.assertFalse(sessions.is_parked("Alice"))
+            self.assertEqual(len(sessions), 0)
+
+            await asyncio.sleep(0.1)
+            self.assertEqual(expired, [])
+
+        test_helper.sync(run())
+
+    def test_expire(self):
+        expired = []
+
+        async def run():
+            sessions = SessionRegistry(0.01, lambda user: asyncio.sleep(0, expired.append(user)))
+            user = User(None, "Bob")
+            token = sessions.issue(user)
+            sessions.park(user)
+            await asyncio.sleep(0.05)
+            return sessions, token, user
+
+        sessions, token, user = test_helper.sync(run())
+        self.assertEqual(expired, [user])
+        self.assertIsNone(sessions.resume(token))
+        self.assertFalse(sessions.is_parked("Bob"))
+
+    def test_discard(self):
+        sessions = SessionRegistry(30, None)
+        user = User(None, "Carol")
+        token = sessions.issue(user)
+        sessions.discard(user)
+        self.assertIsNone(sessions.resume(token))
+
+    def test_resume_request(self):
+        self.assertEqual(resume_request(None), (None, 0))
+        self.assertEqual(resume_request("/general"), (None, 0))
+        self.assertEqual(resume_request("/general?resume=abc&last=12"), ("abc", 12))
+        self.assertEqual(resume_request("/?resume=abc&last=x"), ("abc", 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+import asyncio
+import os
+import signal
+import sys
+import tempfile
+import time
+import test_helper
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../server')))
+from supervisor import Supervisor
+
+
+def crashing_worker(index, bus_path):
+    os._exit(1)
+
+
+def sleeping_worker(index, bus_path):
+    time.sleep(60)
+
+
+def stubborn_worker(index, bus_path):
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    time.sleep(60)
+
+
+class TestSupervisor(unittest.TestCase):
+
+    def run_supervisor(self, supervisor, duration):
+        async def run():
+            task = asyncio.ensure_future(supervisor.run())
+            await asyncio.sleep(duration)
+            supervisor.stop()
+            await task
+        test_helper.sync(run())
+
+    def test_restarts_crashed_workers(self):
+        with tempfile.TemporaryDirectory() as directory:
+            supervisor = Supervisor(crashing_worker, 2, os.path.join(directory, "bus.sock"), check_interval=0.05)
+            self.run_supervisor(supervisor, 0.5)
+            self.assertGreater(supervisor.restarts, 0)
+
+    def test_stop_terminates_workers(self):
+        with tempfile.TemporaryDirectory() as directory:
+            supervisor = Supervisor(sleeping_worker, 2, os.path.join(directory, "bus.sock"), check_interval=0.05)
+            self.run_supervisor(supervisor, 0.3)
+            self.assertEqual(supervisor.restarts, 0)
+            self.assertEqual(len(supervisor.processes), 2)
+            for process in supervisor.processes:
+                self.assertFalse(process.is_alive())
+
+    def test_kills_workers_after_shutdown_timeout(self):
+        with tempfile.TemporaryDirectory() as directory:
+            supervisor = Supervisor(stubborn_worker, 2, os.path.join(directory, "bus.sock"), check_interval=0.05,
+                                    shutdown_timeout=0.2)
+            start = time.monotonic()
+            self.run_supervisor(supervisor, 0.3)
+            self.assertLess(time.monotonic() - start, 5)
+            for process in supervisor.processes:
+                self.assertFalse(process.is_alive())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+import unittest
+import os
+import sys
+from string import Template
+import test_helper
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../server')))
+from templates import CompiledTemplate
+from chatroom import Chatroom
+
+
+class TestTemplates(unittest.TestCase):
+
+    def test_render_matches_template(self):
+        sources = ["$name has connected!", "\"$old\" -> \"${new}\"", "costs $$5 {not a field} $name", "no fields"]
+        for source in sources:
+            compiled = CompiledTemplate(source, ["name", "old", "new"])
+            values = {"name": "Rafi", "old": "a", "new": "b"}
+            self.assertEqual(compiled.render(**values), Template(source).substitute(**values))
+
+    def test_unknown_placeholder(self):
+        with self.assertRaises(ValueError):
+            CompiledTemplate("$nmae has connected!", ["name"])
+
+    def test_invalid_placeholder(self):
+        with self.assertRaises(ValueError):
+            CompiledTemplate("$ has connected!", ["name"])
+
+    def test_chatroom_fails_on_malformed_template(self):
+        config = test_helper.config_stream("../config/test_config/chat.yaml", conn_notif_temp="$nmae has connected!")
+        with self.assertRaises(ValueError):
+            Chatroom(config)
+
+
+if __name__ == '__main__':
+    unittest.main()
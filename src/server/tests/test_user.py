@@ -20,6 +20,17 @@ class TestUser(unittest.TestCase):
         self.assertIsNotNone(user.connected_at)
         self.assertEqual(user.name, name)
 
+    def test_compact_user(self):
+        user = User(Mwsc(), "Rafi")
+        self.assertFalse(hasattr(user, "__dict__"))
+        self.assertIsInstance(user.connected, int)
+        self.assertRegex(user.connected_at, r"^\d{4}-\d{2}-\d{2} \d{2}:\d{2}$")
+
+        # the uuid is created on first use and then kept
+        self.assertIsNone(user._uuid)
+        self.assertEqual(user.uuid, user.uuid)
+        self.assertNotEqual(user.uuid, User(Mwsc(), "Other").uuid)
+
 
 if __name__ == '__main__':
     unittest.main()
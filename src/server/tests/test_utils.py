@@ -0,0 +1,143 @@
+import unittest
+import asyncio
+import logging
+import os
+import sys
+import test_helper
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../server')))
+from utils import log, call_stats, reset_call_stats, start_eagerly
+
+
+class ReprCounter:
+
+    def __init__(self):
+        self.count = 0
+
+    def __repr__(self):
+        self.count += 1
+        return "<ReprCounter>"
+
+
+class ListHandler(logging.Handler):
+
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class TestUtils(unittest.TestCase):
+
+    def setUp(self):
+        # test_helper disables logging, re-enable it for these tests
+        self.disabled = logging.root.manager.disable
+        logging.disable(logging.NOTSET)
+        self.handler = ListHandler()
+        self.logger = logging.getLogger("test_utils")
+        self.logger.addHandler(self.handler)
+        self.logger.setLevel(logging.INFO)
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+        logging.disable(self.disabled)
+
+    def test_log_enabled(self):
+        @log(self.logger, logging.INFO)
+        def func(arg):
+            return arg
+
+        self.assertEqual(func(1), 1)
+        self.assertEqual(len(self.handler.messages), 1)
+        self.assertIn("func", self.handler.messages[0])
+
+    def test_log_redact(self):
+        @log(self.logger, logging.INFO, redact=("path",))
+        def func(websocket, name=None, path=None):
+            return path
+
+        self.assertEqual(func("ws", None, "/general?resume=secret&last=3"), "/general?resume=secret&last=3")
+        func("ws", path="/lobby?resume=secret")
+        func("ws", path=None)
+        self.assertEqual(len(self.handler.messages), 3)
+        self.assertFalse(any("secret" in message for message in self.handler.messages))
+        self.assertIn("/general?<redacted>", self.handler.messages[0])
+        self.assertIn("/lobby?<redacted>", self.handler.messages[1])
+
+    def test_log_disabled_level_skips_formatting(self):
+        @log(self.logger, logging.DEBUG)
+        def func(arg):
+            return arg
+
+        counter = ReprCounter()
+        func(counter)
+        self.assertEqual(counter.count, 0)
+        self.assertEqual(len(self.handler.messages), 0)
+
+    def test_log_sampling(self):
+        @log(self.logger, logging.INFO, sample_rate=0.0)
+        def never(arg):
+            return arg
+
+        counter = ReprCounter()
+        for _ in range(10):
+            never(counter)
+        self.assertEqual(counter.count, 0)
+        self.assertEqual(len(self.handler.messages), 0)
+
+    def test_hot_path(self):
+        @log(self.logger, hot_path=True)
+        def hot_sync():
+            return 1
+
+        @log(self.logger, hot_path=True)
+        async def hot_async():
+            return 2
+
+        reset_call_stats()
+        self.assertEqual(hot_sync(), 1)
+        self.assertEqual(test_helper.sync(hot_async()), 2)
+        self.assertEqual(test_helper.sync(hot_async()), 2)
+
+        self.assertEqual(call_stats[hot_sync.__qualname__].calls, 1)
+        self.assertEqual(call_stats[hot_async.__qualname__].calls, 2)
+        self.assertGreaterEqual(call_stats[hot_async.__qualname__].total_time, 0.0)
+        self.assertEqual(len(self.handler.messages), 0)
+
+    def test_start_eagerly(self):
+        steps = []
+
+        async def immediate():
+            steps.append("immediate")
+
+        async def waits(result):
+            steps.append("before")
+            await asyncio.sleep(0.01)
+            steps.append("after")
+            return result
+
+        async def fails():
+            raise ValueError("fails")
+
+        async def run():
+            self.assertIsNone(start_eagerly(immediate()))
+            task = start_eagerly(waits(3))
+            # ran up to its first wait before start_eagerly returned
+            self.assertEqual(steps, ["immediate", "before"])
+            self.assertEqual(await task, 3)
+            with self.assertRaises(ValueError):
+                start_eagerly(fails())
+
+            cancelled = start_eagerly(waits(4))
+            await asyncio.sleep(0)
+            cancelled.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await cancelled
+
+        test_helper.sync(run())
+        self.assertEqual(steps, ["immediate", "before", "after", "before"])
+
+
+if __name__ == '__main__':
+    unittest.main()